@@ -1,35 +1,210 @@
-import json
-import csv
 import argparse
+import csv
+import json
+import math
 import os
+from multiprocessing import Pool
+
+READ_SIZE = 1024 * 1024         # Characters of an export to read at a time
+RELATIVE_ACCURACY = 0.01        # Largest relative error of the duration percentiles
+PERCENTILES = (50, 90, 99)
+
+# Summary tables, each with the columns that it groups by.  Those by language count a job once for each of its
+# languages, with that language's share of its duration, and the others count each job once with its whole duration
+SUMMARIES = {
+    'user_month_language': ('Username', 'Month', 'LanguageCode'),
+    'user': ('Username',),
+    'month': ('Month',),
+    'language': ('LanguageCode',),
+}
+
+class DurationHistogram:
+    """
+    Job durations in logarithmic buckets, so that percentiles to within RELATIVE_ACCURACY can be found for any
+    number of jobs in a fixed amount of memory, and histograms from different files can be merged
+    """
+    gamma = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+
+    def __init__(self):
+        self.buckets = {}
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, duration):
+        bucket = math.ceil(math.log(duration, self.gamma)) if duration > 0 else None
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += duration
+
+    def merge(self, other):
+        for bucket, count in other.buckets.items():
+            self.buckets[bucket] = self.buckets.get(bucket, 0) + count
+        self.count += other.count
+        self.total += other.total
+
+    def percentile(self, percent):
+        rank = percent / 100 * (self.count - 1)
+        seen = 0
+        for bucket in sorted(self.buckets, key=lambda b: -math.inf if b is None else b):
+            seen += self.buckets[bucket]
+            if seen > rank:
+                return 0.0 if bucket is None else 2 * self.gamma ** bucket / (self.gamma + 1)
+        return 0.0
+
+def iter_json_array(json_file):
+    """
+    Steps through the items of a JSON array one at a time, so only one item is ever held in memory
+    """
+    decoder = json.JSONDecoder()
+    buffer = json_file.read(READ_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError(f'{json_file.name} is not a JSON array')
+    position = 1
+    while True:
+        # Skip to the next item, reading more of the file whenever the buffer runs out
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer):
+                break
+            buffer = json_file.read(READ_SIZE)
+            position = 0
+            if not buffer:
+                raise ValueError(f'{json_file.name} ends before its array does')
+        if buffer[position] == ']':
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            more = json_file.read(READ_SIZE)
+            if not more:
+                raise
+            buffer = buffer[position:] + more
+            position = 0
+            continue
+        yield item
+        position = end
+
+def language_durations(item):
+    # Logs Insights may export the parsed language list as a JSON string rather than as a list
+    languages = item['LanguageCodes']
+    if isinstance(languages, str):
+        languages = json.loads(languages)
+    for lang in languages:
+        yield lang['LanguageCode'], float(lang['DurationInSeconds'])
+
+def add_duration(totals, key, duration):
+    if key not in totals:
+        totals[key] = DurationHistogram()
+    totals[key].add(duration)
+
+def merge_totals(totals, other):
+    for key, histogram in other.items():
+        if key in totals:
+            totals[key].merge(histogram)
+        else:
+            totals[key] = histogram
 
 def flatten_json(input_file):
-    output_file = os.path.splitext(input_file)[0] + '.csv'
+    """
+    Writes a CSV row for every language of every job in a CloudWatch export, next to the export, and totals the
+    durations as it goes, both by language and by job
 
-    with open(input_file, 'r') as json_file:
-        data = json.load(json_file)
+    :return: Tuple of the CSV filename, the number of rows, a dictionary of (user, month, language) ->
+             DurationHistogram of each language's duration, and a dictionary of (user, month) ->
+             DurationHistogram of each job's total duration
+    """
+    output_file = os.path.splitext(input_file)[0] + '.csv'
+    language_totals = {}
+    job_totals = {}
+    rows = 0
 
-    with open(output_file, 'w', newline='') as csv_file:
+    with open(input_file, 'r') as json_file, open(output_file, 'w', newline='') as csv_file:
         writer = csv.writer(csv_file)
         writer.writerow(['Timestamp', 'TranscriptionJobName', 'Username', 'LanguageCode', 'DurationInSeconds'])
 
-        for item in data:
+        for item in iter_json_array(json_file):
             timestamp = item['Timestamp']
             job_name = item['TranscriptionJobName']
             username = job_name.split('_')[0].lower()
-            for lang in item['LanguageCodes']:
-                language_code = lang['LanguageCode']
-                duration = lang['DurationInSeconds']
+            month = timestamp[:7]
+            job_duration = 0.0
+            for language_code, duration in language_durations(item):
                 writer.writerow([timestamp, job_name, username, language_code, duration])
+                add_duration(language_totals, (username, month, language_code), duration)
+                job_duration += duration
+                rows += 1
+            add_duration(job_totals, (username, month), job_duration)
 
-    print(f'Data written to {output_file}.')
+    return output_file, rows, language_totals, job_totals
+
+def find_inputs(paths):
+    # Directories are searched for every CloudWatch export (.json) in them
+    inputs = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, _, filenames in sorted(os.walk(path)):
+                inputs.extend(os.path.join(folder, f) for f in sorted(filenames) if f.lower().endswith('.json'))
+        else:
+            inputs.append(path)
+    return inputs
+
+def write_summaries(language_totals, job_totals, output_dir):
+    """
+    Writes a summary CSV for each of SUMMARIES, with the job count, total and mean duration, and the duration
+    percentiles of each group
+    """
+    names = {'Username': 0, 'Month': 1, 'LanguageCode': 2}
+    outputs = []
+    for summary, columns in SUMMARIES.items():
+        totals = language_totals if 'LanguageCode' in columns else job_totals
+        groups = {}
+        for key, histogram in totals.items():
+            group = tuple(key[names[column]] for column in columns)
+            if group not in groups:
+                groups[group] = DurationHistogram()
+            groups[group].merge(histogram)
+
+        output_file = os.path.join(output_dir, f'summary_by_{summary}.csv')
+        with open(output_file, 'w', newline='') as csv_file:
+            writer = csv.writer(csv_file)
+            writer.writerow(list(columns) + ['Jobs', 'TotalDurationInSeconds', 'MeanDurationInSeconds'] +
+                            [f'P{percent}DurationInSeconds' for percent in PERCENTILES])
+            for group in sorted(groups):
+                histogram = groups[group]
+                writer.writerow(list(group) + [histogram.count, round(histogram.total, 2),
+                                               round(histogram.total / histogram.count, 2)] +
+                                [round(histogram.percentile(percent), 2) for percent in PERCENTILES])
+        outputs.append(output_file)
+    return outputs
 
 def main():
-    parser = argparse.ArgumentParser(description='Flatten an ATS CloudWatch logs file.')
-    parser.add_argument('input_file', help='The JSON file to flatten.')
+    parser = argparse.ArgumentParser(description='Flatten ATS CloudWatch logs files and summarise usage.')
+    parser.add_argument('inputs', nargs='+', metavar='input',
+                        help='The JSON files to flatten, or directories of them.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='Number of files to process at once.')
+    parser.add_argument('--summary-dir', default='.',
+                        help='Directory to write the summary tables to.')
     args = parser.parse_args()
 
-    flatten_json(args.input_file)
+    inputs = find_inputs(args.inputs)
+    if not inputs:
+        parser.error('no JSON files found')
+
+    # Each file is streamed by its own worker process, and only the totals come back to be merged
+    language_totals = {}
+    job_totals = {}
+    workers = max(1, min(args.workers, len(inputs)))
+    with Pool(workers) as pool:
+        for output_file, rows, file_language_totals, file_job_totals in pool.imap_unordered(flatten_json, inputs):
+            print(f'Data written to {output_file} ({rows} rows).')
+            merge_totals(language_totals, file_language_totals)
+            merge_totals(job_totals, file_job_totals)
+
+    for output_file in write_summaries(language_totals, job_totals, args.summary_dir):
+        print(f'Summary written to {output_file}.')
 
 if __name__ == '__main__':
     main()
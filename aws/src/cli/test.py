@@ -0,0 +1,88 @@
+import io
+import json
+import os
+import random
+import tempfile
+import unittest
+
+target = __import__("reports")
+
+def job(name, *languages):
+    return {"Timestamp": "2025-01-02 10:00:00.000", "TranscriptionJobName": name,
+            "LanguageCodes": [{"LanguageCode": code, "DurationInSeconds": str(duration)}
+                              for code, duration in languages]}
+
+class NamedStringIO(io.StringIO):
+    name = "export.json"
+
+class TestReports(unittest.TestCase):
+    def test_percentile_accuracy(self):
+        generator = random.Random(1)
+        durations = [generator.lognormvariate(5, 2) for _ in range(10000)]
+        histogram = target.DurationHistogram()
+        for duration in durations:
+            histogram.add(duration)
+        durations.sort()
+        for percent in (1, 50, 90, 99, 100):
+            exact = durations[int(percent / 100 * (len(durations) - 1))]
+            self.assertLessEqual(abs(histogram.percentile(percent) - exact) / exact, target.RELATIVE_ACCURACY)
+        self.assertAlmostEqual(histogram.total, sum(durations))
+
+        # Merged histograms give the same percentiles as one histogram of every duration
+        first, second = target.DurationHistogram(), target.DurationHistogram()
+        for i, duration in enumerate(durations):
+            (first if i % 2 else second).add(duration)
+        first.merge(second)
+        self.assertEqual([first.percentile(p) for p in (50, 99)], [histogram.percentile(p) for p in (50, 99)])
+        self.assertEqual(first.count, histogram.count)
+
+    def test_zero_durations(self):
+        histogram = target.DurationHistogram()
+        for duration in (0.0, 0.0, 10.0):
+            histogram.add(duration)
+        self.assertEqual(histogram.percentile(50), 0.0)
+        self.assertAlmostEqual(histogram.percentile(100), 10.0, delta=10.0 * target.RELATIVE_ACCURACY)
+
+    def test_iter_json_array_across_reads(self):
+        # An object with a string longer than a whole read is joined across the 1 MB boundary
+        items = [job("user_%d" % i, ("en-US", i * 1.25), ("es-US", 0)) for i in range(50)]
+        items[7]["Note"] = "x" * target.READ_SIZE
+        text = "[\n" + ",\n ".join(json.dumps(item) for item in items) + "\n]\n"
+        self.assertGreater(len(text), target.READ_SIZE)
+        self.assertEqual(list(target.iter_json_array(NamedStringIO(text))), items)
+
+        # Reads shorter than any item split every one of them, and the gaps between them
+        del items[7]["Note"]
+        text = "[\n" + ",\n ".join(json.dumps(item) for item in items) + "\n]\n"
+        read_size = target.READ_SIZE
+        try:
+            target.READ_SIZE = 7
+            self.assertEqual(list(target.iter_json_array(NamedStringIO(text))), items)
+            self.assertEqual(list(target.iter_json_array(NamedStringIO(" [ ] "))), [])
+            with self.assertRaises(ValueError):
+                list(target.iter_json_array(NamedStringIO('{"a": 1}')))
+            with self.assertRaises(ValueError):
+                list(target.iter_json_array(NamedStringIO(text[:-3])))
+            with self.assertRaises(ValueError):
+                list(target.iter_json_array(NamedStringIO('[{"a": 1}, {"a": ]')))
+        finally:
+            target.READ_SIZE = read_size
+
+    def test_summaries_count_jobs_once(self):
+        with tempfile.TemporaryDirectory() as folder:
+            export = os.path.join(folder, "export.json")
+            with open(export, "w") as f:
+                json.dump([job("jsmith_a", ("en-US", 60), ("es-US", 40)), job("jsmith_b", ("en-US", 30))], f)
+            output_file, rows, language_totals, job_totals = target.flatten_json(export)
+            self.assertEqual(rows, 3)
+            outputs = target.write_summaries(language_totals, job_totals, folder)
+            summaries = {}
+            for output in outputs:
+                with open(output) as f:
+                    summaries[os.path.basename(output)] = [line.split(",")[:4] for line in f.read().splitlines()[1:]]
+        self.assertEqual(summaries["summary_by_user.csv"], [["jsmith", "2", "130.0", "65.0"]])
+        self.assertEqual(summaries["summary_by_language.csv"], [["en-US", "2", "90.0", "45.0"],
+                                                                ["es-US", "1", "40.0", "40.0"]])
+
+if __name__ == '__main__':
+    unittest.main()
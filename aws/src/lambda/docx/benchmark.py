@@ -0,0 +1,351 @@
+"""
+Benchmark for transcribe_to_docx, using synthetic Amazon Transcribe output in each of the speaker, channel and
+audio-segments modes.  Each stage of the pipeline is timed separately, and run again under tracemalloc to find
+its peak memory, with the results written as JSON so that one version can be compared against another.
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --baseline before.json
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import sys
+import tracemalloc
+from datetime import datetime as dt
+from io import BytesIO
+from time import perf_counter
+
+import transcribe_to_docx as target
+
+# Version of the results file layout
+RESULTS_VERSION = 1
+
+# Diarization modes that the generator can produce
+MODE_SPEAKER = "speaker"
+MODE_CHANNEL = "channel"
+MODE_AUDIO_SEGMENTS = "audio"
+MODE_ARGUMENTS = {
+    MODE_SPEAKER: {"isSpeakerMode": True},
+    MODE_CHANNEL: {"isChannelMode": True},
+    MODE_AUDIO_SEGMENTS: {"isAudioSegmentsMode": True},
+}
+
+# Pipeline stages, in the order that they run
+STAGES = ("parse", "segmentation", "stats", "render", "save")
+
+# Slow-downs smaller than this many seconds are timer noise, and never reported as regressions
+NOISE_FLOOR = 0.02
+
+# Speaking rate and the pause that a speaker sometimes leaves mid-turn, which splits their speech segment
+WORDS_PER_MINUTE = 150
+LONG_PAUSE_RATE = 0.01
+
+# Small vocabularies, so that multi-language transcripts have recognisably different words
+VOCABULARY = {
+    "en-US": ("the", "and", "we", "think", "research", "students", "data", "really", "about", "interview",
+              "project", "because", "that's", "question", "yes", "so", "university", "maybe", "results", "time"),
+    "es-US": ("el", "la", "que", "y", "de", "estudiantes", "datos", "investigación", "entonces", "pregunta",
+              "sí", "porque", "tiempo", "proyecto", "universidad", "bueno", "resultados", "creo", "muy", "también"),
+    "fr-FR": ("le", "la", "et", "nous", "pensons", "étudiants", "données", "recherche", "alors", "question",
+              "oui", "parce", "temps", "projet", "université", "bien", "résultats", "peut-être", "très", "aussi"),
+    "de-DE": ("der", "die", "und", "wir", "denken", "Studierende", "Daten", "Forschung", "also", "Frage",
+              "ja", "weil", "Zeit", "Projekt", "Universität", "gut", "Ergebnisse", "vielleicht", "sehr", "auch"),
+}
+PUNCTUATION = (",", ",", ",", ".", ".", "?")
+
+def word_confidence(rng):
+    """
+    Picks a confidence score that is skewed towards the top of the range, as real transcripts are
+
+    :param rng: Random number generator
+    :return: Confidence as the string that Transcribe would write
+    """
+    return "{0:.3f}".format(min(1.0, rng.betavariate(8, 1.2)))
+
+def generate_turns(rng, duration, speakers, languages, redaction_rate, punctuation_rate):
+    """
+    Generates the conversation as a list of turns, each being one speaker talking in one language
+
+    :param rng: Random number generator
+    :param duration: Length of the recording in seconds
+    :param speakers: Number of speakers (or channels)
+    :param languages: List of language codes spoken in the recording
+    :param redaction_rate: Fraction of words that are redacted as PII
+    :param punctuation_rate: Fraction of words that are followed by punctuation
+    :return: List of (speaker index, language, items) tuples, with items in asrOutput.json form
+    """
+    turns = []
+    wordTime = 60.0 / WORDS_PER_MINUTE
+    time = round(rng.uniform(0.2, 1.5), 2)
+    speaker = 0
+    language = languages[0]
+    while time < duration:
+        items = []
+        vocabulary = VOCABULARY.get(language, VOCABULARY["en-US"])
+        for _ in range(max(1, int(rng.expovariate(1 / 18)))):
+            if rng.random() < LONG_PAUSE_RATE:
+                time += rng.uniform(2.5, 6.0)
+            length = rng.uniform(0.5, 1.3) * wordTime * 0.8
+            item = {"start_time": "{0:.3f}".format(time), "end_time": "{0:.3f}".format(time + length),
+                    "type": "pronunciation"}
+            time += length + rng.uniform(0.0, 0.2) * wordTime
+            if rng.random() < redaction_rate:
+                item["alternatives"] = [{"redactions": [{"confidence": word_confidence(rng), "type": "PII",
+                                                         "category": "NAME"}], "content": "[PII]"}]
+            else:
+                item["alternatives"] = [{"confidence": word_confidence(rng), "content": rng.choice(vocabulary)}]
+            if len(languages) > 1:
+                item["language_code"] = language
+            items.append(item)
+            if rng.random() < punctuation_rate:
+                items.append({"alternatives": [{"confidence": "0.0", "content": rng.choice(PUNCTUATION)}],
+                              "type": "punctuation"})
+            if time >= duration:
+                break
+        if items[-1]["type"] == "pronunciation":
+            items.append({"alternatives": [{"confidence": "0.0", "content": "."}], "type": "punctuation"})
+        turns.append((speaker, language, items))
+
+        # Hand over to someone else after a short gap, occasionally switching language
+        time += rng.uniform(0.2, 1.5)
+        if speakers > 1:
+            speaker = (speaker + rng.randrange(1, speakers)) % speakers
+        if len(languages) > 1 and rng.random() < 0.1:
+            language = rng.choice(languages)
+    return turns
+
+def generate_transcript(mode, duration, speakers=2, languages=("en-US",), redaction_rate=0.02,
+                        punctuation_rate=0.12, seed=0):
+    """
+    Generates a deterministic, realistic asrOutput.json structure for a recording
+
+    :param mode: One of "speaker", "channel" or "audio"
+    :param duration: Length of the recording in seconds
+    :param speakers: (optional) Number of speakers, or channels in channel mode
+    :param languages: (optional) Language codes spoken in the recording
+    :param redaction_rate: (optional) Fraction of words that are redacted as PII
+    :param punctuation_rate: (optional) Fraction of words that are followed by punctuation
+    :param seed: (optional) Seed for the random number generator
+    :return: Transcript structure, as json.load() would return it
+    """
+    rng = random.Random("{0}:{1}:{2}:{3}:{4}:{5}:{6}".format(mode, duration, speakers, ",".join(languages),
+                                                             redaction_rate, punctuation_rate, seed))
+    turns = generate_turns(rng, duration, speakers, list(languages), redaction_rate, punctuation_rate)
+    results = {"transcripts": [], "items": []}
+
+    # Items for the whole recording, with the labels that each mode adds
+    for speaker, language, items in turns:
+        for item in items:
+            if mode == MODE_SPEAKER and item["type"] == "pronunciation":
+                item["speaker_label"] = "spk_" + str(speaker)
+            elif mode == MODE_CHANNEL:
+                item["channel_label"] = "ch_" + str(speaker)
+            elif mode == MODE_AUDIO_SEGMENTS:
+                item["id"] = len(results["items"])
+            results["items"].append(item)
+
+    if mode == MODE_SPEAKER:
+        segments = []
+        for speaker, language, items in turns:
+            words = [item for item in items if item["type"] == "pronunciation"]
+            segments.append({"start_time": words[0]["start_time"], "end_time": words[-1]["end_time"],
+                             "speaker_label": "spk_" + str(speaker),
+                             "items": [{"speaker_label": "spk_" + str(speaker), "start_time": word["start_time"],
+                                        "end_time": word["end_time"]} for word in words]})
+        results["speaker_labels"] = {"speakers": speakers, "segments": segments}
+    elif mode == MODE_CHANNEL:
+        channels = [{"channel_label": "ch_" + str(channel), "items": []} for channel in range(speakers)]
+        for speaker, language, items in turns:
+            channels[speaker]["items"].extend(items)
+        results["channel_labels"] = {"number_of_channels": speakers, "channels": channels}
+    else:
+        segments = []
+        for speaker, language, items in turns:
+            words = [item for item in items if item["type"] == "pronunciation"]
+            segments.append({"id": len(segments), "transcript": turn_text(items),
+                             "start_time": words[0]["start_time"], "end_time": words[-1]["end_time"],
+                             "items": [item["id"] for item in items]})
+        results["audio_segments"] = segments
+
+    results["transcripts"].append({"transcript": " ".join(turn_text(items) for _, _, items in turns)})
+    if len(languages) > 1:
+        results["language_codes"] = [{"language_code": language, "duration_in_seconds": 0.0}
+                                     for language in languages]
+    return {"jobName": "benchmark-" + mode, "accountId": "123456789012", "status": "COMPLETED",
+            "results": results}
+
+def turn_text(items):
+    """
+    Builds the plain text of some items, as Transcribe does for its transcript fields
+
+    :param items: List of items in asrOutput.json form
+    :return: Text of the items
+    """
+    text = ""
+    for item in items:
+        content = item["alternatives"][0]["content"]
+        text += content if (item["type"] == "punctuation" or text == "") else " " + content
+    return text
+
+def run_pipeline(raw, mode, renderer, stage):
+    """
+    Runs the transcript through each stage of the docx pipeline
+
+    :param raw: Bytes of the asrOutput.json file
+    :param mode: One of "speaker", "channel" or "audio"
+    :param renderer: Document rendering engine
+    :param stage: Function taking a stage name and a callable, which runs the callable and returns its result
+    :return: Number of speech segments, number of words and size of the saved document in bytes
+    """
+    data = stage("parse", lambda: target.load_transcript(BytesIO(raw)))
+    speech_segments = stage("segmentation", lambda: target.create_turn_by_turn_segments(data, **MODE_ARGUMENTS[mode]))
+    stats = stage("stats", lambda: target.generate_confidence_stats(speech_segments))
+    document, styleIds = stage("render", lambda: target.build_document(data, speech_segments, None, stats, renderer))
+    output = BytesIO()
+    stage("save", lambda: target.save_document(document, speech_segments, output, styleIds))
+    return len(speech_segments), stats.wordCount, len(output.getvalue())
+
+def benchmark_case(mode, duration, renderer, speakers, languages, redaction_rate, punctuation_rate, repeat,
+                   memory):
+    """
+    Benchmarks one combination of recording and renderer
+
+    :return: Result dictionary for the case
+    """
+    transcript = generate_transcript(mode, duration, speakers, languages, redaction_rate, punctuation_rate)
+    raw = json.dumps(transcript).encode("utf-8")
+    del transcript
+
+    # Time each stage, keeping the best of the repeated runs
+    timings = {}
+    def timed(name, function):
+        start = perf_counter()
+        result = function()
+        elapsed = perf_counter() - start
+        timings[name] = min(timings.get(name, elapsed), elapsed)
+        return result
+    for _ in range(repeat):
+        segments, words, documentSize = run_pipeline(raw, mode, renderer, timed)
+
+    # Then find each stage's peak memory in a separate run, as tracing distorts the timings
+    peaks = {}
+    def traced(name, function):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        result = function()
+        peaks[name] = tracemalloc.get_traced_memory()[1] - before
+        return result
+    if memory:
+        tracemalloc.start()
+        run_pipeline(raw, mode, renderer, traced)
+        tracemalloc.stop()
+
+    return {"name": "{0}-{1}m-{2}".format(mode, int(duration / 60), renderer), "mode": mode, "duration": duration,
+            "renderer": renderer, "speakers": speakers, "languages": list(languages),
+            "redactionRate": redaction_rate, "punctuationRate": punctuation_rate, "transcriptBytes": len(raw),
+            "segments": segments, "words": words, "documentBytes": documentSize,
+            "timings": {name: round(timings[name], 4) for name in STAGES},
+            "total": round(sum(timings.values()), 4),
+            "peakMemory": peaks}
+
+def case_key(case):
+    """
+    Identifies a case by all of the parameters that it was generated and rendered with
+
+    :param case: Result dictionary for the case
+    :return: Tuple of the case's parameters
+    """
+    return (case["mode"], case["duration"], case["renderer"], case["speakers"], tuple(case["languages"]),
+            case["redactionRate"], case["punctuationRate"])
+
+def compare_results(results, baseline, tolerance):
+    """
+    Prints each case's stage timings against a baseline results file
+
+    :param results: Results dictionary for this run
+    :param baseline: Results dictionary from an earlier run
+    :param tolerance: Fractional slow-down that is reported as a regression, if also larger than NOISE_FLOOR
+    :return: List of regressions, as (case name, stage, baseline seconds, seconds) tuples
+    """
+    regressions = []
+    baselineCases = {case_key(case): case for case in baseline["results"]}
+    for case in results["results"]:
+        if case_key(case) not in baselineCases:
+            print("{0}: not in baseline".format(case["name"]))
+            continue
+        previous = baselineCases[case_key(case)]
+        for name in STAGES + ("total",):
+            before = previous["timings"].get(name) if name != "total" else previous["total"]
+            after = case["timings"][name] if name != "total" else case["total"]
+            if not before:
+                continue
+            change = (after - before) / before
+            flag = ""
+            if change > tolerance and after - before > NOISE_FLOOR:
+                flag = "  << REGRESSION"
+                regressions.append((case["name"], name, before, after))
+            print("{0:28} {1:13} {2:9.4f}s -> {3:9.4f}s {4:+7.1%}{5}".format(case["name"], name, before, after,
+                                                                           change, flag))
+    return regressions
+
+def main():
+    """
+    Entrypoint for the command-line interface.
+    """
+    cli_parser = argparse.ArgumentParser(prog='benchmark',
+                                         description='Benchmark transcribe_to_docx with synthetic Transcribe output')
+    cli_parser.add_argument('--modes', nargs='+', choices=list(MODE_ARGUMENTS), default=list(MODE_ARGUMENTS),
+                            help='Diarization modes to generate')
+    cli_parser.add_argument('--durations', nargs='+', type=float, default=[10, 60, 600], metavar='minutes',
+                            help='Recording lengths in minutes')
+    cli_parser.add_argument('--renderers', nargs='+', default=[target.RENDERER_PYTHON_DOCX, target.RENDERER_STREAM],
+                            choices=[target.RENDERER_PYTHON_DOCX, target.RENDERER_STREAM], help='Renderers to time')
+    cli_parser.add_argument('--speakers', type=int, default=2, help='Number of speakers, or channels')
+    cli_parser.add_argument('--languages', nargs='+', default=["en-US"], help='Language codes spoken')
+    cli_parser.add_argument('--redaction', type=float, default=0.02, help='Fraction of words redacted as PII')
+    cli_parser.add_argument('--punctuation', type=float, default=0.12, help='Fraction of words followed by punctuation')
+    cli_parser.add_argument('--repeat', type=int, default=1, help='Runs per case, keeping the fastest time per stage')
+    cli_parser.add_argument('--no-memory', dest='memory', action='store_false', help='Skip the peak memory run')
+    cli_parser.add_argument('--output', metavar='filename', type=str, help='File to write the JSON results to')
+    cli_parser.add_argument('--baseline', metavar='filename', type=str, help='Earlier JSON results to compare with')
+    cli_parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Fractional slow-down against the baseline that counts as a regression')
+    cli_args = cli_parser.parse_args()
+
+    results = {"version": RESULTS_VERSION, "created": dt.now().isoformat(timespec="seconds"),
+               "python": platform.python_version(), "platform": platform.platform(), "results": []}
+    # The Lambda builds its base document during the init phase, so keep that out of the first render
+    target.get_base_document()
+    for mode in cli_args.modes:
+        for minutes in cli_args.durations:
+            for renderer in cli_args.renderers:
+                case = benchmark_case(mode, minutes * 60, renderer, cli_args.speakers, cli_args.languages,
+                                      cli_args.redaction, cli_args.punctuation, cli_args.repeat, cli_args.memory)
+                results["results"].append(case)
+                print("{0:28} {1:7} words  {2}  total {3:.3f}s".format(
+                    case["name"], case["words"],
+                    "  ".join("{0} {1:.3f}s".format(name, case["timings"][name]) for name in STAGES),
+                    case["total"]))
+
+    # Peak resident memory of the whole run, which Linux reports in KiB and macOS in bytes
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    results["maxRSS"] = maxrss if sys.platform == "darwin" else maxrss * 1024
+
+    if cli_args.output is not None:
+        with open(cli_args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print("> Results written to " + cli_args.output)
+
+    if cli_args.baseline is not None:
+        with open(cli_args.baseline) as f:
+            regressions = compare_results(results, json.load(f), cli_args.tolerance)
+        if len(regressions) > 0:
+            print("FAIL: {0} stage(s) slower than the baseline by more than {1:.0%}".format(len(regressions),
+                                                                                          cli_args.tolerance))
+            exit(1)
+
+# Main entrypoint
+if __name__ == "__main__":
+    main()
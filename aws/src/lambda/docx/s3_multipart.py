@@ -0,0 +1,121 @@
+"""
+Streaming S3 upload shared by the docx and export Lambdas.  The export Lambda's package takes this file from the
+docx folder, so there is only one copy to maintain
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+UPLOAD_PART_SIZE = 8 * 1024 * 1024  # Bytes per S3 multipart upload part (S3 needs at least 5MiB, bar the last part)
+UPLOAD_THREADS = 4                  # Parts of an object that can be uploading to S3 at once
+
+class S3MultipartWriter:
+    """
+    Writable file-like object that uploads straight to S3 as it is written, so that a document or export can be
+    saved without touching local disk or being held in memory.  Whenever a full part has been written it is handed
+    to a background thread to upload while the writer carries on, so the upload is under way before the output is
+    complete.  Output that never fills a part is sent with a single put_object call instead
+    """
+
+    def __init__(self, client, bucket, key, part_size=UPLOAD_PART_SIZE, threads=UPLOAD_THREADS, metadata=None,
+                 content_type=None):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.objectArgs = {"Metadata": metadata or {}}
+        if content_type is not None:
+            self.objectArgs["ContentType"] = content_type
+        self.partSize = part_size
+        self.threads = threads
+        self.buffer = bytearray()
+        self.position = 0
+        self.uploadId = None
+        self.executor = None
+        self.pending = []       # Futures for the parts that have been started, in part number order
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        # ZipFile only needs the position to build the central directory, which is why it never seeks
+        return self.position
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        """
+        Appends data to the current part, starting the upload of each part as soon as it is full
+
+        :param data: Bytes-like object to write
+        :return: Number of bytes written
+        """
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= self.partSize:
+            part = bytes(self.buffer[:self.partSize])
+            del self.buffer[:self.partSize]
+            self.upload_part(part)
+        return len(data)
+
+    def upload_part(self, part):
+        """
+        Starts uploading a part in the background, waiting for the oldest outstanding one if enough are
+        already in flight that another would only grow the memory held by the writer
+
+        :param part: Bytes of the next part
+        """
+        if self.uploadId is None:
+            self.uploadId = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.key,
+                                                                **self.objectArgs)["UploadId"]
+            self.executor = ThreadPoolExecutor(max_workers=self.threads)
+        inFlight = [future for future in self.pending if not future.done()]
+        if len(inFlight) >= self.threads:
+            inFlight[0].result()
+        partNumber = len(self.pending) + 1
+        self.pending.append(self.executor.submit(self.client.upload_part, Bucket=self.bucket, Key=self.key,
+                                                 UploadId=self.uploadId, PartNumber=partNumber, Body=part))
+
+    def close(self):
+        """
+        Uploads whatever is left and completes the object, aborting the multipart upload if that fails
+        """
+        if self.closed:
+            return
+        self.closed = True
+        if self.uploadId is None:
+            self.client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self.buffer), **self.objectArgs)
+            return
+
+        try:
+            if len(self.buffer) > 0:
+                self.upload_part(bytes(self.buffer))
+            parts = [{"ETag": future.result()["ETag"], "PartNumber": partNumber}
+                     for partNumber, future in enumerate(self.pending, start=1)]
+            self.client.complete_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.uploadId,
+                                                  MultipartUpload={"Parts": parts})
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self.executor.shutdown()
+            self.buffer = bytearray()
+
+    def abort(self):
+        """
+        Abandons the upload, so that S3 neither creates the object nor keeps any parts already sent
+        """
+        self.closed = True
+        self.buffer = bytearray()
+        if self.uploadId is not None:
+            self.executor.shutdown(cancel_futures=True)
+            self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.uploadId)
+            self.uploadId = None
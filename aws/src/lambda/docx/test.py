@@ -1,7 +1,55 @@
+import contextlib
+import io
+import json
+import os
+import tempfile
 import unittest
+from io import BytesIO
+from zipfile import ZipFile
 
 target = __import__("transcribe_to_docx")
 
+HANDLER_TRANSCRIPT = json.dumps({"jobName": "test-job", "results": {
+    "speaker_labels": {"segments": [{"start_time": "0.0", "end_time": "0.5", "speaker_label": "spk_0",
+                                     "items": [{"start_time": "0.0", "end_time": "0.5"}]}]},
+    "items": [{"type": "pronunciation", "start_time": "0.0", "end_time": "0.5",
+               "alternatives": [{"confidence": "0.9", "content": "Hello"}]}]}}).encode("utf-8")
+
+class FakeTranscribe:
+    def get_transcription_job(self, TranscriptionJobName):
+        return {"TranscriptionJob": {
+            "TranscriptionJobName": TranscriptionJobName, "LanguageCode": "en-US",
+            "CreationTime": target.dt(2025, 1, 2), "Settings": {"ShowSpeakerLabels": True},
+            "Media": {"MediaFileUri": "s3://upload/audio.mp3"},
+            "Transcript": {"TranscriptFileUri": "https://s3.us-east-1.amazonaws.com/output/test-job.json"}}}
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.metadata = {}
+        self.content_types = {}
+        self.deleted = []
+        self.downloads = 0
+        self.etag = '"transcript-etag"'
+        self.failing = ()               # Key extensions whose uploads fail
+    def get_object(self, Bucket, Key):
+        self.downloads += 1
+        return {"Body": BytesIO(HANDLER_TRANSCRIPT)}
+    def head_object(self, Bucket, Key):
+        if Bucket == "output":
+            return {"ETag": self.etag, "Metadata": {}}
+        if Key not in self.objects:
+            raise KeyError(Key)
+        return {"ETag": '"docx"', "Metadata": self.metadata[Key]}
+    def put_object(self, Bucket, Key, Body, Metadata, ContentType=None):
+        if Key.endswith(self.failing):
+            raise ConnectionError(Key)
+        self.objects[Key] = Body
+        self.metadata[Key] = Metadata
+        self.content_types[Key] = ContentType
+    def delete_object(self, Bucket, Key):
+        self.deleted.append(Bucket + "/" + Key)
+
 class TestSum(unittest.TestCase):
     def test_find_bucket_key_url(self):
         data = 'https://s3.region-code.amazonaws.com/bucket-name/key-name'
@@ -30,5 +78,389 @@ class TestSum(unittest.TestCase):
         self.assertEqual(target.convert_timestamp(0), '00:00:00')
         self.assertEqual(target.convert_timestamp(10000), '02:46:40')
 
+    def test_speaker_mode_segments(self):
+        data = {"results": {
+            "speaker_labels": {"segments": [
+                {"start_time": "0.0", "end_time": "1.0", "speaker_label": "spk_0", "items": [
+                    {"start_time": "0.0", "end_time": "0.5", "speaker_label": "spk_0"},
+                    {"start_time": "0.5", "end_time": "1.0", "speaker_label": "spk_0"}]},
+                {"start_time": "1.2", "end_time": "1.5", "speaker_label": "spk_1", "items": [
+                    {"start_time": "1.2", "end_time": "1.5", "speaker_label": "spk_1"}]}]},
+            "items": [
+                {"type": "pronunciation", "start_time": "0.0", "end_time": "0.5",
+                 "alternatives": [{"confidence": "0.4", "content": "Hi"}, {"confidence": "0.9", "content": "Hello"}]},
+                {"type": "pronunciation", "start_time": "0.5", "end_time": "1.0",
+                 "alternatives": [{"content": "[PII]", "redactions": [{"confidence": "0.75"}]}]},
+                {"type": "punctuation", "alternatives": [{"confidence": "0.0", "content": "."}]},
+                {"type": "pronunciation", "start_time": "1.2", "end_time": "1.5",
+                 "alternatives": [{"confidence": "0.99", "content": "Yes"}]}]}}
+        segments = target.create_turn_by_turn_segments(data, isSpeakerMode=True)
+        self.assertEqual(len(segments), 2)
+        self.assertEqual(segments[0].segmentText, "Hello [PII].")
+        self.assertEqual([word[1] for word in segments[0].iter_words()], [0.9, 0.75])
+        self.assertEqual(segments[1].segmentSpeaker, "spk_1")
+        self.assertEqual(segments[1].segmentText, "Yes")
+
+    def test_channel_mode_segments(self):
+        def word(start, end, content):
+            return {"type": "pronunciation", "start_time": start, "end_time": end,
+                    "alternatives": [{"confidence": "0.9", "content": content}]}
+        data = {"results": {"channel_labels": {"channels": [
+            {"channel_label": "ch_0", "items": [word("0.0", "0.5", "One"), word("3.0", "3.5", "four")]},
+            {"channel_label": "ch_1", "items": [
+                word("1.0", "1.5", "Two"),
+                {"type": "punctuation", "alternatives": [{"confidence": "0.0", "content": ","}]},
+                word("2.0", "2.2", "three")]}]}}}
+        segments = target.create_turn_by_turn_segments(data, isChannelMode=True)
+        self.assertEqual([s.segmentSpeaker for s in segments], ["ch_0", "ch_1", "ch_0"])
+        self.assertEqual(segments[1].segmentText, "Two, three")
+        self.assertEqual(segments[1].segmentEndTime, 2.2)
+        self.assertEqual(segments[2].segmentText, "four")
+
+    def test_write_transcribe_text_coalesces_runs(self):
+        segment = target.SpeechSegment()
+        segment.segmentSpeaker = "spk_0"
+        segment.add_word("Sure", 0.99, 0.0, 0.2)
+        segment.add_word("thing", 0.95, 0.2, 0.4)
+        segment.add_word("maybe", 0.5, 0.4, 0.6)
+        segment.add_word("[PII]", 0.0, 0.6, 0.8)
+        document = target.Document()
+        target.write_transcribe_text(document, [segment])
+        runs = document.paragraphs[-1].runs
+        self.assertEqual([run.text for run in runs], ["[00:00:00] Speaker 1: ", "Sure thing", " maybe", " [PII]"])
+        self.assertEqual([run.style.name for run in runs[1:]],
+                         [target.STYLE_CONFIDENT, target.STYLE_LOW_CONFIDENCE, target.STYLE_NO_CONFIDENCE])
+        self.assertTrue(runs[3].style.font.bold)
+
+    def test_stream_renderer_matches_python_docx(self):
+        segment = target.SpeechSegment()
+        segment.segmentSpeaker = "spk_0"
+        segment.segmentEndTime = 0.4
+        segment.add_word("Fish", 0.99, 0.0, 0.2)
+        segment.add_word("&", 0.5, 0.2, 0.3)
+        segment.add_word("chips", 0.5, 0.3, 0.4)
+        data = {"jobName": "test-job", "results": {"speaker_labels": {"segments": []}}}
+        documents = {}
+        for renderer in (target.RENDERER_PYTHON_DOCX, target.RENDERER_STREAM):
+            output = BytesIO()
+            target.write(data, [segment], None, output, renderer=renderer)
+            documents[renderer] = ZipFile(output).read("word/document.xml")
+        self.assertEqual(documents[target.RENDERER_PYTHON_DOCX], documents[target.RENDERER_STREAM])
+        self.assertNotIn(target.TRANSCRIPT_PLACEHOLDER.encode(), documents[target.RENDERER_STREAM])
+
+    def test_load_transcript(self):
+        data = {"jobName": "test-job", "status": "COMPLETED", "results": {
+            "transcripts": [{"transcript": "Caf\u00e9 \"quoted\" [text]"}],
+            "channel_labels": {"number_of_channels": 1, "channels": [{"channel_label": "ch_0", "items": [
+                {"type": "pronunciation", "start_time": "0.0", "end_time": "0.5",
+                 "alternatives": [{"confidence": "0.9", "content": "Caf\u00e9"}]}]}]},
+            "items": [{"type": "punctuation", "alternatives": [{"confidence": "0.0", "content": "."}]}]}}
+        raw = json.dumps(data, indent=1).encode("utf-8")
+        expected = json.loads(raw)
+        expected["results"]["transcripts"] = []
+        self.assertEqual(target.load_transcript(BytesIO(raw)), expected)
+        reader = target.JsonStreamReader(BytesIO(raw), read_size=3)
+        keys = []
+        for key in reader.iter_object():
+            keys.append(key)
+            reader.skip_value()
+        self.assertEqual(keys, ["jobName", "status", "results"])
+
+    def test_get_json_download_failure(self):
+        def failing_urlopen(url):
+            raise ConnectionError(url)
+        opener = target.urlopen
+        try:
+            target.urlopen = failing_urlopen
+            with contextlib.redirect_stdout(io.StringIO()), self.assertRaises(ConnectionError):
+                target.get_json("https://s3.us-east-1.amazonaws.com/output/test-job.json?X-Amz-Signature=x")
+        finally:
+            target.urlopen = opener
+
+    def test_audio_segments_share_transcript_words(self):
+        def word(start, end, content):
+            return {"type": "pronunciation", "start_time": start, "end_time": end,
+                    "alternatives": [{"confidence": "0.9", "content": content}]}
+        data = {"results": {
+            "items": [word("0.0", "0.5", "One"), {"type": "punctuation", "alternatives": [{"content": "."}]},
+                      word("1.0", "1.5", "Two"), word("9.0", "9.5", "Three")],
+            "audio_segments": [
+                {"start_time": "0.0", "end_time": "0.5", "transcript": "One.", "items": [0, 1]},
+                {"start_time": "1.0", "end_time": "1.5", "transcript": "Two", "items": [2]},
+                {"start_time": "9.0", "end_time": "9.5", "transcript": "Three", "items": [3]}]}}
+        segments = target.create_turn_by_turn_segments(data, isAudioSegmentsMode=True)
+        self.assertEqual([s.segmentText for s in segments], ["One. Two", "Three"])
+        self.assertIs(segments[0].words, segments[1].words)
+        self.assertEqual((segments[1].wordStart, segments[1].wordEnd), (2, 3))
+        self.assertEqual(list(segments[1].words.startTime), [0.0, 1.0, 9.0])
+
+    def test_transcript_stats(self):
+        first = target.SpeechSegment()
+        first.segmentSpeaker, first.segmentStartTime, first.segmentEndTime = "spk_0", 0.0, 2.0
+        for confidence in (1.0, 0.98, 0.97, 0.1):
+            first.add_word("word", confidence, 0.0, 0.5)
+        second = target.SpeechSegment()
+        second.segmentSpeaker, second.segmentStartTime, second.segmentEndTime = "spk_1", 3.0, 4.5
+        for confidence in (0.09, 0.0):
+            second.add_word("word", confidence, 3.0, 3.5)
+        stats = target.TranscriptStats()
+        stats.add_segment(first)
+        stats.add_segment(second)
+        self.assertEqual(stats.histogram, [2, 1, 0, 0, 0, 0, 0, 0, 0, 1, 2])
+        self.assertEqual(stats.wordCount, 6)
+        self.assertEqual(round(stats.averageConfidence, 2), 52.33)
+        self.assertEqual(stats.speakers, {"spk_0": [2.0, 4], "spk_1": [1.5, 2]})
+        self.assertEqual(stats.duration, 4.5)
+
+    def test_audio_segments_redacted_word(self):
+        data = {"results": {
+            "items": [{"type": "pronunciation", "start_time": "0.0", "end_time": "0.5", "alternatives": [
+                {"content": "[PII]", "redactions": [{"confidence": "0.8", "type": "PII", "category": "NAME"}]}]}],
+            "audio_segments": [{"start_time": "0.0", "end_time": "0.5", "transcript": "[PII]", "items": [0]}]}}
+        segments = target.create_turn_by_turn_segments(data, isAudioSegmentsMode=True)
+        self.assertEqual([word[:2] for word in segments[0].iter_words()], [("[PII]", 0.8)])
+
+    def run_lambda_handler(self, s3):
+        clients = dict(target.aws_clients)
+        environ = dict(os.environ)
+        try:
+            target.aws_clients.update({"s3": s3, "transcribe": FakeTranscribe()})
+            os.environ.update({"BUCKET": "download", "DOCX_MAX_DURATION": "3600"})
+            log = io.StringIO()
+            with contextlib.redirect_stdout(log):
+                response = target.lambda_handler({"detail": {"TranscriptionJobStatus": "COMPLETED",
+                                                             "TranscriptionJobName": "test-job"}}, None)
+        finally:
+            target.aws_clients.clear()
+            target.aws_clients.update(clients)
+            os.environ.clear()
+            os.environ.update(environ)
+        return response, log.getvalue()
+
+    def test_lambda_handler_metrics(self):
+        s3 = FakeS3()
+        response, log = self.run_lambda_handler(s3)
+        self.assertEqual(response["statusCode"], 200)
+        self.assertEqual(s3.deleted, ["upload/audio.mp3"])
+        self.assertEqual(list(s3.objects), [target.today + "/test-job.atsx", target.today + "/test-job.docx"])
+        self.assertEqual(response["body"]["sidecar"], "s3://download/" + target.today + "/test-job.atsx")
+        metrics = response["body"]["metrics"]
+        self.assertEqual((metrics["TranscriptBytes"], metrics["Words"], metrics["Segments"]),
+                         (len(HANDLER_TRANSCRIPT), 1, 1))
+        self.assertEqual(set(metrics), set(target.METRIC_UNITS))
+        emf = [json.loads(line) for line in log.splitlines() if line.startswith('{"_aws"')]
+        self.assertEqual(len(emf), 1)
+        self.assertEqual(emf[0]["JobName"], "test-job")
+        self.assertEqual(len(emf[0]["_aws"]["CloudWatchMetrics"][0]["Metrics"]), len(target.METRIC_UNITS))
+
+    def test_lambda_handler_exports(self):
+        s3 = FakeS3()
+        formats = target.export_formats_env
+        try:
+            target.export_formats_env = "srt, csv"
+            response, _ = self.run_lambda_handler(s3)
+        finally:
+            target.export_formats_env = formats
+        prefix = target.today + "/test-job"
+        self.assertEqual(response["body"]["artifacts"], {"docx": "s3://download/" + prefix + ".docx",
+                                                         "sidecar": "s3://download/" + prefix + ".atsx",
+                                                         "srt": "s3://download/" + prefix + ".srt",
+                                                         "csv": "s3://download/" + prefix + ".csv"})
+        self.assertEqual(s3.objects[prefix + ".srt"], b"1\n00:00:00,000 --> 00:00:00,500\nSpeaker 1: Hello\n\n")
+        self.assertEqual(s3.content_types[prefix + ".csv"], target.EXPORT_CONTENT_TYPES["csv"])
+
+    def test_release_admission_slot(self):
+        class FakeDynamoDB:
+            def __init__(self):
+                self.markers = {"job#test-job"}
+                self.in_flight = 3
+            def transact_write_items(self, TransactItems):
+                marker = TransactItems[0]["Delete"]["Key"]["SK"]["S"]
+                if marker not in self.markers:
+                    raise RuntimeError("TransactionCanceledException")
+                self.markers.remove(marker)
+                self.in_flight -= 1
+
+        dynamodb = FakeDynamoDB()
+        clients = dict(target.aws_clients)
+        table = target.admission_table_env
+        try:
+            target.aws_clients["dynamodb"] = dynamodb
+            target.admission_table_env = "jobs"
+            with contextlib.redirect_stdout(io.StringIO()):
+                self.assertTrue(target.release_admission_slot("test-job"))
+                self.assertFalse(target.release_admission_slot("test-job"))
+        finally:
+            target.aws_clients.clear()
+            target.aws_clients.update(clients)
+            target.admission_table_env = table
+        self.assertEqual(dynamodb.in_flight, 2)
+
+    def test_lambda_handler_render_cache(self):
+        s3 = FakeS3()
+        first, _ = self.run_lambda_handler(s3)
+        self.assertEqual(s3.downloads, 1)
+        second, _ = self.run_lambda_handler(s3)
+        self.assertEqual(s3.downloads, 1)
+        self.assertEqual(second["body"]["metrics"]["CacheHit"], 1)
+        for field in ("duration", "languages", "confidence", "words", "speakers", "s3uri", "upload", "artifacts"):
+            self.assertEqual(second["body"][field], first["body"][field])
+
+        # A new transcript is rendered again
+        s3.etag = '"changed"'
+        third, _ = self.run_lambda_handler(s3)
+        self.assertEqual((s3.downloads, third["body"]["metrics"]["CacheHit"]), (2, 0))
+
+        # Only the artifacts that were saved are returned from the cache
+        s3 = FakeS3()
+        s3.failing = (target.SIDECAR_EXTENSION,)
+        first, _ = self.run_lambda_handler(s3)
+        second, _ = self.run_lambda_handler(s3)
+        self.assertEqual(second["body"]["metrics"]["CacheHit"], 1)
+        self.assertEqual(second["body"]["artifacts"], first["body"]["artifacts"])
+        self.assertEqual(list(second["body"]["artifacts"]), ["docx"])
+        self.assertIsNone(second["body"]["sidecar"])
+
+    def test_s3_multipart_writer(self):
+        class FakeS3:
+            def __init__(self):
+                self.calls = []
+                self.parts = {}
+            def create_multipart_upload(self, Bucket, Key, Metadata):
+                self.calls.append("create")
+                return {"UploadId": "upload-1"}
+            def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+                self.parts[PartNumber] = Body
+                return {"ETag": "etag-" + str(PartNumber)}
+            def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+                self.calls.append("complete")
+                self.body = b"".join(self.parts[part["PartNumber"]] for part in MultipartUpload["Parts"])
+            def put_object(self, Bucket, Key, Body, Metadata):
+                self.calls.append("put")
+                self.body = Body
+            def abort_multipart_upload(self, Bucket, Key, UploadId):
+                self.calls.append("abort")
+
+        client = FakeS3()
+        with target.S3MultipartWriter(client, "bucket", "key", part_size=4) as output:
+            output.write(b"0123456789")
+            self.assertEqual(output.tell(), 10)
+        self.assertEqual(client.calls, ["create", "complete"])
+        self.assertEqual(client.body, b"0123456789")
+        self.assertEqual(client.parts[3], b"89")
+
+        client = FakeS3()
+        with target.S3MultipartWriter(client, "bucket", "key") as output:
+            output.write(b"small")
+        self.assertEqual((client.calls, client.body), (["put"], b"small"))
+
+        client = FakeS3()
+        with self.assertRaises(ValueError), target.S3MultipartWriter(client, "bucket", "key", part_size=4) as output:
+            output.write(b"0123456789")
+            raise ValueError("render failed")
+        self.assertEqual(client.calls, ["create", "abort"])
+
+    def test_site_template(self):
+        site = target.Document()
+        site.styles[target.TABLE_STYLE_STANDARD].element.getparent().remove(site.styles[target.TABLE_STYLE_STANDARD].element)
+        site.styles.add_style(target.CUSTOM_STYLE_HEADER, target.WD_STYLE_TYPE.PARAGRAPH).font.name = "Georgia"
+        site.add_paragraph("Site letterhead")
+        self.assertNotIn(target.TABLE_STYLE_STANDARD, site.styles)
+        with tempfile.TemporaryDirectory() as folder:
+            template = os.path.join(folder, "site.docx")
+            site.save(template)
+            base = target.get_base_document(template)
+            self.assertIs(target.get_base_document(template), base)
+            output = BytesIO()
+            target.write({"jobName": "test-job", "results": {"speaker_labels": {"segments": []}}}, [], None, output,
+                         template=template)
+        document = target.Document(output)
+        self.assertEqual(document.paragraphs[0].text, "Site letterhead")
+        self.assertEqual(document.styles[target.CUSTOM_STYLE_HEADER].font.name, "Georgia")
+        self.assertEqual(document.tables[0].style.name, target.TABLE_STYLE_STANDARD)
+        self.assertEqual(document.tables[0].rows[0].cells[1].text, "test-job")
+
+    def test_write_exports(self):
+        words = target.TranscriptWords()
+        segment = target.SpeechSegment(words)
+        segment.segmentSpeaker = "spk_0"
+        for number in range(20):
+            segment.add_word("w" + str(number), 0.5, number * 0.5, number * 0.5 + 0.4)
+        segment.add_word("<end>", 0.9, 10.0, 10.5)
+        outputs = {name: BytesIO() for name in ("txt", "vtt", "csv")}
+        target.write_exports([segment], outputs)
+        self.assertEqual(outputs["txt"].getvalue().decode("utf-8"), "[00:00:00] Speaker 1: " + segment.segmentText + "\n")
+        vtt = outputs["vtt"].getvalue().decode("utf-8").split("\n\n")
+        self.assertEqual(vtt[0], "WEBVTT")
+        self.assertEqual(vtt[1].split("\n")[0], "00:00:00.000 --> 00:00:06.900")
+        self.assertEqual(vtt[2], "00:00:07.000 --> 00:00:10.500\n<v Speaker 1>w14 w15 w16 w17 w18 w19 &lt;end&gt;")
+        rows = outputs["csv"].getvalue().decode("utf-8").splitlines()
+        self.assertEqual(rows[0], "Segment,Speaker,StartTime,EndTime,Confidence,Word")
+        self.assertEqual(rows[1], "1,Speaker 1,0.0,0.4,0.5,w0")
+        self.assertEqual(len(rows), 22)
+
+    def test_sidecar_round_trip(self):
+        data = {"jobName": "test-job", "results": {
+            "speaker_labels": {"segments": [
+                {"start_time": "0.0", "end_time": "1.0", "speaker_label": "spk_0", "items": [
+                    {"start_time": "0.0", "end_time": "0.5", "speaker_label": "spk_0"},
+                    {"start_time": "0.5", "end_time": "1.0", "speaker_label": "spk_0"}]},
+                {"start_time": "1.2", "end_time": "1.5", "speaker_label": "spk_1", "items": [
+                    {"start_time": "1.2", "end_time": "1.5", "speaker_label": "spk_1"}]}]},
+            "items": [
+                {"type": "pronunciation", "start_time": "0.0", "end_time": "0.5",
+                 "alternatives": [{"confidence": "0.9", "content": "Héllo"}]},
+                {"type": "pronunciation", "start_time": "0.5", "end_time": "1.0",
+                 "alternatives": [{"confidence": "0.4", "content": "there"}]},
+                {"type": "punctuation", "alternatives": [{"confidence": "0.0", "content": "."}]},
+                {"type": "pronunciation", "start_time": "1.2", "end_time": "1.5",
+                 "alternatives": [{"confidence": "0.99", "content": "Yes"}]}]}}
+        job_info = {"TranscriptionJobName": "test-job", "LanguageCode": "en-US",
+                    "CreationTime": target.dt(2024, 5, 1, 12, 30), "Transcript": {"TranscriptFileUri": "x"}}
+        segments = target.create_turn_by_turn_segments(data, isSpeakerMode=True)
+        with tempfile.TemporaryDirectory() as folder:
+            sidecar = os.path.join(folder, "test-job" + target.SIDECAR_EXTENSION)
+            with open(sidecar, "wb") as f:
+                target.save_sidecar(f, data, segments, job_info)
+            self.assertTrue(target.is_sidecar(sidecar))
+            loaded_data, loaded_segments, loaded_info = target.load_sidecar(sidecar)
+            self.assertEqual(loaded_data["jobName"], "test-job")
+            self.assertEqual(loaded_info["CreationTime"], job_info["CreationTime"])
+            self.assertNotIn("Transcript", loaded_info)
+            self.assertEqual([(s.segmentStartTime, s.segmentEndTime, s.segmentSpeaker, s.segmentText)
+                              for s in loaded_segments],
+                             [(s.segmentStartTime, s.segmentEndTime, s.segmentSpeaker, s.segmentText)
+                              for s in segments])
+            self.assertEqual([list(s.iter_words()) for s in loaded_segments],
+                             [list(s.iter_words()) for s in segments])
+            output = BytesIO()
+            target.write(loaded_data, loaded_segments, loaded_info, output)
+        document = target.Document(output)
+        self.assertIn("[00:00:00] Speaker 1: Héllo there.", [paragraph.text for paragraph in document.paragraphs])
+
+    def test_other_source(self):
+        # Another service's converter builds the same segments and names itself in the data
+        segment = target.SpeechSegment()
+        segment.segmentStartTime = 1.0
+        segment.segmentSpeaker = "spk_1"
+        segment.add_word("Hola", 0.95, 1.0, 1.5)
+        segment.add_word("amigo.", 0.0, 1.5, 2.0)
+        segment.segmentEndTime = 2.0
+        data = {"jobName": "google-job", "source": "Google Cloud Speech-to-Text", "results": {"speaker_labels": {}}}
+        job_info = {"language_codes": [{"language_code": "es-US"}]}
+        with tempfile.TemporaryDirectory() as folder:
+            sidecar = os.path.join(folder, "google-job" + target.SIDECAR_EXTENSION)
+            with open(sidecar, "wb") as f:
+                target.save_sidecar(f, data, [segment], job_info)
+            loaded_data, loaded_segments, loaded_info = target.load_sidecar(sidecar)
+            self.assertEqual(loaded_data, data)
+            for renderer in (target.RENDERER_PYTHON_DOCX, target.RENDERER_STREAM):
+                output = BytesIO()
+                target.write(loaded_data, loaded_segments, loaded_info, output, renderer=renderer)
+                paragraphs = [paragraph.text for paragraph in target.Document(output).paragraphs]
+                self.assertIn("Google Cloud Speech-to-Text Audio Source", paragraphs)
+                self.assertNotIn("Amazon Transcribe Audio Source", paragraphs)
+                self.assertIn("[00:00:01] Speaker 2: Hola amigo.", paragraphs)
+
 if __name__ == '__main__':
     unittest.main()
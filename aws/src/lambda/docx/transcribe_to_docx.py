@@ -1,13 +1,29 @@
-import boto3
 from urllib.parse import urlparse
-from urllib.request import urlopen
-from urllib.request import urlretrieve
+from urllib.request import urlopen, Request
 import json
+import heapq
+import codecs
+import re
+import csv
+import hashlib
+from copy import deepcopy
+from sys import intern
+from array import array
+from bisect import bisect_right
+from collections import Counter
+from functools import partial
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from datetime import datetime as dt
 from io import BytesIO
-import statistics
+from xml.sax.saxutils import escape
+from zipfile import ZipFile, ZIP_DEFLATED
 import os
+import sys
+import mmap
+import struct
+from time import perf_counter, process_time
 from docx import Document
 from docx.shared import Cm, Mm, Pt, Inches, RGBColor
 from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_COLOR_INDEX
@@ -16,9 +32,7 @@ from docx.enum.section import WD_SECTION
 from docx.oxml.shared import qn
 from docx.oxml.ns import nsdecls
 from docx.oxml import parse_xml
-import argparse
-from pathlib import Path
-from time import perf_counter
+from s3_multipart import S3MultipartWriter
 
 # Common formats and styles
 CUSTOM_STYLE_HEADER = "CustomHeader"
@@ -28,46 +42,518 @@ RED = "FF0000"
 YELLOW = "FFFF00"
 GREEN = "00FF00"
 
+# Character styles for transcript words, by confidence tier
+STYLE_CONFIDENT = "Transcript Confident"
+STYLE_LOW_CONFIDENCE = "Transcript Low Confidence"
+STYLE_NO_CONFIDENCE = "Transcript No Confidence"
+
 # Additional Constants
 START_NEW_SEGMENT_DELAY = 2.0       # After n seconds pause by one speaker, put next speech in new segment
+JSON_READ_SIZE = 262144             # Characters of transcript JSON to read from the source at a time
+INTERN_MAX_LENGTH = 16              # Longest JSON string value that is shared between decoded objects
+SOURCE_TRANSCRIBE = "Amazon Transcribe"     # Service named in the job summary, unless the data names another
+TRANSCRIPT_PLACEHOLDER = "ATS-TRANSCRIPT-PLACEHOLDER"   # Marks where the streaming renderer inserts the transcript
+STREAM_WRITE_SIZE = 65536           # Bytes of transcript XML to gather before each write into the .docx archive
+
+# Version of the rendered output - bump this whenever a code change alters the documents that are produced,
+# so that documents already in the output bucket are not returned from the render cache in place of new ones
+RENDERER_VERSION = "2"
+
+# Binary sidecar holding a transcript's speech segments, for re-rendering without the Transcribe JSON
+SIDECAR_EXTENSION = ".atsx"
+SIDECAR_MAGIC = b"ATSX"
+SIDECAR_VERSION = 1
+SIDECAR_HEADER = struct.Struct("<4sHHI")    # Magic, version, reserved, length of the JSON metadata
+SIDECAR_JOB_INFO_KEYS = ("TranscriptionJobName", "LanguageCode", "LanguageCodes", "language_codes", "MediaFormat",
+                         "MediaSampleRateHertz", "CreationTime", "Settings")
+
+# Rendering engines
+RENDERER_AUTO = "auto"
+RENDERER_PYTHON_DOCX = "python-docx"
+RENDERER_STREAM = "stream"
+
+# Items of the jobs table that count in-flight Transcribe jobs, which audio_to_transcribe adds to as it starts them
+ADMISSION_PK = "admission"
+ADMISSION_COUNTER_SK = "counter"
+ADMISSION_JOB_PREFIX = "job#"
+
+# Extra formats that the transcript can be exported in alongside the .docx, with the content type of each
+EXPORT_TXT = "txt"
+EXPORT_SRT = "srt"
+EXPORT_VTT = "vtt"
+EXPORT_CSV = "csv"
+EXPORT_CONTENT_TYPES = {
+    EXPORT_TXT: "text/plain; charset=utf-8",
+    EXPORT_SRT: "application/x-subrip; charset=utf-8",
+    EXPORT_VTT: "text/vtt; charset=utf-8",
+    EXPORT_CSV: "text/csv; charset=utf-8",
+}
+CAPTION_MAX_DURATION = 7.0          # Longest time in seconds that a single caption stays on screen
+CAPTION_MAX_CHARACTERS = 84         # Most characters in a single caption, which is two lines of 42
+
+# CloudWatch units of the metrics that the Lambda reports for each job
+METRIC_UNITS = {
+    "GetJobTime": "Seconds",
+    "DownloadTime": "Seconds",
+    "SegmentationTime": "Seconds",
+    "BuildTime": "Seconds",
+    "SaveTime": "Seconds",
+    "UploadTime": "Seconds",
+    "ExportTime": "Seconds",
+    "DeleteMediaTime": "Seconds",
+    "TotalTime": "Seconds",
+    "TranscriptBytes": "Bytes",
+    "Words": "Count",
+    "Segments": "Count",
+    "PeakRSS": "Bytes",
+    "CacheHit": "Count",
+}
+
+# Confidence score bands for the summary table - each is the lower bound of a bucket above the "0% - 9%" one
+CONFIDENCE_BUCKET_THRESHOLDS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.98)
+CONFIDENCE_BUCKET_RANGES = ("0% - 9%", "10% - 19%", "20% - 29%", "30% - 39%", "40% - 49%", "50% - 59%",
+                            "60% - 69%", "70% - 79%", "80% - 89%", "90% - 97%", "98% - 100%")
+
+class TranscriptWords:
+    """ Class to hold every word of a transcript in compact, shared columns """
+    __slots__ = ("text", "confidence", "startTime", "endTime")
 
-# Global variables
-global_average_confidence = "0.0"
-global_audio_duration = 0.0
-global_languages = ""
+    def __init__(self):
+        self.text = []                  # Interned word text, including any trailing punctuation
+        self.confidence = array("d")
+        self.startTime = array("d")
+        self.endTime = array("d")
+
+    def __len__(self):
+        return len(self.text)
+
+    def append(self, text, confidence, start_time, end_time):
+        """
+        Adds a word to the end of the transcript
+
+        :param text: Word text, without any leading space
+        :param confidence: Confidence score for the word
+        :param start_time: Start time of the word in seconds
+        :param end_time: End time of the word in seconds
+        """
+        self.text.append(intern(text))
+        self.confidence.append(confidence)
+        self.startTime.append(start_time)
+        self.endTime.append(end_time)
+
+    def extend(self, other, start, end):
+        """
+        Copies a range of words from another set of words onto the end of this one
+
+        :param other: TranscriptWords to copy from
+        :param start: Position of the first word to copy
+        :param end: Position after the last word to copy
+        """
+        self.text.extend(other.text[start:end])
+        self.confidence.extend(other.confidence[start:end])
+        self.startTime.extend(other.startTime[start:end])
+        self.endTime.extend(other.endTime[start:end])
 
 class SpeechSegment:
-    """ Class to hold information about a single speech segment """
-    def __init__(self):
+    """ Class to hold information about a single speech segment, whose words are a range of a TranscriptWords """
+    __slots__ = ("segmentStartTime", "segmentEndTime", "segmentSpeaker", "words", "wordStart", "wordEnd")
+
+    def __init__(self, words=None):
         self.segmentStartTime = 0.0
         self.segmentEndTime = 0.0
         self.segmentSpeaker = ""
-        self.segmentText = ""
-        self.segmentConfidence = []
-        self.segmentSentimentScore = -1.0    # -1.0 => no sentiment calculated
-        self.segmentPositive = 0.0
-        self.segmentNegative = 0.0
-        self.segmentIsPositive = False
-        self.segmentIsNegative = False
-        self.segmentAllSentiments = []
-        self.segmentLoudnessScores = []
-        self.segmentInterruption = False
-        self.segmentIssuesDetected = []
-        self.segmentActionItemsDetected = []
-        self.segmentOutcomesDetected = []
+        self.words = words if words is not None else TranscriptWords()
+        self.wordStart = len(self.words)
+        self.wordEnd = self.wordStart
+
+    @property
+    def wordCount(self):
+        return self.wordEnd - self.wordStart
+
+    @property
+    def segmentText(self):
+        """ Text of the whole segment, which is only built when asked for """
+        return " ".join(self.words.text[self.wordStart:self.wordEnd])
+
+    def add_word(self, text, confidence, start_time, end_time):
+        """
+        Adds a word to the end of this segment, which must be the last segment using its TranscriptWords
+
+        :param text: Word text, without any leading space
+        :param confidence: Confidence score for the word
+        :param start_time: Start time of the word in seconds
+        :param end_time: End time of the word in seconds
+        """
+        self.words.append(text, confidence, start_time, end_time)
+        self.wordEnd = len(self.words)
+
+    def iter_words(self):
+        """
+        Steps through the words of this segment, as they appear in the segment text
+
+        :return: Generator of (text, confidence, start_time, end_time) tuples, where the text has a leading
+                 space for all but the first word
+        """
+        words = self.words
+        for position in range(self.wordStart, self.wordEnd):
+            text = words.text[position] if position == self.wordStart else " " + words.text[position]
+            yield text, words.confidence[position], words.startTime[position], words.endTime[position]
+
+class TranscriptStats:
+    """ Class to accumulate transcript statistics as the speech segments are produced """
+    __slots__ = ("histogram", "accuracyTotal", "wordCount", "speakers", "duration", "lastStartTime", "languages",
+                 "transcriptBytes")
+
+    def __init__(self):
+        self.histogram = [0] * len(CONFIDENCE_BUCKET_RANGES)   # Word count per confidence bucket, lowest first
+        self.accuracyTotal = 0          # Sum of each word's confidence as a whole percentage
+        self.wordCount = 0
+        self.speakers = {}              # Speaker label -> [talk time in seconds, word count]
+        self.duration = 0.0             # End time of the final speech segment
+        self.lastStartTime = 0.0
+        self.languages = ""
+        self.transcriptBytes = 0        # Size of the transcript JSON, when it is loaded with load_transcript()
+
+    def add_segment(self, segment):
+        """
+        Adds a completed speech segment to the statistics.  The words are bucketed and summed a whole
+        column-slice at a time, rather than one at a time
+
+        :param segment: Speech segment that will not change any further
+        """
+        confidences = segment.words.confidence[segment.wordStart:segment.wordEnd]
+        for bucket, count in Counter(map(partial(bisect_right, CONFIDENCE_BUCKET_THRESHOLDS), confidences)).items():
+            self.histogram[bucket] += count
+        self.accuracyTotal += sum(int(confidence * 100) for confidence in confidences)
+        self.wordCount += len(confidences)
+
+        speaker = self.speakers.setdefault(segment.segmentSpeaker, [0.0, 0])
+        speaker[0] += segment.segmentEndTime - segment.segmentStartTime
+        speaker[1] += len(confidences)
+
+        # Audio duration is the end-time of the final voice segment
+        if segment.segmentStartTime >= self.lastStartTime:
+            self.lastStartTime = segment.segmentStartTime
+            self.duration = segment.segmentEndTime
+
+    @property
+    def averageConfidence(self):
+        """ Mean of the words' whole-percentage confidence scores, which like statistics.mean() is an int if exact """
+        if self.wordCount == 0:
+            return 0.0
+        if self.accuracyTotal % self.wordCount == 0:
+            return self.accuracyTotal // self.wordCount
+        return self.accuracyTotal / self.wordCount
+
+class SidecarText:
+    """ Class to read the words of a sidecar's text column, decoding each one from the mapped file when asked for """
+    __slots__ = ("blob", "offsets")
+
+    def __init__(self, blob, offsets):
+        self.blob = blob                # UTF-8 text of every word, back to back
+        self.offsets = offsets          # Start of each word in the blob, plus the end of the last one
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        return str(self.blob[self.offsets[index]:self.offsets[index + 1]], "utf-8")
+
+def intern_json_object(pairs):
+    """
+    Builds a decoded JSON object, sharing its keys and short string values (word timings, item types) with
+    every other object.  Decoding one value at a time would otherwise give each object its own copies
+
+    :param pairs: List of (key, value) pairs from the JSON decoder
+    :return: Dictionary for the JSON object
+    """
+    return {intern(key): intern(value) if value.__class__ is str and len(value) <= INTERN_MAX_LENGTH else value
+            for key, value in pairs}
+
+class JsonStreamReader:
+    """ Class to incrementally read a JSON document from a file-like object, one value at a time """
+    SKIP_PATTERN = re.compile(r'["\\\[\]{}]')
+
+    def __init__(self, stream, read_size=JSON_READ_SIZE):
+        self.stream = stream
+        self.readSize = read_size
+        self.decoder = json.JSONDecoder(object_pairs_hook=intern_json_object)
+        self.utf8 = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.bytesRead = 0
+
+    def fill(self, size=None):
+        """
+        Reads the next block from the stream, discarding anything already consumed from the buffer
+
+        :param size: (optional) Amount to read, if more than the standard block size is wanted
+        :return: False if the stream is exhausted
+        """
+        if self.eof:
+            return False
+        block = self.stream.read(max(size or 0, self.readSize))
+        self.bytesRead += len(block)
+        if not block:
+            self.eof = True
+        if isinstance(block, bytes):
+            # A block may end part-way through a multi-byte character, which is held back until the next one
+            block = self.utf8.decode(block, final=self.eof)
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+        return not self.eof
+
+    def peek(self):
+        """
+        Skips any whitespace and returns the next character, or an empty string at the end of the document
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        """
+        Consumes the next character, which must be the one given
+        """
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at '{self.buffer[self.pos:self.pos + 20]}'")
+        self.pos += 1
+
+    def read_value(self):
+        """
+        Decodes the next complete JSON value, reading more of the stream until it is all available
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # A number at the very end of the buffer may continue in the next block
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Double the unconsumed buffer each time, so a large value is only re-decoded a few times
+            self.fill(len(self.buffer) - self.pos)
+
+    def skip_value(self):
+        """
+        Moves past the next JSON value without decoding it, so large values are never held in memory
+        """
+        if self.peek() not in ('"', "[", "{"):
+            self.read_value()
+            return
+        depth = 0
+        inString = False
+        while True:
+            match = self.SKIP_PATTERN.search(self.buffer, self.pos)
+            if match is None:
+                self.pos = len(self.buffer)
+                if not self.fill():
+                    raise ValueError("Unexpected end of JSON document")
+                continue
+            char = match.group()
+            self.pos = match.end()
+            if inString:
+                if char == "\\":
+                    # Step over the escaped character, which may be in the next block
+                    if self.pos >= len(self.buffer) and not self.fill():
+                        raise ValueError("Unexpected end of JSON document")
+                    self.pos += 1
+                elif char == '"':
+                    inString = False
+                    if depth == 0:
+                        return
+            elif char == '"':
+                inString = True
+            elif char in "[{":
+                depth += 1
+            elif char in "]}":
+                depth -= 1
+                if depth == 0:
+                    return
+
+    def iter_object(self):
+        """
+        Steps through the members of the next JSON object, yielding each key.  The caller must consume the
+        member's value, with read_value(), skip_value() or a nested iteration, before asking for the next key
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(":")
+            yield key
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("}")
+                return
+
+    def iter_array(self):
+        """
+        Steps through the elements of the next JSON array, yielding each position.  The caller must consume
+        each element before asking for the next one
+        """
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        position = 0
+        while True:
+            yield position
+            position += 1
+            if self.peek() == ",":
+                self.pos += 1
+            else:
+                self.expect("]")
+                return
+
+    def iter_values(self):
+        """
+        Decodes the elements of the next JSON array one at a time
+        """
+        for _ in self.iter_array():
+            yield self.read_value()
 
 # Get current date for S3 folder name:
 today = dt.now().strftime("%Y%m%d")
 
-# S3 client to read/write files
-s3 = boto3.client('s3')
+# AWS clients by service name - boto3 is only imported, and each client created, the first time one is needed
+aws_clients = {}
 
-# Transcribe client to read job results
-if __name__ != "__main__":
-    ts_client = boto3.client('transcribe')
+# Prepared base documents by template and title, built once per container and copied for each transcript
+base_documents = {}
 
 confidence_env = int(os.environ.get('CONFIDENCE', 90))
 
+# Title at the top of every document
+document_title_env = os.environ.get('DOCUMENT_TITLE', 'Transcription Results')
+
+# Transcripts longer than this many seconds are streamed straight into the .docx when the renderer is "auto"
+stream_duration_env = float(os.environ.get('DOCX_STREAM_DURATION', 3600))
+
+# Optional site .docx template, as a local path or s3:// URI
+template_env = os.environ.get('DOCX_TEMPLATE') or None
+
+# Comma-separated extra formats to export each transcript in, from txt, srt, vtt and csv
+export_formats_env = os.environ.get('EXPORT_FORMATS', '')
+
+# Jobs table holding the admission counter for the concurrent Transcribe job quota, if that is turned on
+admission_table_env = os.environ.get('ADMISSION_TABLE') or None
+
+# CloudWatch namespace for the per-job metrics
+metrics_namespace_env = os.environ.get('METRICS_NAMESPACE', 'ATS')
+
+def get_client(service_name):
+    """
+    Returns the shared boto3 client for an AWS service, creating it on first use.  This keeps the cost of
+    loading boto3 and its service models away from the CLI and unit tests when they do not need AWS
+
+    :param service_name: boto3 service name, such as "s3" or "transcribe"
+    :return: boto3 client for the service
+    """
+    if service_name not in aws_clients:
+        import boto3
+        aws_clients[service_name] = boto3.client(service_name)
+    return aws_clients[service_name]
+
+def load_template_document(template):
+    """
+    Opens the .docx that a base document is built on - either python-docx's default template, or a site template
+
+    :param template: Local path or s3:// URI of a .docx template, or None for the default
+    :return: Document for the template
+    """
+    if template is None:
+        return Document()
+    if template.startswith("s3://"):
+        bucket, key = find_bucket_key(template)
+        body = get_client("s3").get_object(Bucket=bucket, Key=key)["Body"].read()
+        return Document(BytesIO(body))
+    return Document(template)
+
+def get_base_document(template=None, source=None):
+    """
+    Returns the prepared base document for a template, building it the first time it is asked for.  This holds
+    the section layout, the styles and the skeleton of the job summary.  A site template keeps its own layout and
+    any of our styles that it defines, and is only given what it lacks.  Each transcript is written into a deep
+    copy of it, which takes about half the time of re-opening the saved document and doesn't unzip or re-parse it
+
+    :param template: (optional) Local path or s3:// URI of a .docx template, defaulting to the DOCX_TEMPLATE setting
+    :param source: (optional) Speech-to-text service that produced the transcript, defaulting to Amazon Transcribe
+    :return: Base document, which must be copied before it is changed
+    """
+    template = template or template_env
+    source = source or SOURCE_TRANSCRIBE
+    if (template, document_title_env, source) in base_documents:
+        return base_documents[(template, document_title_env, source)]
+
+    document = load_template_document(template)
+    if template is None:
+        # Initiate orientation and margins
+        document.sections[0].left_margin = Mm(19.1)
+        document.sections[0].right_margin = Mm(19.1)
+        document.sections[0].top_margin = Mm(19.1)
+        document.sections[0].bottom_margin = Mm(19.1)
+        document.sections[0].page_width = Mm(210)
+        document.sections[0].page_height = Mm(297)
+
+        # Set the base font
+        font = document.styles["Normal"].font
+        font.name = "Calibri"
+        font.size = Pt(10)
+
+    # Create our custom text header style
+    if CUSTOM_STYLE_HEADER not in document.styles:
+        font = document.styles["Normal"].font
+        custom_style = document.styles.add_style(CUSTOM_STYLE_HEADER, WD_STYLE_TYPE.PARAGRAPH)
+        custom_style.paragraph_format.widow_control = True
+        custom_style.paragraph_format.keep_with_next = True
+        custom_style.paragraph_format.space_after = Pt(0)
+        custom_style.font.size = font.size
+        custom_style.font.name = font.name
+        custom_style.font.bold = True
+        custom_style.font.italic = True
+
+    # Word only saves the styles that a template has used, so bring in our table style if it is missing
+    if TABLE_STYLE_STANDARD not in document.styles:
+        document.styles.element.append(deepcopy(Document().styles[TABLE_STYLE_STANDARD].element))
+    add_transcript_styles(document)
+
+    # Intro header
+    write_custom_text_header(document, document_title_env, 2)
+
+    # Job summary header and table, whose first row will hold the job name
+    write_custom_text_header(document, source + " Audio Source")
+    table = document.add_table(rows=1, cols=2)
+    table.style = document.styles[TABLE_STYLE_STANDARD]
+    table.alignment = WD_ALIGN_PARAGRAPH.LEFT
+    table.rows[0].cells[0].text = "Job Name"
+
+    base_documents[(template, document_title_env, source)] = document
+    return document
+
+def copy_document(document):
+    """
+    Makes an independent copy of a document.  The package is copied rather than the document itself, because
+    lxml copies an element afresh each time it is reached, which would split the document from its part
+
+    :param document: Document to copy
+    :return: Copy of the document, sharing nothing with the original
+    """
+    return deepcopy(document.part.package).main_document_part.document
+
 def convert_timestamp(time_in_seconds):
     """
     Function to help convert timestamps from s to hh:mm:ss
@@ -111,30 +597,180 @@ def set_transcript_text_style(run, force_highlight, confidence=0.0, rgb_color=No
     if force_highlight:
         run.font.highlight_color = WD_COLOR_INDEX.YELLOW
 
+def add_transcript_styles(document):
+    """
+    Creates the character styles used to show word confidence in the transcript, so that each run of text
+    only needs to reference a style rather than carry its own font formatting.  Styles that already exist are kept
+
+    :param document: Document to add the styles to
+    :return: Dictionary of style name -> character style
+    """
+    styles = {}
+    for style_name in (STYLE_CONFIDENT, STYLE_LOW_CONFIDENCE, STYLE_NO_CONFIDENCE):
+        if style_name in document.styles:
+            # Already in the base document, or supplied by a site template
+            styles[style_name] = document.styles[style_name]
+            continue
+        styles[style_name] = document.styles.add_style(style_name, WD_STYLE_TYPE.CHARACTER)
+        if style_name == STYLE_CONFIDENT:
+            styles[style_name].font.color.rgb = RGBColor(0, 0, 0)
+        elif style_name == STYLE_LOW_CONFIDENCE:
+            styles[style_name].font.highlight_color = WD_COLOR_INDEX.YELLOW
+        else:
+            set_transcript_text_style(styles[style_name], False, confidence=0.0)
+    return styles
+
+def confidence_style_name(confidence):
+    """
+    Picks the transcript character style for a word, matching the formatting of set_transcript_text_style
+
+    :param confidence: Confidence score for the word
+    :return: Name of the character style to use
+    """
+    if confidence == 0.0:
+        return STYLE_NO_CONFIDENCE
+    elif confidence >= (confidence_env / 100):
+        return STYLE_CONFIDENT
+    return STYLE_LOW_CONFIDENCE
+
+def coalesce_transcript_runs(segment):
+    """
+    Groups consecutive words in the same confidence tier, so that each group can be written as a single run
+
+    :param segment: Speech segment holding the words
+    :return: Generator of (style name, text) tuples
+    """
+    words = segment.words
+    runStart = segment.wordStart
+    runStyle = None
+    for position in range(segment.wordStart, segment.wordEnd):
+        wordStyle = confidence_style_name(words.confidence[position])
+        if wordStyle != runStyle and position > runStart:
+            yield runStyle, run_text(words, runStart, position, segment.wordStart)
+            runStart = position
+        runStyle = wordStyle
+    if segment.wordEnd > runStart:
+        yield runStyle, run_text(words, runStart, segment.wordEnd, segment.wordStart)
+
+def run_text(words, start, end, segment_start):
+    """
+    Builds the text for a run of words, which starts with a space unless it opens the segment
+
+    :param words: TranscriptWords holding the words
+    :param start: Position of the first word in the run
+    :param end: Position after the last word in the run
+    :param segment_start: Position of the first word in the segment
+    :return: Text of the run
+    """
+    text = " ".join(words.text[start:end])
+    return text if start == segment_start else " " + text
+
 def write_transcribe_text(document, speech_segments):
     """
-    Writes out each line of the transcript in the Word document
+    Writes out each line of the transcript in the Word document.  Consecutive words in the same confidence
+    tier are written as a single run that uses that tier's character style
+
     :param document: Document to write the text to
     :param speech_segments: Turn-by-turn speech list
     """
+    # Resolve the style IDs once, as looking styles up by name for every run is expensive
+    styleIds = {name: style.style_id for name, style in add_transcript_styles(document).items()}
     for segment in speech_segments:
         startTime = convert_timestamp(segment.segmentStartTime)
         speaker = format_speaker_label(segment.segmentSpeaker)
 
         paragraph = document.add_paragraph()
-        run = paragraph.add_run()
-        run.add_text("[" + startTime + "] " + speaker + ": ")
+        paragraph.add_run("[" + startTime + "] " + speaker + ": ")
+
+        # Then do each word with confidence-level styling
+        for styleName, text in coalesce_transcript_runs(segment):
+            paragraph.add_run(text)._r.style = styleIds[styleName]
+
+def transcript_paragraph_xml(segment, styleIds):
+    """
+    Builds the WordprocessingML for one line of the transcript, exactly as write_transcribe_text would
+    produce it through python-docx
+
+    :param segment: Speech segment to be written
+    :param styleIds: Dictionary of character style name -> style ID
+    :return: XML string for the paragraph
+    """
+    startTime = convert_timestamp(segment.segmentStartTime)
+    speaker = format_speaker_label(segment.segmentSpeaker)
+    parts = ['<w:p><w:r>', text_element_xml("[" + startTime + "] " + speaker + ": "), '</w:r>']
+    for styleName, text in coalesce_transcript_runs(segment):
+        parts.append('<w:r><w:rPr><w:rStyle w:val="' + styleIds[styleName] + '"/></w:rPr>')
+        parts.append(text_element_xml(text))
+        parts.append('</w:r>')
+    parts.append('</w:p>')
+    return "".join(parts)
+
+def text_element_xml(text):
+    """
+    Builds a w:t element for some run text, preserving whitespace only where python-docx would
 
-        # Then do each word with confidence-level colouring
-        text_index = 1
-        for eachWord in segment.segmentConfidence:
-            run = paragraph.add_run()
+    :param text: Text of the run
+    :return: XML string for the text element
+    """
+    if len(text.strip()) < len(text):
+        return '<w:t xml:space="preserve">' + escape(text) + '</w:t>'
+    return '<w:t>' + escape(text) + '</w:t>'
 
-            # Output the next word, with the correct confidence styling and forced background
-            run.add_text(eachWord["text"])
-            text_index += len(eachWord["text"])
-            confLevel = eachWord["confidence"]
-            set_transcript_text_style(run, False, confidence=confLevel)
+def save_streamed_document(document, speech_segments, styleIds, output_file):
+    """
+    Saves a document whose transcript has been left as a placeholder paragraph, streaming the transcript
+    paragraphs straight into word/document.xml inside the output archive.  Only the small document shell is
+    ever held as a python-docx object tree, so memory use does not grow with the length of the transcript
+
+    :param document: Document holding everything except the transcript text
+    :param speech_segments: Turn-by-turn speech list
+    :param styleIds: Dictionary of character style name -> style ID
+    :param output_file: Filename or writable file-like object for the .docx
+    """
+    shell = BytesIO()
+    document.save(shell)
+    with ZipFile(shell) as source, ZipFile(output_file, "w", compression=ZIP_DEFLATED) as target:
+        for info in source.infolist():
+            if info.filename != "word/document.xml":
+                target.writestr(info, source.read(info.filename))
+                continue
+
+            # Split the main document around the placeholder paragraph
+            xml = source.read(info.filename).decode("utf-8")
+            marker = xml.index(TRANSCRIPT_PLACEHOLDER)
+            paraStart = xml.rindex("<w:p>", 0, marker)
+            paraEnd = xml.index("</w:p>", marker) + len("</w:p>")
+            # No Zip64 records, as Word is fussy about them and the document XML is nowhere near 4GiB
+            with target.open(info.filename, "w") as member:
+                member.write(xml[:paraStart].encode("utf-8"))
+                pending = []
+                pendingSize = 0
+                for segment in speech_segments:
+                    paragraph = transcript_paragraph_xml(segment, styleIds)
+                    pending.append(paragraph)
+                    pendingSize += len(paragraph)
+                    if pendingSize >= STREAM_WRITE_SIZE:
+                        member.write("".join(pending).encode("utf-8"))
+                        pending = []
+                        pendingSize = 0
+                member.write("".join(pending).encode("utf-8"))
+                member.write(xml[paraEnd:].encode("utf-8"))
+
+def select_renderer(renderer, audio_duration):
+    """
+    Works out which rendering engine to use for a document
+
+    :param renderer: Requested renderer - "auto", "python-docx" or "stream" - or None to use DOCX_RENDERER
+    :param audio_duration: Length of the transcript in seconds
+    :return: Either "python-docx" or "stream"
+    """
+    if renderer is None:
+        renderer = os.environ.get("DOCX_RENDERER", RENDERER_AUTO)
+    if renderer == RENDERER_AUTO:
+        return RENDERER_STREAM if audio_duration > stream_duration_env else RENDERER_PYTHON_DOCX
+    if renderer not in (RENDERER_PYTHON_DOCX, RENDERER_STREAM):
+        raise ValueError(f"Unknown renderer '{renderer}'")
+    return renderer
 
 def format_speaker_label(label):
     """
@@ -174,49 +810,15 @@ def write_small_header_text(document, text, confidence):
 
 def generate_confidence_stats(speech_segments):
     """
-    Creates a map of timestamps and confidence scores to allow for both summarising and graphing in the document.
-    We also need to bucket the stats for summarising into bucket ranges that feel important (but are easily changed)
+    Creates the confidence statistics for a set of speech segments that were produced without a TranscriptStats
+    accumulator.  Scores are bucketed into ranges that feel important (but are easily changed)
 
     :param speech_segments: List of call speech segments
-    :return: Confidence and timestamp structures for graphing
-    """""
-
-    # Stats dictionary
-    stats = {
-        "timestamps": [],
-        "accuracy": [],
-        "9.8": 0, "9": 0, "8": 0, "7": 0, "6": 0, "5": 0, "4": 0, "3": 0, "2": 0, "1": 0, "0": 0,
-        "parsedWords": 0}
-
-    # Confidence count - we need the average confidence score regardless
+    :return: TranscriptStats for the segments
+    """
+    stats = TranscriptStats()
     for line in speech_segments:
-        for word in line.segmentConfidence:
-            stats["timestamps"].append(word["start_time"])
-            conf_value = word["confidence"]
-            stats["accuracy"].append(int(conf_value * 100))
-            if conf_value >= 0.98:
-                stats["9.8"] += 1
-            elif conf_value >= 0.9:
-                stats["9"] += 1
-            elif conf_value >= 0.8:
-                stats["8"] += 1
-            elif conf_value >= 0.7:
-                stats["7"] += 1
-            elif conf_value >= 0.6:
-                stats["6"] += 1
-            elif conf_value >= 0.5:
-                stats["5"] += 1
-            elif conf_value >= 0.4:
-                stats["4"] += 1
-            elif conf_value >= 0.3:
-                stats["3"] += 1
-            elif conf_value >= 0.2:
-                stats["2"] += 1
-            elif conf_value >= 0.1:
-                stats["1"] += 1
-            else:
-                stats["0"] += 1
-            stats["parsedWords"] += 1
+        stats.add_segment(line)
     return stats
 
 def write_custom_text_header(document, text_label, level=3):
@@ -252,17 +854,14 @@ def write_confidence_scores(document, stats, temp_files):
     hdr_cells[0].text = "Confidence"
     hdr_cells[1].text = "Count"
     hdr_cells[2].text = "Percentage"
-    parsedWords = stats["parsedWords"]
-    confidenceRanges = ["98% - 100%", "90% - 97%", "80% - 89%", "70% - 79%", "60% - 69%", "50% - 59%", "40% - 49%",
-                        "30% - 39%", "20% - 29%", "10% - 19%", "0% - 9%"]
-    confidenceRangeStats = ["9.8", "9", "8", "7", "6", "5", "4", "3", "2", "1", "0"]
-    # Add on each row
+    parsedWords = stats.wordCount
+    # Add on each row, highest confidence first
     shading_reqd = False
-    for confRange, rangeStats in zip(confidenceRanges, confidenceRangeStats):
+    for confRange, rangeCount in zip(reversed(CONFIDENCE_BUCKET_RANGES), reversed(stats.histogram)):
         row_cells = table.add_row().cells
         row_cells[0].text = confRange
-        row_cells[1].text = str(stats[rangeStats])
-        row_cells[2].text = str(round(stats[rangeStats] / parsedWords * 100, 2)) + "%"
+        row_cells[1].text = str(rangeCount)
+        row_cells[2].text = str(round(rangeCount / parsedWords * 100, 2)) + "%"
 
         # Add highlighting to the row if required
         if shading_reqd:
@@ -288,7 +887,7 @@ def set_table_cell_background_colour(cell, rgb_hex):
     parsed_xml = parse_xml(r'<w:shd {0} w:fill="{1}"/>'.format(nsdecls('w'), rgb_hex))
     cell._tc.get_or_add_tcPr().append(parsed_xml)
 
-def write(data, speech_segments, job_info, output_file):
+def write(data, speech_segments, job_info, output_file, renderer=None, stats=None, template=None):
     """
     Write a transcript from the .json transcription file and other data generated
     by the results parser, putting it all into a human-readable Word document
@@ -296,63 +895,45 @@ def write(data, speech_segments, job_info, output_file):
     :param data: JSON output from the transcription job
     :param speech_segments: List of call speech segments
     :param job_info: Status of the Transcribe job
-    :param summaries_detected: Flag to indicate presence of call summary data
+    :param output_file: Filename or writable file-like object for the .docx
+    :param renderer: (optional) "auto", "python-docx" or "stream", defaulting to the DOCX_RENDERER setting
+    :param stats: (optional) TranscriptStats gathered during segmentation, which also receives the job's languages
+    :param template: (optional) Local path or s3:// URI of a .docx template, defaulting to the DOCX_TEMPLATE setting
+    :return: TranscriptStats for the transcript
     """
+    if stats is None:
+        stats = generate_confidence_stats(speech_segments)
+    document, styleIds = build_document(data, speech_segments, job_info, stats, renderer, template)
+    save_document(document, speech_segments, output_file, styleIds)
+    return stats
 
-    # Global variable to hold the average confidence score
-    global global_average_confidence
-    global global_audio_duration
-    global global_languages
+def build_document(data, speech_segments, job_info, stats, renderer=None, template=None):
+    """
+    Builds the Word document for a transcript in memory.  With the streaming renderer the transcript itself is
+    only a placeholder at this point, and is written out by save_document()
 
+    :param data: JSON output from the transcription job, or the same job name and mode from another service along
+                 with its name as "source"
+    :param speech_segments: List of call speech segments
+    :param job_info: Status of the Transcribe job
+    :param stats: TranscriptStats for the speech segments, which also receives the job's languages
+    :param renderer: (optional) "auto", "python-docx" or "stream", defaulting to the DOCX_RENDERER setting
+    :param template: (optional) Local path or s3:// URI of a .docx template, defaulting to the DOCX_TEMPLATE setting
+    :return: The document, and the transcript style IDs if the transcript is to be streamed in when saved, else None
+    """
     tempFiles = []
+    styleIds = None
 
-    # Initiate Document, orientation and margins
-    document = Document()
-    document.sections[0].left_margin = Mm(19.1)
-    document.sections[0].right_margin = Mm(19.1)
-    document.sections[0].top_margin = Mm(19.1)
-    document.sections[0].bottom_margin = Mm(19.1)
-    document.sections[0].page_width = Mm(210)
-    document.sections[0].page_height = Mm(297)
-
-    # Set the base font and document title
-    font = document.styles["Normal"].font
-    font.name = "Calibri"
-    font.size = Pt(10)
-
-    # Create our custom text header style
-    custom_style = document.styles.add_style(CUSTOM_STYLE_HEADER, WD_STYLE_TYPE.PARAGRAPH)
-    custom_style.paragraph_format.widow_control = True
-    custom_style.paragraph_format.keep_with_next = True
-    custom_style.paragraph_format.space_after = Pt(0)
-    custom_style.font.size = font.size
-    custom_style.font.name = font.name
-    custom_style.font.bold = True
-    custom_style.font.italic = True
-
-    # Intro header
-    DOCUMENT_TITLE = os.environ.get("DOCUMENT_TITLE", "Transcription Results")
-    write_custom_text_header(document, DOCUMENT_TITLE, 2)
-
-    # Write put the call summary table - depending on the mode that Transcribe was used in, and
-    # if the request is being run on a JSON results file rather than reading the job info from Transcribe,
-    # not all of the information is available.
-    # -- Media information
-    # -- Amazon Transcribe job information
-    # -- Average transcript word-confidence scores
-    write_custom_text_header(document, "Amazon Transcribe Audio Source")
-    table = document.add_table(rows=1, cols=2)
-    table.style = document.styles[TABLE_STYLE_STANDARD]
-    table.alignment = WD_ALIGN_PARAGRAPH.LEFT
-    hdr_cells = table.rows[0].cells
-    hdr_cells[0].text = "Job Name"
-    hdr_cells[1].text = data["jobName"]
+    # Start from a copy of the prepared base document, and fill in the job name in its summary table
+    document = copy_document(get_base_document(template, data.get("source")))
+    table = document.tables[-1]
+    table.rows[0].cells[1].text = data["jobName"]
     job_data = []
     # Audio duration is the end-time of the final voice segment, which might be shorter than the actual file duration
     if len(speech_segments) > 0:
-        global_audio_duration = speech_segments[-1].segmentEndTime
-        dur_text = str(int(global_audio_duration / 60)) + "m " + str(round(global_audio_duration % 60, 2)) + "s"
+        dur_text = str(int(stats.duration / 60)) + "m " + str(round(stats.duration % 60, 2)) + "s"
         job_data.append({"name": "Audio Duration", "value": dur_text})
+        renderer = select_renderer(renderer, stats.duration)
     # We can infer diarization mode from the JSON results data structure
     if "speaker_labels" in data["results"] and data["results"]["speaker_labels"] is not None:
         job_data.append({"name": "Audio Identification", "value": "Speaker-separated"})
@@ -364,20 +945,20 @@ def write(data, speech_segments, job_info, output_file):
     # Some information is only in the job info
     if job_info is not None:
         if "LanguageCode" in job_info: # AWS sample job_info
-            global_languages = job_info["LanguageCode"]
+            stats.languages = job_info["LanguageCode"]
             job_data.append({"name": "Language", "value": job_info["LanguageCode"]})
         elif "LanguageCodes" in job_info: # AWS job_info
             languages = []
             for language in job_info["LanguageCodes"]:
                 languages.append(language["LanguageCode"])
-            global_languages = ', '.join(languages)
-            job_data.append({"name": "Language(s)", "value": global_languages})
+            stats.languages = ', '.join(languages)
+            job_data.append({"name": "Language(s)", "value": stats.languages})
         elif "language_codes" in job_info: # json job_info
             languages = []
             for language in job_info["language_codes"]:
                 languages.append(language["language_code"])
-            global_languages = ', '.join(languages)
-            job_data.append({"name": "Language(s)", "value": global_languages})
+            stats.languages = ', '.join(languages)
+            job_data.append({"name": "Language(s)", "value": stats.languages})
         if "MediaFormat" in job_info:
             job_data.append({"name": "File Format", "value": job_info["MediaFormat"]})
         if "MediaSampleRateHertz" in job_info:
@@ -397,10 +978,8 @@ def write(data, speech_segments, job_info, output_file):
                 job_data.append({"name": "Custom Vocabulary", "value": job_info["Settings"]["VocabularyName"]})
 
     # Finish with the confidence scores (if we have any)
-    stats = generate_confidence_stats(speech_segments)
-    if len(stats["accuracy"]) > 0:
-        global_average_confidence = str(round(statistics.mean(stats["accuracy"]), 2))
-        job_data.append({"name": "Average Confidence", "value": global_average_confidence + "%"})
+    if stats.wordCount > 0:
+        job_data.append({"name": "Average Confidence", "value": str(round(stats.averageConfidence, 2)) + "%"})
 
     # Place all of our job-summary fields into the Table, one row at a time
     for next_row in job_data:
@@ -433,8 +1012,13 @@ def write(data, speech_segments, job_info, output_file):
         write_small_header_text(document, "WORD CONFIDENCE: >= " + str(confidence_env) + "% in black, ", (confidence_env / 100))
         write_small_header_text(document, "< " + str(confidence_env) + "% in yellow highlight", ((confidence_env - 1) / 100))
 
-        # Based upon our segment list, write out the transcription
-        write_transcribe_text(document, speech_segments)
+        # Based upon our segment list, write out the transcription - long transcripts are left as a placeholder
+        # here, then streamed directly into the saved file
+        if renderer == RENDERER_STREAM:
+            styleIds = {name: style.style_id for name, style in add_transcript_styles(document).items()}
+            document.add_paragraph(TRANSCRIPT_PLACEHOLDER)
+        else:
+            write_transcribe_text(document, speech_segments)
         document.add_paragraph()
 
         # Display confidence count table (new section)
@@ -443,13 +1027,201 @@ def write(data, speech_segments, job_info, output_file):
         write_confidence_scores(document, stats, tempFiles)
         document.add_section(WD_SECTION.CONTINUOUS)
 
-    # Save the whole document and then upload to S3
-    document.save(output_file)
-
-    # Now delete any local images that we created
+    # Now delete any local images that we created, as they are already embedded
     for filename in tempFiles:
         os.remove(filename)
 
+    return document, styleIds
+
+def save_document(document, speech_segments, output_file, styleIds=None):
+    """
+    Saves a document built by build_document(), streaming in the transcript if it was left as a placeholder
+
+    :param document: Document to save
+    :param speech_segments: List of call speech segments
+    :param output_file: Filename or writable file-like object for the .docx
+    :param styleIds: (optional) Transcript style IDs returned by build_document() for a streamed transcript
+    """
+    if styleIds is not None and len(speech_segments) > 0:
+        save_streamed_document(document, speech_segments, styleIds, output_file)
+    else:
+        document.save(output_file)
+
+def parse_export_formats(formats):
+    """
+    Parses a comma-separated list of export formats, such as the EXPORT_FORMATS environment variable
+
+    :param formats: Format names, e.g. "txt,srt", where an empty string means none
+    :return: Tuple of the formats, in the order given and without duplicates
+    """
+    parsed = []
+    for name in formats.split(","):
+        name = name.strip().lower().lstrip(".")
+        if name == "":
+            continue
+        if name not in EXPORT_CONTENT_TYPES:
+            raise ValueError(f"Unknown export format '{name}'")
+        if name not in parsed:
+            parsed.append(name)
+    return tuple(parsed)
+
+def format_caption_timestamp(time_in_seconds, decimal_marker):
+    """
+    Formats a time for a caption cue, which SubRip writes as 00:01:02,345 and WebVTT as 00:01:02.345
+
+    :param time_in_seconds: Time in seconds
+    :param decimal_marker: Character between the seconds and the milliseconds
+    :return: Formatted timestamp
+    """
+    milliseconds = round(time_in_seconds * 1000)
+    hours, milliseconds = divmod(milliseconds, 3600000)
+    minutes, milliseconds = divmod(milliseconds, 60000)
+    seconds, milliseconds = divmod(milliseconds, 1000)
+    return f"{hours:02d}:{minutes:02d}:{seconds:02d}{decimal_marker}{milliseconds:03d}"
+
+def caption_cues(segment):
+    """
+    Splits a speech segment into caption cues that are short enough to read, breaking between words whenever a
+    cue would otherwise run longer than CAPTION_MAX_DURATION seconds or CAPTION_MAX_CHARACTERS characters
+
+    :param segment: Speech segment to split
+    :return: Generator of (start time, end time, text) tuples
+    """
+    words = segment.words
+    cueStart = segment.wordStart
+    cueLength = 0
+    for position in range(segment.wordStart, segment.wordEnd):
+        wordLength = len(words.text[position])
+        if position > cueStart and (cueLength + 1 + wordLength > CAPTION_MAX_CHARACTERS or
+                                    words.endTime[position] - words.startTime[cueStart] > CAPTION_MAX_DURATION):
+            yield words.startTime[cueStart], words.endTime[position - 1], " ".join(words.text[cueStart:position])
+            cueStart = position
+            cueLength = 0
+        cueLength += wordLength if position == cueStart else 1 + wordLength
+    if segment.wordEnd > cueStart:
+        yield (words.startTime[cueStart], words.endTime[segment.wordEnd - 1],
+               " ".join(words.text[cueStart:segment.wordEnd]))
+
+class ExportWriter:
+    """
+    Gathers the text of an export file and writes it, UTF-8 encoded, to the output in large blocks
+    """
+
+    def __init__(self, output):
+        self.output = output
+        self.parts = []
+        self.length = 0
+
+    def write(self, text):
+        self.parts.append(text)
+        self.length += len(text)
+        if self.length >= STREAM_WRITE_SIZE:
+            self.flush()
+
+    def flush(self):
+        if len(self.parts) > 0:
+            self.output.write("".join(self.parts).encode("utf-8"))
+            self.parts = []
+            self.length = 0
+
+def write_exports(speech_segments, outputs):
+    """
+    Writes the transcript in any of the export formats, making a single pass over the speech segments however
+    many formats are asked for.  The text export matches the lines of the .docx, the captions are split into
+    readable cues with the speaker named in each, and the CSV has a row for every word
+
+    :param speech_segments: Turn-by-turn speech list
+    :param outputs: Dictionary of export format -> writable binary file-like object
+    """
+    writers = {name: ExportWriter(output) for name, output in outputs.items()}
+    txt = writers.get(EXPORT_TXT)
+    srt = writers.get(EXPORT_SRT)
+    vtt = writers.get(EXPORT_VTT)
+    words = None
+    if vtt is not None:
+        vtt.write("WEBVTT\n\n")
+    if EXPORT_CSV in writers:
+        words = csv.writer(writers[EXPORT_CSV])
+        words.writerow(["Segment", "Speaker", "StartTime", "EndTime", "Confidence", "Word"])
+
+    cueNumber = 0
+    for segmentNumber, segment in enumerate(speech_segments, start=1):
+        speaker = format_speaker_label(segment.segmentSpeaker)
+        if txt is not None:
+            txt.write("[" + convert_timestamp(segment.segmentStartTime) + "] " + speaker + ": " +
+                      segment.segmentText + "\n")
+        if srt is not None or vtt is not None:
+            for startTime, endTime, text in caption_cues(segment):
+                cueNumber += 1
+                if srt is not None:
+                    srt.write(f"{cueNumber}\n{format_caption_timestamp(startTime, ',')} --> "
+                              f"{format_caption_timestamp(endTime, ',')}\n{speaker}: {text}\n\n")
+                if vtt is not None:
+                    vtt.write(f"{format_caption_timestamp(startTime, '.')} --> "
+                              f"{format_caption_timestamp(endTime, '.')}\n<v {escape(speaker)}>{escape(text)}\n\n")
+        if words is not None:
+            segmentWords = segment.words
+            for position in range(segment.wordStart, segment.wordEnd):
+                words.writerow([segmentNumber, speaker, segmentWords.startTime[position],
+                                segmentWords.endTime[position], segmentWords.confidence[position],
+                                segmentWords.text[position]])
+
+    for writer in writers.values():
+        writer.flush()
+
+def save_export_files(output_file, speech_segments, formats):
+    """
+    Saves the export formats as local files next to a document, for the command line
+
+    :param output_file: Filename of the .docx, whose extension is swapped for each format
+    :param speech_segments: Turn-by-turn speech list
+    :param formats: Export formats to save
+    :return: List of the filenames that were saved
+    """
+    filenames = [os.path.splitext(output_file)[0] + "." + name for name in formats]
+    with ExitStack() as stack:
+        outputs = {name: stack.enter_context(open(filename, "wb")) for name, filename in zip(formats, filenames)}
+        write_exports(speech_segments, outputs)
+    return filenames
+
+def save_artifacts(bucket, key_prefix, data, speech_segments, job_info, formats):
+    """
+    Saves the transcript sidecar and any export formats next to the document in S3.  Everything is written in
+    one pass and the uploads then finish concurrently.  These are extras to the document, so an upload that
+    fails is logged and left out rather than failing the job
+
+    :param bucket: Output bucket
+    :param key_prefix: Output key of the document, without the .docx extension
+    :param data: JSON result data from Transcribe
+    :param speech_segments: Turn-by-turn speech list
+    :param job_info: Status details of the Transcribe job
+    :param formats: Export formats to save
+    :return: Dictionary of artifact name -> s3uri, for the artifacts that were saved
+    """
+    client = get_client("s3")
+    uploads = {"sidecar": S3MultipartWriter(client, bucket, key_prefix + SIDECAR_EXTENSION)}
+    for name in formats:
+        uploads[name] = S3MultipartWriter(client, bucket, key_prefix + "." + name,
+                                          content_type=EXPORT_CONTENT_TYPES[name])
+    try:
+        save_sidecar(uploads["sidecar"], data, speech_segments, job_info)
+        write_exports(speech_segments, {name: uploads[name] for name in formats})
+    except Exception:
+        for upload in uploads.values():
+            upload.abort()
+        raise
+
+    artifacts = {}
+    with ThreadPoolExecutor(max_workers=len(uploads)) as executor:
+        closes = {name: executor.submit(upload.close) for name, upload in uploads.items()}
+    for name, close in closes.items():
+        try:
+            close.result()
+            artifacts[name] = f"s3://{bucket}/{uploads[name].key}"
+        except Exception as e:
+            print(f"Failed to save {uploads[name].key}: {e}")
+    return artifacts
+
 def find_bucket_key(s3_url_or_uri):
     """
     This is a helper function that given an s3 path such that the path is of
@@ -474,37 +1246,297 @@ def find_bucket_key(s3_url_or_uri):
             s3_key = '/'.join(s3_components[2:])
         return s3_bucket, s3_key, s3_qs
 
-def get_json(download_url):
+def load_transcript(stream, stats=None):
+    """
+    Incrementally reads a Transcribe JSON results document from a file-like object.  The large result arrays are
+    decoded one entry at a time as they arrive, so neither the raw document nor its text is ever held in memory
+    in full.  The full-text "transcripts" entry isn't used by the segmentation code, so it is skipped over.
+
+    The decoded entries themselves are all kept, with their keys and timings shared, so the parsed results are in
+    memory until segmentation has run.  Segmentation looks each word up in the items by its timing or position,
+    and Transcribe writes the speaker segments ahead of the items, so segments aren't built as entries arrive
+
+    :param stream: Binary or text file-like object holding the JSON document
+    :param stats: (optional) TranscriptStats to record the size of the document in
+    :return: Transcript data, with the same structure as the parsed JSON document
+    """
+    reader = JsonStreamReader(stream)
+    transcript = {}
+    for key in reader.iter_object():
+        if key != "results" or reader.peek() != "{":
+            transcript[key] = reader.read_value()
+            continue
+        transcript["results"] = results = {}
+        for resultKey in reader.iter_object():
+            if resultKey == "transcripts":
+                reader.skip_value()
+                results[resultKey] = []
+            elif resultKey in ("items", "audio_segments") and reader.peek() == "[":
+                results[resultKey] = list(reader.iter_values())
+            elif resultKey in ("speaker_labels", "channel_labels") and reader.peek() == "{":
+                # Stream the per-segment or per-channel array, each of which holds its own list of items
+                results[resultKey] = labels = {}
+                for labelKey in reader.iter_object():
+                    if labelKey == "segments" and reader.peek() == "[":
+                        labels[labelKey] = list(reader.iter_values())
+                    elif labelKey == "channels" and reader.peek() == "[":
+                        labels[labelKey] = [load_channel(reader) for _ in reader.iter_array()]
+                    else:
+                        labels[labelKey] = reader.read_value()
+            else:
+                results[resultKey] = reader.read_value()
+    if stats is not None:
+        stats.transcriptBytes = reader.bytesRead
+    return transcript
+
+def load_channel(reader):
+    """
+    Reads a single channel result from a streaming transcript, decoding its items one at a time
+
+    :param reader: JsonStreamReader positioned at the channel object
+    :return: Channel result, with the same structure as the parsed JSON
+    """
+    if reader.peek() != "{":
+        return reader.read_value()
+    channel = {}
+    for key in reader.iter_object():
+        if key == "items" and reader.peek() == "[":
+            channel[key] = list(reader.iter_values())
+        else:
+            channel[key] = reader.read_value()
+    return channel
+
+def write_sidecar_column(output, values):
+    """
+    Writes an array to a sidecar in little-endian byte order
+
+    :param output: Writable binary file-like object
+    :param values: array of numbers
+    """
+    if sys.byteorder != "little":
+        values = array(values.typecode, values)
+        values.byteswap()
+    output.write(values.tobytes())
+
+def save_sidecar(output, data, speech_segments, job_info=None):
+    """
+    Saves the speech segments of a transcript as a compact binary sidecar, which load_sidecar() can map straight
+    back in to render the document again without the Transcribe JSON.  After a fixed header and some JSON metadata,
+    padded to 8 bytes, are the word confidence, start and end times as float64 columns, the segment start and end
+    times as float64, the segments' first word, end word and speaker as uint32, the word offsets into the text as
+    uint32, and finally the UTF-8 text of every word
+
+    :param output: Writable binary file-like object
+    :param data: JSON output from the transcription job, of which only the job name and mode are kept
+    :param speech_segments: List of call speech segments
+    :param job_info: (optional) Status of the Transcribe job, of which only what the document shows is kept
+    """
+    # Gather the segments' words into contiguous columns, whether or not they share a TranscriptWords
+    confidence, startTime, endTime = array("d"), array("d"), array("d")
+    wordStart, wordEnd, speakerIndex = array("I"), array("I"), array("I")
+    textOffsets = array("I", [0])
+    text = bytearray()
+    speakers = {}
+    for segment in speech_segments:
+        words = segment.words
+        wordStart.append(len(confidence))
+        confidence.extend(words.confidence[segment.wordStart:segment.wordEnd])
+        startTime.extend(words.startTime[segment.wordStart:segment.wordEnd])
+        endTime.extend(words.endTime[segment.wordStart:segment.wordEnd])
+        for word in words.text[segment.wordStart:segment.wordEnd]:
+            text += word.encode("utf-8")
+            textOffsets.append(len(text))
+        wordEnd.append(len(confidence))
+        speakerIndex.append(speakers.setdefault(segment.segmentSpeaker, len(speakers)))
+
+    # Keep just enough of the results to tell write() which mode the transcript was in
+    results = {}
+    if "speaker_labels" in data["results"] and data["results"]["speaker_labels"] is not None:
+        results["speaker_labels"] = {}
+    elif "channel_labels" in data["results"]:
+        results["channel_labels"] = {}
+    elif "audio_segments" in data["results"]:
+        results["audio_segments"] = []
+    if "language_codes" in data["results"]:
+        results["language_codes"] = data["results"]["language_codes"]
+    jobInfo = None
+    if job_info is not None:
+        jobInfo = {name: job_info[name] for name in SIDECAR_JOB_INFO_KEYS if name in job_info}
+        if "CreationTime" in jobInfo:
+            jobInfo["CreationTime"] = jobInfo["CreationTime"].isoformat()
+
+    metadata = json.dumps({"jobName": data["jobName"], "source": data.get("source"), "results": results,
+                           "jobInfo": jobInfo, "words": len(confidence), "segments": len(speech_segments),
+                           "speakers": list(speakers), "textBytes": len(text)}).encode("utf-8")
+    metadata += b" " * (-(SIDECAR_HEADER.size + len(metadata)) % 8)
+    output.write(SIDECAR_HEADER.pack(SIDECAR_MAGIC, SIDECAR_VERSION, 0, len(metadata)))
+    output.write(metadata)
+    segmentStart = array("d", (segment.segmentStartTime for segment in speech_segments))
+    segmentEnd = array("d", (segment.segmentEndTime for segment in speech_segments))
+    for column in (confidence, startTime, endTime, segmentStart, segmentEnd, wordStart, wordEnd, speakerIndex,
+                   textOffsets):
+        write_sidecar_column(output, column)
+    output.write(text)
+
+def is_sidecar(filename):
+    """
+    Checks whether a file is a transcript sidecar rather than Transcribe JSON
+
+    :param filename: Path of the file
+    :return: True if the file starts with the sidecar's magic number
+    """
+    with open(filename, "rb") as f:
+        return f.read(len(SIDECAR_MAGIC)) == SIDECAR_MAGIC
+
+def load_sidecar(filename):
+    """
+    Loads a transcript sidecar written by save_sidecar().  The file is memory-mapped and its numeric columns are
+    used in place as typed views, so only the small segment objects are built and the word text is only decoded
+    as it is rendered
+
+    :param filename: Path of the sidecar
+    :return: Tuple of the transcript data for write(), the list of speech segments, and the job info (or None)
+    """
+    with open(filename, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    magic, version, _, metadataLength = SIDECAR_HEADER.unpack_from(view)
+    if magic != SIDECAR_MAGIC or version != SIDECAR_VERSION:
+        raise ValueError(f"{filename} is not a version {SIDECAR_VERSION} transcript sidecar")
+    metadata = json.loads(bytes(view[SIDECAR_HEADER.size:SIDECAR_HEADER.size + metadataLength]))
+    position = SIDECAR_HEADER.size + metadataLength
+
+    def column(typecode, count):
+        nonlocal position
+        end = position + count * array(typecode).itemsize
+        values = view[position:end].cast(typecode)
+        if sys.byteorder != "little":
+            values = array(typecode, values)
+            values.byteswap()
+        position = end
+        return values
+
+    wordCount = metadata["words"]
+    segmentCount = metadata["segments"]
+    words = TranscriptWords()
+    words.confidence = column("d", wordCount)
+    words.startTime = column("d", wordCount)
+    words.endTime = column("d", wordCount)
+    segmentStart = column("d", segmentCount)
+    segmentEnd = column("d", segmentCount)
+    wordStart = column("I", segmentCount)
+    wordEnd = column("I", segmentCount)
+    speakerIndex = column("I", segmentCount)
+    textOffsets = column("I", wordCount + 1)
+    words.text = SidecarText(view[position:position + metadata["textBytes"]], textOffsets)
+
+    speech_segments = []
+    for index in range(segmentCount):
+        segment = SpeechSegment(words)
+        segment.segmentStartTime = segmentStart[index]
+        segment.segmentEndTime = segmentEnd[index]
+        segment.segmentSpeaker = metadata["speakers"][speakerIndex[index]]
+        segment.wordStart = wordStart[index]
+        segment.wordEnd = wordEnd[index]
+        speech_segments.append(segment)
+
+    job_info = metadata["jobInfo"]
+    if job_info is not None and "CreationTime" in job_info:
+        job_info["CreationTime"] = dt.fromisoformat(job_info["CreationTime"])
+    data = {"jobName": metadata["jobName"], "results": metadata["results"]}
+    if metadata.get("source"):
+        data["source"] = metadata["source"]
+    return data, speech_segments, job_info
+
+def get_json(download_url, stats=None):
     bucket, key, qs = find_bucket_key(download_url)
     if len(qs) > 0:
         # Transcription is available via signed URL
         try:
             with urlopen(download_url) as f:
-                file_content = f.read().decode('utf-8')
-                transcript = json.loads(file_content)
+                transcript = load_transcript(f, stats)
         except Exception as e:
             print(f"Error downloading from: {download_url}. Exception: {e}")
+            raise
     else:
         # Transcription stored in a bucket
         try:
-            transcription = s3.get_object(Bucket=bucket, Key=key)
-            file_content = transcription['Body'].read().decode('utf-8')
-            transcript = json.loads(file_content)
+            transcription = get_client("s3").get_object(Bucket=bucket, Key=key)
+            transcript = load_transcript(transcription['Body'], stats)
         except Exception as e:
             print(e)
             print(f"Error retrieving file from bucket={bucket}, key={key}.")
             raise
     return transcript
 
-def merge_speaker_segments(input_segment_list):
+def index_pronunciations(items):
+    """
+    Builds a one-time index over a Transcribe items array, so that each word can be looked up by its timing
+    rather than by re-scanning the whole array.  Where more than one pronunciation shares the same timing we
+    record both the first and the last, as the word content comes from the last but any trailing punctuation
+    follows the first
+
+    :param items: Transcribe "items" array, either the top-level one or a channel's one
+    :return: Dictionary of (start_time, end_time) -> [first position, last position]
+    """
+    index = {}
+    for position, item in enumerate(items):
+        if item["type"] == "pronunciation":
+            index.setdefault((item["start_time"], item["end_time"]), [position, position])[1] = position
+    return index
+
+def select_best_alternative(item):
+    """
+    Picks the highest-confidence alternative for a pronunciation item.  Redacted words carry no confidence
+    on the alternative itself, so in that case we fall back to the first alternative and take its score
+    from the redaction entry
+
+    :param item: Transcribe pronunciation item
+    :return: Tuple of the chosen alternative and its confidence score
+    """
+    alternatives = item["alternatives"]
+    if len(alternatives) == 1 and "confidence" in alternatives[0]:
+        result = alternatives[0]
+    elif len(alternatives) > 1 and all("confidence" in alt for alt in alternatives):
+        # Last of the highest-scoring alternatives, to match a stable sort by confidence
+        result = alternatives[0]
+        for alt in alternatives[1:]:
+            if alt["confidence"] >= result["confidence"]:
+                result = alt
+    else:
+        result = alternatives[0]
+        return result, float(result["redactions"][0]["confidence"])
+    return result, float(result["confidence"])
+
+def next_punctuation(items, position):
+    """
+    Returns any punctuation that immediately follows the item at the given position
+
+    :param items: Transcribe "items" array holding the word
+    :param position: Position of the word in the array
+    :return: Punctuation text, or an empty string if the next item isn't punctuation
+    """
+    if position + 1 < len(items):
+        next_item = items[position + 1]
+        if next_item["type"] == "punctuation":
+            return next_item["alternatives"][0]["content"]
+    return ""
+
+def merge_speaker_segments(input_segment_list, words=None, stats=None):
     """
     Merges together consecutive speaker segments unless:
     a) There is a speaker change, or
     b) The gap between segments is greater than our acceptable level of delay
 
-    :param input_segment_list: Full time-sorted list of speaker segments
+    The words of the merged segments are copied, in order, into a single shared TranscriptWords
+
+    :param input_segment_list: Time-sorted list, or stream, of speaker segments
+    :param words: (optional) TranscriptWords to hold the merged segments' words
+    :param stats: (optional) TranscriptStats to accumulate each merged segment into once it is complete
     :return: An updated segment list
     """
+    if words is None:
+        words = TranscriptWords()
     outputSegmentList = []
     lastSpeaker = ""
     lastSegment = None
@@ -513,23 +1545,71 @@ def merge_speaker_segments(input_segment_list):
     for segment in input_segment_list:
         if (segment.segmentSpeaker != lastSpeaker) or \
                 ((segment.segmentStartTime - lastSegment.segmentEndTime) >= START_NEW_SEGMENT_DELAY):
-            # Simple case - speaker change or > n-second gap means new output segment
-            outputSegmentList.append(segment)
+            # Simple case - speaker change or > n-second gap means new output segment, and the last one is done
+            if stats is not None and lastSegment is not None:
+                stats.add_segment(lastSegment)
+            lastSegment = SpeechSegment(words)
+            lastSegment.segmentStartTime = segment.segmentStartTime
+            lastSegment.segmentSpeaker = segment.segmentSpeaker
+            outputSegmentList.append(lastSegment)
 
             # This is now our base segment moving forward
             lastSpeaker = segment.segmentSpeaker
-            lastSegment = segment
-        else:
-            # Same speaker, short time, need to copy this info to the last one
-            lastSegment.segmentEndTime = segment.segmentEndTime
-            lastSegment.segmentText += " " + segment.segmentText
-            segment.segmentConfidence[0]["text"] = " " + segment.segmentConfidence[0]["text"]
-            for wordConfidence in segment.segmentConfidence:
-                lastSegment.segmentConfidence.append(wordConfidence)
 
+        # Copy this segment's words onto the end of the output segment
+        lastSegment.segmentEndTime = segment.segmentEndTime
+        words.extend(segment.words, segment.wordStart, segment.wordEnd)
+        lastSegment.wordEnd = len(words)
+
+    if stats is not None and lastSegment is not None:
+        stats.add_segment(lastSegment)
     return outputSegmentList
 
-def create_turn_by_turn_segments(data, isSpeakerMode=False, isChannelMode=False, isAudioSegmentsMode=False):
+def generate_channel_segments(channel):
+    """
+    Generates the speech segments for a single channel of a channel-separated transcript, in time order.  A new
+    segment is started whenever there is any noticeable pause between words
+
+    :param channel: Transcribe channel result, holding the channel label and its items
+    :return: Generator of speech segments for this channel
+    """
+    items = channel["items"]
+    itemIndex = index_pronunciations(items)
+
+    # We have the same speaker all the way through this channel
+    nextSpeaker = str(channel["channel_label"])
+    nextSpeechSegment = None
+    lastEndTime = 0.0
+    for word in items:
+        # Pick out our next data from a 'pronunciation'
+        if word["type"] == "pronunciation":
+            nextStartTime = float(word["start_time"])
+            nextEndTime = float(word["end_time"])
+
+            # If this is the first word, or the pause is not very small, then start a new text segment.  Each
+            # one holds its own words until they are merged into the shared transcript
+            if (nextSpeechSegment is None) or ((nextStartTime - lastEndTime) > 0.1):
+                if nextSpeechSegment is not None:
+                    yield nextSpeechSegment
+                nextSpeechSegment = SpeechSegment()
+                nextSpeechSegment.segmentStartTime = nextStartTime
+                nextSpeechSegment.segmentSpeaker = nextSpeaker
+            nextSpeechSegment.segmentEndTime = nextEndTime
+            lastEndTime = nextEndTime
+
+            # Get the word with the highest confidence
+            firstPosition, lastPosition = itemIndex[(word["start_time"], word["end_time"])]
+            result, confidence = select_best_alternative(items[lastPosition])
+
+            # Add the word and confidence to this segment, and if the next item is
+            # punctuation then add it to the current word
+            nextSpeechSegment.add_word(result["content"] + next_punctuation(items, firstPosition),
+                                       confidence, nextStartTime, nextEndTime)
+
+    if nextSpeechSegment is not None:
+        yield nextSpeechSegment
+
+def create_turn_by_turn_segments(data, isSpeakerMode=False, isChannelMode=False, isAudioSegmentsMode=False, stats=None):
     """
     This creates a list of per-turn speech segments based upon the transcript data.  It has to work in three modes:
         a) Speaker-separated audio
@@ -540,18 +1620,22 @@ def create_turn_by_turn_segments(data, isSpeakerMode=False, isChannelMode=False,
     :param isSpeakerMode: (optional) Boolean indicating whether the audio was speaker-separated
     :param isChannelMode: (optional) Boolean indicating whether the audio was channel-separated
     :param isAudioSegmentsMode: (optional) Boolean indicating whether the audio was segments-separated
+    :param stats: (optional) TranscriptStats to accumulate each segment into as soon as it is complete
     :return: List of transcription speech segments
     """
     speechSegmentList = []
+    words = TranscriptWords()
 
     lastSpeaker = ""
     lastEndTime = 0.0
-    skipLeadingSpace = False
-    confidenceList = []
     nextSpeechSegment = None
 
     # Process a Speaker-separated non-analytics file
     if isSpeakerMode:
+        # Index the items once, rather than searching them for every word
+        items = data["results"]["items"]
+        itemIndex = index_pronunciations(items)
+
         # A segment is a blob of pronunciation and punctuation by an individual speaker
         for segment in data["results"]["speaker_labels"]["segments"]:
 
@@ -564,13 +1648,12 @@ def create_turn_by_turn_segments(data, isSpeakerMode=False, isChannelMode=False,
 
                 # If we've changed speaker, or there's a gap, create a new row
                 if (nextSpeaker != lastSpeaker) or ((nextStartTime - lastEndTime) >= START_NEW_SEGMENT_DELAY):
-                    nextSpeechSegment = SpeechSegment()
+                    if stats is not None and nextSpeechSegment is not None:
+                        stats.add_segment(nextSpeechSegment)
+                    nextSpeechSegment = SpeechSegment(words)
                     speechSegmentList.append(nextSpeechSegment)
                     nextSpeechSegment.segmentStartTime = nextStartTime
                     nextSpeechSegment.segmentSpeaker = nextSpeaker
-                    skipLeadingSpace = True
-                    confidenceList = []
-                    nextSpeechSegment.segmentConfidence = confidenceList
                 nextSpeechSegment.segmentEndTime = nextEndTime
 
                 # Note the speaker and end time of this segment for the next iteration
@@ -581,174 +1664,214 @@ def create_turn_by_turn_segments(data, isSpeakerMode=False, isChannelMode=False,
                 for word in segment["items"]:
 
                     # Get the word with the highest confidence
-                    pronunciations = list(filter(lambda x: x["type"] == "pronunciation", data["results"]["items"]))
-                    word_result = list(filter(lambda x: x["start_time"] == word["start_time"] and x["end_time"] == word["end_time"], pronunciations))
-                    try:
-                        result = sorted(word_result[-1]["alternatives"], key=lambda x: x["confidence"])[-1]
-                        confidence = float(result["confidence"])
-                    except Exception:
-                        result = word_result[-1]["alternatives"][0]
-                        confidence = float(result["redactions"][0]["confidence"])
-
-                    # Write the word, and a leading space if this isn't the start of the segment
-                    if skipLeadingSpace:
-                        skipLeadingSpace = False
-                        wordToAdd = result["content"]
-                    else:
-                        wordToAdd = " " + result["content"]
-
-                    # If the next item is punctuation, add it to the current word
-                    try:
-                        word_result_index = data["results"]["items"].index(word_result[0])
-                        next_item = data["results"]["items"][word_result_index + 1]
-                        if next_item["type"] == "punctuation":
-                            wordToAdd += next_item["alternatives"][0]["content"]
-                    except IndexError:
-                        pass
-
-                    nextSpeechSegment.segmentText += wordToAdd
-                    confidenceList.append({"text": wordToAdd,
-                                           "confidence": confidence,
-                                           "start_time": float(word["start_time"]),
-                                           "end_time": float(word["end_time"])})
+                    firstPosition, lastPosition = itemIndex[(word["start_time"], word["end_time"])]
+                    result, confidence = select_best_alternative(items[lastPosition])
+
+                    # Add the word, and if the next item is punctuation then add it to the current word
+                    nextSpeechSegment.add_word(result["content"] + next_punctuation(items, firstPosition),
+                                               confidence, float(word["start_time"]), float(word["end_time"]))
 
     # Process a Channel-separated non-analytics file
     elif isChannelMode:
 
-        # A channel contains all pronunciation and punctuation from a single speaker
-        for channel in data["results"]["channel_labels"]["channels"]:
-
-            # If there is content in the channel then start processing it
-            if len(channel["items"]) > 0:
-
-                # We have the same speaker all the way through this channel
-                nextSpeaker = str(channel["channel_label"])
-                for word in channel["items"]:
-                    # Pick out our next data from a 'pronunciation'
-                    if word["type"] == "pronunciation":
-                        nextStartTime = float(word["start_time"])
-                        nextEndTime = float(word["end_time"])
-
-                        # If we've changed speaker, or we haven't and the
-                        # pause is very small, then start a new text segment
-                        if (nextSpeaker != lastSpeaker) or\
-                                ((nextSpeaker == lastSpeaker) and ((nextStartTime - lastEndTime) > 0.1)):
-                            nextSpeechSegment = SpeechSegment()
-                            speechSegmentList.append(nextSpeechSegment)
-                            nextSpeechSegment.segmentStartTime = nextStartTime
-                            nextSpeechSegment.segmentSpeaker = nextSpeaker
-                            skipLeadingSpace = True
-                            confidenceList = []
-                            nextSpeechSegment.segmentConfidence = confidenceList
-                        nextSpeechSegment.segmentEndTime = nextEndTime
-
-                        # Note the speaker and end time of this segment for the next iteration
-                        lastSpeaker = nextSpeaker
-                        lastEndTime = nextEndTime
-
-                        # Get the word with the highest confidence
-                        pronunciations = list(filter(lambda x: x["type"] == "pronunciation", channel["items"]))
-                        word_result = list(filter(lambda x: x["start_time"] == word["start_time"] and x["end_time"] == word["end_time"], pronunciations))
-                        try:
-                            result = sorted(word_result[-1]["alternatives"], key=lambda x: x["confidence"])[-1]
-                            confidence = float(result["confidence"])
-                        except Exception:
-                            result = word_result[-1]["alternatives"][0]
-                            confidence = float(result["redactions"][0]["confidence"])
-
-                        # Write the word, and a leading space if this isn't the start of the segment
-                        if (skipLeadingSpace):
-                            skipLeadingSpace = False
-                            wordToAdd = result["content"]
-                        else:
-                            wordToAdd = " " + result["content"]
-
-                        # If the next item is punctuation, add it to the current word
-                        try:
-                            word_result_index = channel["items"].index(word_result[0])
-                            next_item = channel["items"][word_result_index + 1]
-                            if next_item["type"] == "punctuation":
-                                wordToAdd += next_item["alternatives"][0]["content"]
-                        except IndexError:
-                            pass
-
-                        # Finally, add the word and confidence to this segment's list
-                        nextSpeechSegment.segmentText += wordToAdd
-                        confidenceList.append({"text": wordToAdd,
-                                               "confidence": confidence,
-                                               "start_time": float(word["start_time"]),
-                                               "end_time": float(word["end_time"])})
-
-        # Sort the segments, as they are in channel-order and not speaker-order, then
-        # merge together turns from the same speaker that are very close together
-        speechSegmentList = sorted(speechSegmentList, key=lambda segment: segment.segmentStartTime)
-        speechSegmentList = merge_speaker_segments(speechSegmentList)
+        # A channel contains all pronunciation and punctuation from a single speaker, and is already in time
+        # order, so we interleave the channels' segments as they are produced and merge together turns from
+        # the same speaker that are very close together in the same pass
+        channelSegments = [generate_channel_segments(channel)
+                           for channel in data["results"]["channel_labels"]["channels"] if len(channel["items"]) > 0]
+        speechSegmentList = merge_speaker_segments(heapq.merge(*channelSegments,
+                                                               key=lambda segment: segment.segmentStartTime),
+                                                   words, stats)
 
     # Process an Audio-segment non-analytics file
     elif isAudioSegmentsMode:
+        items = data["results"]["items"]
         for segment in data["results"]["audio_segments"]:
-            nextSpeechSegment = SpeechSegment()
-            nextSpeechSegment.segmentStartTime = float(segment["start_time"])
-            nextSpeechSegment.segmentEndTime = float(segment["end_time"])
-            nextSpeechSegment.segmentText = segment["transcript"]
-            nextSpeechSegment.segmentSpeaker = ""  # Default speaker label for audio segments
-            confidenceList = []
- 
+            nextStartTime = float(segment["start_time"])
+            nextEndTime = float(segment["end_time"])
+
+            # Check if new segment based on the delay. There are no speaker or channels like the previous two
+            # modes so we can't check that.  Either way, this audio segment's words go on the end of the transcript
+            if not speechSegmentList or (nextStartTime - speechSegmentList[-1].segmentEndTime) >= START_NEW_SEGMENT_DELAY:
+                if stats is not None and nextSpeechSegment is not None:
+                    stats.add_segment(nextSpeechSegment)
+                nextSpeechSegment = SpeechSegment(words)
+                nextSpeechSegment.segmentStartTime = nextStartTime
+                nextSpeechSegment.segmentSpeaker = ""  # Default speaker label for audio segments
+                speechSegmentList.append(nextSpeechSegment)
+            nextSpeechSegment.segmentEndTime = nextEndTime
+
+            audioSegmentStart = len(words)
             for item_id in segment["items"]:
-                item = data["results"]["items"][item_id]
+                item = items[item_id]
                 if item["type"] == "pronunciation":
+                    # Redacted words only carry a confidence score on their redaction entry
                     word_result = item["alternatives"][0]
-                    confidence = float(word_result["confidence"])
-                    wordToAdd = word_result["content"]
-                    if confidenceList:
-                        wordToAdd = " " + wordToAdd  # Add space before each word except the first one
-                    confidenceList.append({
-                        "text": wordToAdd,
-                        "confidence": confidence,
-                        "start_time": float(item["start_time"]),
-                        "end_time": float(item["end_time"])
-                    })
-                elif item["type"] == "punctuation":
-                    word_result = item["alternatives"][0]
-                    wordToAdd = word_result["content"]
-                    if confidenceList:
-                        confidenceList[-1]["text"] += wordToAdd  # Last word
- 
-            nextSpeechSegment.segmentConfidence = confidenceList
- 
-             # Check if new segment based on the delay. There are no speaker or channels like the previous two modes so we can't check that
-            if speechSegmentList and (nextSpeechSegment.segmentStartTime - speechSegmentList[-1].segmentEndTime) >= START_NEW_SEGMENT_DELAY:
-                speechSegmentList.append(nextSpeechSegment)
-            else:
-                if speechSegmentList:
-                    speechSegmentList[-1].segmentEndTime = nextSpeechSegment.segmentEndTime
-                    speechSegmentList[-1].segmentText += " " + nextSpeechSegment.segmentText
-                    for wordConfidence in confidenceList:
-                        speechSegmentList[-1].segmentConfidence.append(wordConfidence)
-                else:
-                    speechSegmentList.append(nextSpeechSegment)
- 
+                    confidence = word_result["confidence"] if "confidence" in word_result \
+                        else word_result["redactions"][0]["confidence"]
+                    nextSpeechSegment.add_word(word_result["content"], float(confidence),
+                                               float(item["start_time"]), float(item["end_time"]))
+                elif item["type"] == "punctuation" and len(words) > audioSegmentStart:
+                    # Punctuation goes on the end of the last word
+                    words.text[-1] = intern(words.text[-1] + item["alternatives"][0]["content"])
+
+    # The last speaker or audio segment is only complete once every word has been added
+    if stats is not None and nextSpeechSegment is not None:
+        stats.add_segment(nextSpeechSegment)
+
     # Ensure segments are sorted by start_time before returning
     speechSegmentList = sorted(speechSegmentList, key=lambda segment: segment.segmentStartTime)
 
     # Return our full turn-by-turn speaker segment list
     return speechSegmentList
 
+def get_transcript_etag(download_url):
+    """
+    Finds the ETag of a transcript without downloading it.  Signed URLs only allow a GET, so for those just the
+    first byte is requested
+
+    :param download_url: Signed URL or S3 URL of the transcript
+    :return: ETag of the transcript object
+    """
+    bucket, key, qs = find_bucket_key(download_url)
+    if len(qs) > 0:
+        with urlopen(Request(download_url, headers={"Range": "bytes=0-0"})) as f:
+            return f.headers["ETag"]
+    return get_client("s3").head_object(Bucket=bucket, Key=key)["ETag"]
+
+def render_cache_key(job_name, transcript_etag):
+    """
+    Builds the key that identifies a rendered document - the same transcript rendered by the same code with the
+    same settings gives the same document, so one that was already saved with this key can be reused
+
+    :param job_name: Transcribe job name
+    :param transcript_etag: ETag of the transcript object
+    :return: Hex digest of the transcript and render settings
+    """
+    settings = [job_name, transcript_etag, RENDERER_VERSION, str(confidence_env),
+                document_title_env, os.environ.get("DOCX_RENDERER", ""),
+                template_env or "", ",".join(parse_export_formats(export_formats_env))]
+    return hashlib.sha256("\n".join(settings).encode("utf-8")).hexdigest()
+
+def find_cached_document(bucket, key, cache_key):
+    """
+    Looks for a document that was already rendered with the same render cache key
+
+    :param bucket: Output bucket
+    :param key: Output key of the document
+    :param cache_key: Render cache key of the transcript being processed
+    :return: The existing document's metadata, or None if there isn't a matching one
+    """
+    try:
+        metadata = get_client("s3").head_object(Bucket=bucket, Key=key)["Metadata"]
+    except Exception:
+        # Most likely not rendered yet
+        return None
+    # A document that doesn't list the artifacts saved alongside it is rendered again, so they are all saved
+    if metadata.get("render-key") != cache_key or "artifacts" not in metadata:
+        return None
+    return metadata
+
+def release_admission_slot(job_name):
+    """
+    Gives back the slot that a finished Transcribe job held under the concurrent job quota, so that audio_to_transcribe
+    can start another.  The job's marker is removed in the same transaction, so a retry does not release it twice
+
+    :param job_name: Transcribe job name
+    :return: True if the job held a slot
+    """
+    if admission_table_env is None:
+        return False
+    try:
+        get_client("dynamodb").transact_write_items(TransactItems=[
+            {"Delete": {
+                "TableName": admission_table_env,
+                "Key": {"PK": {"S": ADMISSION_PK}, "SK": {"S": ADMISSION_JOB_PREFIX + job_name}},
+                "ConditionExpression": "attribute_exists(SK)"}},
+            {"Update": {
+                "TableName": admission_table_env,
+                "Key": {"PK": {"S": ADMISSION_PK}, "SK": {"S": ADMISSION_COUNTER_SK}},
+                "UpdateExpression": "SET InFlight = InFlight - :one",
+                "ConditionExpression": "InFlight > :zero",
+                "ExpressionAttributeValues": {":zero": {"N": "0"}, ":one": {"N": "1"}}}},
+        ])
+        return True
+    except Exception as e:
+        # Either already released or started before admission control, which is fine, or an error that must not
+        # stop the transcript being delivered
+        print(f"No admission slot released for {job_name}: {e}")
+        return False
+
+@contextmanager
+def time_stage(metrics, name):
+    """
+    Context manager that records how long the code inside it took, whether or not it succeeded
+
+    :param metrics: Dictionary of metric name -> value to add the timing to
+    :param name: Name of the metric
+    """
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        metrics[name] = round(perf_counter() - start, 3)
+
+def peak_rss():
+    """
+    Returns the most memory that this process has held, which on a warm Lambda covers every job it has run
+
+    :return: Peak resident set size in bytes, or 0 where that cannot be found
+    """
+    try:
+        import resource
+    except ImportError:
+        return 0
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def emit_metrics(job_name, metrics):
+    """
+    Prints a job's metrics as a CloudWatch Embedded Metric Format log line, which CloudWatch turns into metrics
+
+    :param job_name: Transcribe job name, kept as a searchable property rather than a dimension
+    :param metrics: Dictionary of metric name -> value, named as in METRIC_UNITS
+    """
+    record = {
+        "_aws": {
+            "Timestamp": int(dt.now().timestamp() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": metrics_namespace_env,
+                "Dimensions": [["FunctionName"]],
+                "Metrics": [{"Name": name, "Unit": METRIC_UNITS[name]} for name in metrics]
+            }]
+        },
+        "FunctionName": os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "transcribe_to_docx"),
+        "JobName": job_name,
+    }
+    record.update(metrics)
+    print(json.dumps(record))
+
 def lambda_handler(event, context):
     """
     Entrypoint for the Lambda function.
     """
     print("transcribe_to_docx.lambda_handler started")
+    handler_start = perf_counter()
+    metrics = {}
 
     # Get environment variables
     BUCKET = os.environ["BUCKET"]               # S3 output bucket name
     DOCX_MAX_DURATION = float(os.environ['DOCX_MAX_DURATION'])   # Max transcription duration to process
+    export_formats = parse_export_formats(export_formats_env)
 
     # Attempt to retrieve job details
     job_status = event["detail"]["TranscriptionJobStatus"]
     job_name = event["detail"]["TranscriptionJobName"]
+
+    # The Transcribe job has finished, so its slot under the concurrent job quota is free for the next one
+    release_admission_slot(job_name)
     try:
-        job_info = ts_client.get_transcription_job(TranscriptionJobName=job_name)["TranscriptionJob"]
+        with time_stage(metrics, "GetJobTime"):
+            job_info = get_client("transcribe").get_transcription_job(TranscriptionJobName=job_name)["TranscriptionJob"]
         print(f"Job info: {job_info}")
     except Exception as e:
         # Can't retrieve job details, so we can't do anything
@@ -764,29 +1887,60 @@ def lambda_handler(event, context):
             }
         }
 
-    # Check duration and error if exceeded
-    if global_audio_duration > DOCX_MAX_DURATION:
-        default_message = f"Job name: {job_name}. Total transcription duration ({global_audio_duration:.1f}s) exceeded DOCX_MAX_DURATION ({DOCX_MAX_DURATION}s), download and finish command line using the available JSON."
-        lambda_message = f"Job name:<br><pre>{job_name}</pre><br>Total transcription duration ({global_audio_duration:.1f}s) exceeded DOCX_MAX_DURATION ({DOCX_MAX_DURATION}s), download and finish command line using the available JSON."
-        print(default_message)
-        title = "Transcription job stopped"
+    # Find the transcript JSON
+    if "RedactedTranscriptFileUri" in job_info["Transcript"]:
+        download_url = job_info["Transcript"]["RedactedTranscriptFileUri"]
+    else:
+        download_url = job_info["Transcript"]["TranscriptFileUri"]
+
+    # If this transcript has already been rendered with the same settings, by an earlier attempt or an earlier run
+    # today, then there is no need to download or render it again
+    output_file = job_info["TranscriptionJobName"] + ".docx"
+    key_prefix = today + "/" + job_info["TranscriptionJobName"]
+    key = key_prefix + ".docx"
+    s3uri = f"s3://{BUCKET}/{key}"
+    cache_key = None
+    try:
+        cache_key = render_cache_key(job_name, get_transcript_etag(download_url))
+    except Exception as e:
+        print(f"Unable to find the transcript ETag, so not using the render cache: {e}")
+    cached = find_cached_document(BUCKET, key, cache_key) if cache_key is not None else None
+    if cached is not None:
+        # Only the sidecar and exports that were saved before the document are listed in its metadata
+        artifacts = {"docx": s3uri}
+        for name in filter(None, cached["artifacts"].split(",")):
+            artifacts[name] = f"s3://{BUCKET}/{key_prefix}{SIDECAR_EXTENSION}" if name == "sidecar" \
+                else f"s3://{BUCKET}/{key_prefix}.{name}"
         deleteUploadFileHelper(job_status, job_info)
+        metrics["CacheHit"] = 1
+        metrics["TotalTime"] = round(perf_counter() - handler_start, 3)
+        emit_metrics(job_name, metrics)
+        title = "Transcription job completed"
+        print(f"{title}: Job Name: {job_name} Transcript already rendered at: {s3uri}")
         return {
-            'statusCode': 500,
+            'statusCode': 200,
             'body': {
+                'job': job_name,
+                'duration': cached["duration"],
+                'languages': cached["languages"],
+                'confidence': cached["confidence"],
+                'words': int(cached["words"]),
+                'speakers': int(cached["speakers"]),
+                'metrics': metrics,
+                'created': job_info["CreationTime"].strftime("%Y-%m-%d"),
                 'subject': title,
-                'lambda': lambda_message,
-                'default': default_message,
+                's3uri': s3uri,
+                'upload': job_info["Media"]["MediaFileUri"],
+                'sidecar': artifacts.get("sidecar"),
+                'artifacts': artifacts,
             }
         }
 
     # Try and download the transcript JSON
-    if "RedactedTranscriptFileUri" in job_info["Transcript"]:
-        download_url = job_info["Transcript"]["RedactedTranscriptFileUri"]
-    else:
-        download_url = job_info["Transcript"]["TranscriptFileUri"]
+    stats = TranscriptStats()
     try:
-        transcript = get_json(download_url)
+        with time_stage(metrics, "DownloadTime"):
+            transcript = get_json(download_url, stats)
     except Exception as e:
         print(e)
         title = "Transcription job failed"
@@ -801,13 +1955,14 @@ def lambda_handler(event, context):
             }
         }
 
-    # Check the job settings for speaker/channel/audio ID
+    # Check the job settings for speaker/channel/audio ID, gathering the statistics as the segments are built
+    segmentation_start = perf_counter()
     if "ChannelIdentification" in job_info["Settings"] and job_info["Settings"]["ChannelIdentification"]:
-        speech_segments = create_turn_by_turn_segments(transcript, isChannelMode = True)
+        speech_segments = create_turn_by_turn_segments(transcript, isChannelMode = True, stats = stats)
     elif "ShowSpeakerLabels" in job_info["Settings"] and job_info["Settings"]["ShowSpeakerLabels"]:
-        speech_segments = create_turn_by_turn_segments(transcript, isSpeakerMode = True)
+        speech_segments = create_turn_by_turn_segments(transcript, isSpeakerMode = True, stats = stats)
     elif "ChannelIdentification" in job_info["Settings"] and not job_info["Settings"]["ChannelIdentification"]:
-        speech_segments = create_turn_by_turn_segments(transcript, isAudioSegmentsMode = True)
+        speech_segments = create_turn_by_turn_segments(transcript, isAudioSegmentsMode = True, stats = stats)
     else:
         # We do not support non-speaker mode in this version
         title = "Transcription job failed"
@@ -822,16 +1977,53 @@ def lambda_handler(event, context):
             }
         }
 
-    # Write out the file
-    os.chdir("/tmp")
-    output_file = job_info["TranscriptionJobName"] + ".docx"
-    write(transcript, speech_segments, job_info, output_file)
+    metrics["SegmentationTime"] = round(perf_counter() - segmentation_start, 3)
+
+    # Check duration and error if exceeded
+    if stats.duration > DOCX_MAX_DURATION:
+        default_message = f"Job name: {job_name}. Total transcription duration ({stats.duration:.1f}s) exceeded DOCX_MAX_DURATION ({DOCX_MAX_DURATION}s), download and finish command line using the available JSON."
+        lambda_message = f"Job name:<br><pre>{job_name}</pre><br>Total transcription duration ({stats.duration:.1f}s) exceeded DOCX_MAX_DURATION ({DOCX_MAX_DURATION}s), download and finish command line using the available JSON."
+        print(default_message)
+        title = "Transcription job stopped"
+        deleteUploadFileHelper(job_status, job_info)
+        return {
+            'statusCode': 500,
+            'body': {
+                'subject': title,
+                'lambda': lambda_message,
+                'default': default_message,
+            }
+        }
 
-    # Upload file to S3
-    # Use bucket provided in the environment variable, plus today's date
-    key = today + "/" + output_file
+    # Save the segments as a sidecar next to the document, so that it can be re-rendered from the CLI without the
+    # Transcribe JSON, along with any export formats.  The document is what was asked for, so failing to save
+    # these is only logged.  They are saved first, so that the document's metadata can list the ones that exist
+    artifacts = {"docx": s3uri}
     try:
-        s3.upload_file(output_file, BUCKET, key)
+        with time_stage(metrics, "ExportTime"):
+            artifacts.update(save_artifacts(BUCKET, key_prefix, transcript, speech_segments, job_info,
+                                            export_formats))
+    except Exception as e:
+        print(f"Failed to save the transcript sidecar and exports: {e}")
+
+    # Write out the file straight into S3, using the bucket provided in the environment variable plus today's date.
+    # The statistics and saved artifacts are kept in its metadata along with the render cache key, for any later
+    # run to return
+    try:
+        with time_stage(metrics, "BuildTime"):
+            document, styleIds = build_document(transcript, speech_segments, job_info, stats)
+        metadata = {"duration": str(round(stats.duration, 2)), "languages": stats.languages,
+                    "confidence": str(round(stats.averageConfidence, 2)), "words": str(stats.wordCount),
+                    "speakers": str(len(stats.speakers)),
+                    "artifacts": ",".join(name for name in artifacts if name != "docx")}
+        if cache_key is not None:
+            metadata["render-key"] = cache_key
+        with S3MultipartWriter(get_client("s3"), BUCKET, key, metadata=metadata) as output:
+            with time_stage(metrics, "SaveTime"):
+                save_document(document, speech_segments, output, styleIds)
+            # Most parts are uploaded during the save, leaving just the final part and the completion
+            with time_stage(metrics, "UploadTime"):
+                output.close()
     except Exception as e:
         print(e)
         title = "Transcription job failed"
@@ -846,25 +2038,38 @@ def lambda_handler(event, context):
             }
         }
 
-    deleteUploadFileHelper(job_status, job_info)
+    with time_stage(metrics, "DeleteMediaTime"):
+        deleteUploadFileHelper(job_status, job_info)
+    metrics["TotalTime"] = round(perf_counter() - handler_start, 3)
+    metrics["TranscriptBytes"] = stats.transcriptBytes
+    metrics["Words"] = stats.wordCount
+    metrics["Segments"] = len(speech_segments)
+    metrics["PeakRSS"] = peak_rss()
+    metrics["CacheHit"] = 0
+    emit_metrics(job_name, metrics)
 
     title = "Transcription job completed"
-    s3uri = f"s3://{BUCKET}/{key}"
     print(f"{title}: Job Name: {job_name} Transcript available at: {s3uri}")
     lambda_message = f"Job Name:<br><pre>{job_name}</pre><br>Transcript available at:<br><pre>{s3uri}</pre>"
     default_message = f"Transcription job {job_name} completed. Transcript available at {s3uri}"
     creation_time = job_info["CreationTime"].strftime("%Y-%m-%d")
-    total_duration = str(round(global_audio_duration, 2))
+    total_duration = str(round(stats.duration, 2))
     return {
         'statusCode': 200,
         'body': {
             'job': job_name,
             'duration': total_duration,
-            'languages': global_languages,
-            'confidence': global_average_confidence,
+            'languages': stats.languages,
+            'confidence': str(round(stats.averageConfidence, 2)),
+            'words': stats.wordCount,
+            'speakers': len(stats.speakers),
+            'metrics': metrics,
             'created': creation_time,
             'subject': title,
             's3uri': s3uri,
+            'upload': job_info["Media"]["MediaFileUri"],
+            'sidecar': artifacts.get("sidecar"),
+            'artifacts': artifacts,
         }
     }
 
@@ -881,7 +2086,7 @@ def deleteUploadFileHelper(job_status, job_info):
         upload_bucket, upload_key = find_bucket_key(upload_uri)
         print(f"Deleting from bucket {upload_bucket} key {upload_key}")
         try:
-            s3.delete_object(Bucket=upload_bucket, Key=upload_key)
+            get_client("s3").delete_object(Bucket=upload_bucket, Key=upload_key)
         except Exception as e:
             print(e)
 
@@ -893,7 +2098,7 @@ def load_transcribe_job_status(cli_args):
     :param cli_args: CLI arguments used for this processing run
     :return: The job status structure (different between standard/analytics), and a 'job-completed' flag
     """
-    transcribe_client = boto3.client("transcribe")
+    transcribe_client = get_client("transcribe")
 
     try:
         # Extract the standard Transcribe job status
@@ -912,17 +2117,43 @@ def generate_document():
     """
     Entrypoint for the command-line interface.
     """
+    # Modules only the CLI needs are loaded here, to keep them out of the Lambda's cold start
+    import argparse
+    from pathlib import Path
+    from urllib.request import urlretrieve
+
     # Parameter extraction
     cli_parser = argparse.ArgumentParser(prog='transcribe_to_docx',
                                          description='Turn an Amazon Transcribe job output into an MS Word document')
     source_group = cli_parser.add_mutually_exclusive_group(required=True)
-    source_group.add_argument('--inputFile', metavar='filename', type=str, help='File containing Transcribe JSON output')
+    source_group.add_argument('--inputFile', metavar='filename', type=str,
+                              help='File containing Transcribe JSON output, or a ' + SIDECAR_EXTENSION + ' transcript sidecar')
     source_group.add_argument('--inputJob', metavar='job-id', type=str, help='Transcribe job identifier')
     cli_parser.add_argument('--outputFile', metavar='filename', type=str, help='Output file to hold MS Word document')
     cli_parser.add_argument('--confidence', choices=['on', 'off'], default='off', help='Displays information on word confidence scores throughout the transcript')
     cli_parser.add_argument('--keep', action='store_true', help='Keeps any downloaded job transcript JSON file')
+    cli_parser.add_argument('--template', metavar='filename', type=str, default=None,
+                            help='Word document (.docx) or s3:// URI to use as the template for the output')
+    cli_parser.add_argument('--renderer', choices=[RENDERER_AUTO, RENDERER_PYTHON_DOCX, RENDERER_STREAM], default=None,
+                            help='Document rendering engine, where "stream" writes the transcript straight into the file')
+    cli_parser.add_argument('--threshold', metavar='percent', type=int, choices=range(0, 101), default=None,
+                            help='Word confidence below which words are highlighted, overriding CONFIDENCE')
+    cli_parser.add_argument('--title', metavar='text', type=str, default=None,
+                            help='Title at the top of the document, overriding DOCUMENT_TITLE')
+    cli_parser.add_argument('--sidecar', action='store_true',
+                            help='Also save the transcript as a ' + SIDECAR_EXTENSION + ' sidecar next to the output, '
+                                 'which can be given as the --inputFile to quickly render it again')
+    cli_parser.add_argument('--formats', metavar='list', type=parse_export_formats, default=(),
+                            help='Comma-separated extra formats to save next to the output, from txt, srt, vtt and csv')
     cli_args = cli_parser.parse_args()
 
+    # Rendering settings can be overridden for this run
+    global confidence_env, document_title_env
+    if cli_args.threshold is not None:
+        confidence_env = cli_args.threshold
+    if cli_args.title is not None:
+        document_title_env = cli_args.title
+
     # If we're downloading a job transcript then validate that we have a job, then download it
     if cli_args.inputJob is not None:
         try:
@@ -961,10 +2192,24 @@ def generate_document():
         if cli_args.outputFile is None:
             cli_args.outputFile = cli_args.inputJob + ".docx"
 
-    # Load in the JSON file for processing
+    # A sidecar already holds the speech segments, so it can go straight to being rendered
     json_filepath = Path(cli_args.inputFile)
+    if json_filepath.is_file() and is_sidecar(json_filepath):
+        start = perf_counter()
+        json_data, speech_segments, job_info = load_sidecar(json_filepath)
+        if cli_args.outputFile is None:
+            cli_args.outputFile = str(json_filepath.with_suffix(".docx"))
+        write(json_data, speech_segments, job_info, cli_args.outputFile, renderer=cli_args.renderer,
+              template=cli_args.template)
+        print(f"> Transcript {cli_args.outputFile} writen in {round(perf_counter() - start, 2)} seconds.")
+        for filename in save_export_files(cli_args.outputFile, speech_segments, cli_args.formats):
+            print(f"> Transcript export {filename} saved.")
+        return
+
+    # Load in the JSON file for processing
     if json_filepath.is_file():
-        json_data = json.load(open(json_filepath.absolute(), "r", encoding="utf-8"))
+        with open(json_filepath.absolute(), "rb") as json_file:
+            json_data = load_transcript(json_file)
     else:
         print("FAIL: Specified JSON file '{0}' does not exists.".format(cli_args.inputFile))
         exit(-1)
@@ -995,26 +2240,55 @@ def generate_document():
 
     # Confirm that we have speaker or channel information then generate the core transcript
     start = perf_counter()
+    stats = TranscriptStats()
     if "channel_labels" in json_data["results"]:
-        speech_segments = create_turn_by_turn_segments(json_data, isChannelMode = True)
+        speech_segments = create_turn_by_turn_segments(json_data, isChannelMode = True, stats = stats)
     elif "speaker_labels" in json_data["results"] and json_data["results"]["speaker_labels"] is not None:
-        speech_segments = create_turn_by_turn_segments(json_data, isSpeakerMode = True)
+        speech_segments = create_turn_by_turn_segments(json_data, isSpeakerMode = True, stats = stats)
     elif "audio_segments" in json_data["results"]:
-        speech_segments = create_turn_by_turn_segments(json_data, isAudioSegmentsMode = True)
+        speech_segments = create_turn_by_turn_segments(json_data, isAudioSegmentsMode = True, stats = stats)
     else:
         print("FAIL: No speaker or channel information found in JSON file.")
         exit(-1)
 
     # Write out our file and the performance statistics
-    write(json_data, speech_segments, job_info, cli_args.outputFile)
+    write(json_data, speech_segments, job_info, cli_args.outputFile, renderer=cli_args.renderer, stats=stats,
+          template=cli_args.template)
     finish = perf_counter()
     duration = round(finish - start, 2)
     print(f"> Transcript {cli_args.outputFile} writen in {duration} seconds.")
+    if cli_args.sidecar:
+        sidecar_file = str(Path(cli_args.outputFile).with_suffix(SIDECAR_EXTENSION))
+        with open(sidecar_file, "wb") as f:
+            save_sidecar(f, json_data, speech_segments, job_info)
+        print(f"> Transcript sidecar {sidecar_file} saved.")
+    for filename in save_export_files(cli_args.outputFile, speech_segments, cli_args.formats):
+        print(f"> Transcript export {filename} saved.")
 
     # Finally, remove any temporary downloaded JSON results file
     if (cli_args.inputJob is not None) and (not cli_args.keep):
         os.remove(cli_args.inputFile)
 
+def init_lambda():
+    """
+    Builds the base document during the Lambda init phase, which runs at full CPU speed before the first request
+    arrives, so that a cold start's first transcript does not pay for it.  The AWS clients are still only created
+    when an invocation first needs them.  If the template can't be loaded, for example because S3 is unavailable,
+    init carries on and the first transcript tries again, so only that invocation fails.  The CPU time logged
+    includes starting Python and the imports, which PYTHONPROFILEIMPORTTIME breaks down module by module
+    """
+    start = perf_counter()
+    try:
+        get_base_document()
+    except Exception as e:
+        print(f"Document template not loaded during init, and will be retried on first use: {e}")
+    print(f"transcribe_to_docx init completed in {round(perf_counter() - start, 3)} seconds, "
+          f"after {round(process_time(), 3)} seconds of CPU since the process started")
+
+# Lambda init phase
+if __name__ != "__main__" and "AWS_LAMBDA_FUNCTION_NAME" in os.environ:
+    init_lambda()
+
 # Main entrypoint
 if __name__ == "__main__":
     generate_document()
@@ -1,54 +1,344 @@
 import os
 import csv
+import codecs
+import contextlib
 import io
+import gzip
+import json
+import pickle
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import UTC, date, timedelta
+from datetime import datetime as dt
 import boto3
-from boto3.dynamodb.conditions import Key
+from botocore.exceptions import ClientError
+from boto3.dynamodb.types import TypeDeserializer
+from s3_multipart import S3MultipartWriter
+
+JOBS_PK = "jobs"                            # Partition of the table that holds the job records
+EXPORT_KEY = "export/transcribe_jobs.csv.gz"
+LEGACY_EXPORT_KEY = "export/transcribe_jobs.csv"   # Uncompressed full export that earlier versions saved
+DELTA_KEY_FORMAT = "export/delta/transcribe_jobs-%Y%m%dT%H%M%SZ.csv.gz"
+MANIFEST_KEY = "export/transcribe_jobs.manifest.json"
+EXPORT_FULL = "full"
+EXPORT_INCREMENTAL = "incremental"
+LOOKBACK_DAYS = 2                           # Days before the watermark to read again, for jobs saved out of order
+SPOOL_MEMORY_SIZE = 16 * 1024 * 1024        # Bytes of records to hold in memory before spooling them to /tmp
+
+# Columns of the job records saved by the post-processing workflow, in the order they are exported.  Any other
+# attributes follow them in name order, so the columns are in the same order in every export and delta
+EXPORT_COLUMNS = ("PK", "SK", "Languages", "TotalDuration", "Confidence", "Created", "Artifacts")
+
+# Clients are shared by every invocation of this container, and by the threads of a parallel read
+dynamodb = boto3.client('dynamodb')
+s3 = boto3.client('s3')
+
+class Watermark:
+    """
+    Tracks how far the export has got through the jobs, by their Created date.  Jobs are saved when they
+    finish rather than when they were created, so one can arrive with an earlier date than jobs that were already
+    exported.  Each run therefore reads from LOOKBACK_DAYS before the latest date, and the keys of the jobs
+    exported for those recent dates are kept so that none of them is exported twice
+    """
+
+    def __init__(self, saved=None):
+        saved = saved or {}
+        self.created = saved.get("created")
+        self.recent = {created: set(jobs) for created, jobs in saved.get("recent", {}).items()}
+        self.lock = threading.Lock()
+
+    def cutoff(self):
+        """
+        :return: Earliest Created date that still has to be read, or None if nothing has been exported yet
+        """
+        if self.created is None:
+            return None
+        return (date.fromisoformat(self.created[:10]) - timedelta(days=LOOKBACK_DAYS)).isoformat()
+
+    def keep(self, record):
+        """
+        Checks whether a job record still has to be exported, and notes that it has been
+
+        :param record: Job record
+        :return: True if the record is new
+        """
+        created = record.get("Created")
+        job = record.get("SK")
+        if created is None:
+            return True
+        with self.lock:
+            if self.created is None or created > self.created:
+                self.created = created
+                cutoff = self.cutoff()
+                for old in [old for old in self.recent if old < cutoff]:
+                    del self.recent[old]
+            elif created < self.cutoff():
+                # Too far behind the watermark to need remembering
+                return True
+            jobs = self.recent.setdefault(created, set())
+            if job in jobs:
+                return False
+            jobs.add(job)
+            return True
+
+    def to_json(self):
+        """
+        :return: Watermark as saved in the manifest, with the latest date and job that have been exported
+        """
+        latest = sorted(self.recent.get(self.created, []))
+        return {"created": self.created, "job": latest[-1] if latest else None,
+                "recent": {created: sorted(jobs) for created, jobs in sorted(self.recent.items())}}
+
+def read_pages(table_name, segment=None, total_segments=None, since=None):
+    """
+    Reads every job record, a page at a time.  A single reader queries the jobs partition in key order, while
+    each reader of a parallel export scans its own segment of the table.  Only recent jobs are read through the
+    index on their Created date
+
+    :param table_name: DynamoDB table name
+    :param segment: (optional) Segment for this reader to scan
+    :param total_segments: (optional) Number of segments the table is being scanned in
+    :param since: (optional) Earliest Created date to read
+    :return: Generator of lists of records, as DynamoDB attribute values
+    """
+    values = {":pk": {"S": JOBS_PK}}
+    if since is not None:
+        values[":since"] = {"S": since}
+        pages = dynamodb.get_paginator("query").paginate(TableName=table_name,
+                                                         IndexName=os.environ.get("CREATED_INDEX", "Created"),
+                                                         KeyConditionExpression="PK = :pk AND Created >= :since",
+                                                         ExpressionAttributeValues=values)
+    elif total_segments is None:
+        pages = dynamodb.get_paginator("query").paginate(TableName=table_name, KeyConditionExpression="PK = :pk",
+                                                         ExpressionAttributeValues=values)
+    else:
+        pages = dynamodb.get_paginator("scan").paginate(TableName=table_name, FilterExpression="PK = :pk",
+                                                        ExpressionAttributeValues=values, Segment=segment,
+                                                        TotalSegments=total_segments)
+    for page in pages:
+        yield page.get("Items", [])
+
+def spool_records(table_name, spool, segments=1, watermark=None):
+    """
+    Reads the job records into a spool file as the pages arrive, noting every column that any record has.  Jobs
+    don't all have the same attributes, and the CSV header has to name every column before the first row, so the
+    CSV can't be written until the last page has been read.  The spool keeps the records out of memory until then
+
+    :param table_name: DynamoDB table name
+    :param spool: Binary file to append the pickled records to
+    :param segments: Number of segments to read in parallel, or 1 to query the partition in order
+    :param watermark: (optional) Watermark that is updated with the records, and that only records past it are
+                      read and kept from when it already has a date
+    :return: Tuple of the number of records and the list of columns, in the order of order_columns()
+    """
+    since = watermark.cutoff() if watermark is not None else None
+    deserializer = TypeDeserializer()
+    columns = set()
+    counts = []
+    lock = threading.Lock()
+
+    def read(segment=None, total_segments=None):
+        count = 0
+        for items in read_pages(table_name, segment, total_segments, since):
+            records = [{k: deserializer.deserialize(v) for k, v in item.items()} for item in items]
+            if watermark is not None:
+                records = [record for record in records if watermark.keep(record)]
+            pickled = b"".join(pickle.dumps(record, pickle.HIGHEST_PROTOCOL) for record in records)
+            with lock:
+                spool.write(pickled)
+                for record in records:
+                    columns.update(record)
+            count += len(records)
+        counts.append(count)
+
+    if segments > 1 and since is None:
+        with ThreadPoolExecutor(max_workers=segments) as executor:
+            for segment in [executor.submit(read, segment, segments) for segment in range(segments)]:
+                segment.result()
+    else:
+        read()
+    return sum(counts), order_columns(columns)
+
+def order_columns(columns):
+    """
+    :param columns: Every column that the records have
+    :return: List of the columns, with those in EXPORT_COLUMNS first and in that order, then the rest by name
+    """
+    return [k for k in EXPORT_COLUMNS if k in columns] + sorted(k for k in columns if k not in EXPORT_COLUMNS)
+
+def write_csv(spool, count, columns, output):
+    """
+    Writes the spooled records as CSV, with the job's sort key as the "Job" column and the partition key left out
+
+    :param spool: Binary file holding the pickled records, positioned at the first one
+    :param count: Number of records in the spool
+    :param columns: Every column that the records have
+    :param output: Text file to write the CSV to
+    """
+    writer = csv.writer(output)
+    if count == 0:
+        writer.writerow(["No records found"])
+        return
+
+    use_keys = [k for k in columns if k != "PK"]
+    writer.writerow(["Job" if k == "SK" else k for k in use_keys])
+    for _ in range(count):
+        item = pickle.load(spool)
+        writer.writerow([item.get(k, "") for k in use_keys])
+
+def save_csv(spool, count, columns, download_bucket, key):
+    """
+    Streams the spooled records to S3 as CSV through a multipart upload, gzipped if the key ends in .gz
+
+    :param spool: Binary file holding the pickled records, positioned at the first one
+    :param count: Number of records in the spool
+    :param columns: Every column that the records have
+    :param download_bucket: Bucket to save the export in
+    :param key: Key of the export
+    """
+    compress = key.endswith(".gz")
+    with S3MultipartWriter(s3, download_bucket, key,
+                           content_type="application/gzip" if compress else "text/csv") as upload:
+        if compress:
+            with gzip.GzipFile(filename=os.path.basename(key)[:-len(".gz")], mode="wb", fileobj=upload) as compressed, \
+                    io.TextIOWrapper(compressed, encoding="utf-8", newline="") as text:
+                write_csv(spool, count, columns, text)
+        else:
+            # A TextIOWrapper would close the upload along with itself
+            write_csv(spool, count, columns, codecs.getwriter("utf-8")(upload))
+
+def export_csv(download_bucket, keys, table_name, segments=1, watermark=None, skip_empty=False):
+    """
+    Exports job records to S3 as CSV.  Records are spooled as they are read, to disk once they outgrow memory,
+    then streamed out to each key in turn once the header is known
+
+    :param download_bucket: Bucket to save the export in
+    :param keys: Keys to save the export as
+    :param table_name: DynamoDB table name
+    :param segments: Number of segments to read in parallel
+    :param watermark: (optional) Watermark to export past, and to update
+    :param skip_empty: (optional) Don't save an export that has no records
+    :return: Number of records exported
+    """
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_SIZE) as spool:
+        count, columns = spool_records(table_name, spool, segments, watermark)
+        if count == 0 and skip_empty:
+            return 0
+        for key in keys:
+            spool.seek(0)
+            save_csv(spool, count, columns, download_bucket, key)
+    return count
+
+@contextlib.contextmanager
+def open_export(download_bucket, key):
+    """
+    :param download_bucket: Bucket the exports are saved in
+    :param key: Key of a gzipped export or delta
+    :return: Context manager of a CSV reader over the export, streamed from S3
+    """
+    body = s3.get_object(Bucket=download_bucket, Key=key)["Body"]
+    try:
+        yield csv.reader(io.TextIOWrapper(gzip.GzipFile(fileobj=body, mode="rb"), encoding="utf-8", newline=""))
+    finally:
+        body.close()
+
+def save_legacy_csv(download_bucket, manifest):
+    """
+    Saves the uncompressed full export under LEGACY_EXPORT_KEY by joining the full export in the manifest with each
+    of its deltas, so that an incremental run doesn't have to read the whole table again for it.  The exports may
+    not all have the same columns, so each row is written by its column names
+
+    :param download_bucket: Bucket the exports are saved in
+    :param manifest: Manifest of the full export and its deltas
+    :return: Number of records saved
+    """
+    headers = {}
+    for key in [manifest["full"]["key"]] + [delta["key"] for delta in manifest["deltas"]]:
+        with open_export(download_bucket, key) as rows:
+            header = next(rows, [])
+        if header and header != ["No records found"]:
+            headers[key] = header
+    columns = ["Job" if k == "SK" else k
+               for k in order_columns({"SK" if name == "Job" else name for header in headers.values()
+                                       for name in header})]
+
+    count = 0
+    with S3MultipartWriter(s3, download_bucket, LEGACY_EXPORT_KEY, content_type="text/csv") as upload:
+        # A TextIOWrapper would close the upload along with itself
+        writer = csv.writer(codecs.getwriter("utf-8")(upload))
+        writer.writerow(columns if headers else ["No records found"])
+        for key, header in headers.items():
+            positions = [header.index(column) if column in header else None for column in columns]
+            with open_export(download_bucket, key) as rows:
+                next(rows)
+                for row in rows:
+                    writer.writerow(["" if position is None else row[position] for position in positions])
+                    count += 1
+    return count
+
+def load_manifest(download_bucket):
+    """
+    :param download_bucket: Bucket the exports are saved in
+    :return: Manifest of the exports so far, or None if there isn't one yet
+    """
+    try:
+        return json.load(s3.get_object(Bucket=download_bucket, Key=MANIFEST_KEY)["Body"])
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
 
 def lambda_handler(event, context):
-    # Initialize DynamoDB and S3 clients
-    dynamodb = boto3.resource('dynamodb')
     table_name = os.environ['DYNAMODB_TABLE']
-    table = dynamodb.Table(table_name)
-    s3 = boto3.client('s3')
     download_bucket = os.environ['DOWNLOAD_BUCKET']
+    event = event or {}
 
-    # Query the DynamoDB table for records where PK equals "jobs"
-    response = table.query(
-        KeyConditionExpression=Key('PK').eq("jobs")
-    )
-    records = response.get('Items', [])
+    # Large histories can be read in parallel segments, set by the event or the environment
+    segments = int(event.get("segments") or os.environ.get("EXPORT_SEGMENTS", "1"))
 
-    # Create CSV file in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
-    if records:
-        orig_keys = list(records[0].keys())
-        header = []
-        use_keys = []
-        for k in orig_keys:
-            if k == "PK":
-                continue
-            elif k == "SK":
-                header.append("Job")
-                use_keys.append(k)
-            else:
-                header.append(k)
-                use_keys.append(k)
-        writer.writerow(header)
-        for item in records:
-            writer.writerow([item.get(k, "") for k in use_keys])
-    else:
-        writer.writerow(["No records found"])
+    # An incremental export saves just the jobs since the last one as a dated delta, alongside the last full
+    # export, and falls back to a full export when there is nothing to add to
+    mode = event.get("mode") or os.environ.get("EXPORT_MODE", EXPORT_INCREMENTAL)
+    if mode not in (EXPORT_FULL, EXPORT_INCREMENTAL):
+        raise ValueError(f"Unknown export mode '{mode}'")
+    manifest = load_manifest(download_bucket) if mode == EXPORT_INCREMENTAL else None
+    if manifest is None:
+        mode = EXPORT_FULL
+
+    # While consumers move over, the uncompressed full export is also saved under the key it used to have.  An
+    # incremental run builds it from the last full export and its deltas, rather than reading every job again
+    legacy = os.environ.get("EXPORT_LEGACY_CSV", "true").lower() == "true"
 
-    csv_content = output.getvalue()
-    output.close()
+    exported = dt.now(UTC).replace(tzinfo=None)
+    if mode == EXPORT_FULL:
+        watermark = Watermark()
+        key = EXPORT_KEY
+        count = export_csv(download_bucket, [key, LEGACY_EXPORT_KEY] if legacy else [key], table_name, segments,
+                           watermark)
+        manifest = {"full": {"key": key, "records": count, "exported": exported.isoformat() + "Z"}, "deltas": []}
+    else:
+        watermark = Watermark(manifest.get("watermark"))
+        since = watermark.cutoff()
+        key = exported.strftime(DELTA_KEY_FORMAT)
+        count = export_csv(download_bucket, [key], table_name, segments, watermark, skip_empty=True)
+        if count > 0:
+            manifest["deltas"].append({"key": key, "records": count, "exported": exported.isoformat() + "Z",
+                                       "since": since})
+        if legacy and count > 0:
+            save_legacy_csv(download_bucket, manifest)
 
-    # Save CSV file to the download S3 bucket
-    filename = "transcribe_jobs.csv"
-    key = f"export/{filename}"
-    s3.put_object(Bucket=download_bucket, Key=key, Body=csv_content)
+    # The manifest lists the full export and the deltas to merge into it, in order
+    manifest["watermark"] = watermark.to_json()
+    s3.put_object(Bucket=download_bucket, Key=MANIFEST_KEY, Body=json.dumps(manifest, indent=2).encode("utf-8"),
+                  ContentType="application/json")
 
+    if mode == EXPORT_INCREMENTAL and count == 0:
+        message = "No new records since the last export."
+    else:
+        message = f"CSV file '{os.path.basename(key)}' created with {count} records."
+    print(message)
     return {
         'statusCode': 200,
-        'body': f"CSV file '{filename}' created with {len(records)} records."
-    }
\ No newline at end of file
+        'body': message
+    }
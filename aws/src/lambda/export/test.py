@@ -0,0 +1,196 @@
+import contextlib
+import csv
+import gzip
+import io
+import json
+import os
+import sys
+import unittest
+
+from boto3.dynamodb.types import TypeSerializer
+from botocore.exceptions import ClientError
+
+# The S3 upload code is packaged from the docx Lambda, and the module creates its clients on import, which needs
+# a region but no credentials
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "docx"))
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+target = __import__("export_jobs")
+
+PAGE_SIZE = 2
+
+def job(name, created, **attributes):
+    return {"PK": "jobs", "SK": name, "Created": created, **attributes}
+
+class FakePaginator:
+    def __init__(self, dynamodb, operation):
+        self.dynamodb = dynamodb
+        self.operation = operation
+    def paginate(self, **kwargs):
+        self.dynamodb.requests.append((self.operation, kwargs))
+        items = self.dynamodb.items
+        if self.operation == "scan":
+            items = items[kwargs["Segment"]::kwargs["TotalSegments"]]
+        elif ":since" in kwargs["ExpressionAttributeValues"]:
+            since = kwargs["ExpressionAttributeValues"][":since"]["S"]
+            items = [item for item in items if item["Created"] >= since]
+        serializer = TypeSerializer()
+        for start in range(0, max(len(items), 1), PAGE_SIZE):
+            yield {"Items": [{k: serializer.serialize(v) for k, v in item.items()}
+                             for item in items[start:start + PAGE_SIZE]]}
+
+class FakeDynamoDB:
+    def __init__(self, items=()):
+        self.items = list(items)
+        self.requests = []
+    def get_paginator(self, operation):
+        return FakePaginator(self, operation)
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.parts = {}
+    def put_object(self, Bucket, Key, Body, **kwargs):
+        self.objects[Key] = Body
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey", "Message": Key}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key])}
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.parts[Key] = {}
+        return {"UploadId": Key}
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        self.parts[Key][PartNumber] = Body
+        return {"ETag": str(PartNumber)}
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.objects[Key] = b"".join(self.parts.pop(Key)[part["PartNumber"]] for part in MultipartUpload["Parts"])
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.parts.pop(Key)
+
+    def rows(self, key):
+        body = self.objects[key]
+        if key.endswith(".gz"):
+            body = gzip.decompress(body)
+        return list(csv.reader(io.StringIO(body.decode("utf-8"))))
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.saved = (target.dynamodb, target.s3)
+        self.environ = dict(os.environ)
+        self.s3 = FakeS3()
+        target.s3 = self.s3
+        os.environ.update({"DYNAMODB_TABLE": "jobs", "DOWNLOAD_BUCKET": "download", "EXPORT_LEGACY_CSV": "false"})
+
+    def tearDown(self):
+        target.dynamodb, target.s3 = self.saved
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def run_handler(self, items, event=None):
+        target.dynamodb = FakeDynamoDB(items)
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = target.lambda_handler(event or {}, None)
+        return response, target.dynamodb.requests
+
+    def manifest(self):
+        return json.loads(self.s3.objects[target.MANIFEST_KEY])
+
+    def test_column_order(self):
+        # Parallel segments see the attributes in different orders, which must not change the header
+        items = [job("b", "2025-01-02", Zeta="z", Languages="en-US", TotalDuration=2),
+                 job("a", "2025-01-01", Artifacts="{}", Alpha="a"),
+                 job("c", "2025-01-03", Confidence=90, Languages="es-US")]
+        response, requests = self.run_handler(items, {"segments": 3, "mode": "full"})
+        self.assertEqual(response["statusCode"], 200)
+        self.assertEqual([operation for operation, _ in requests], ["scan"] * 3)
+        rows = self.s3.rows(target.EXPORT_KEY)
+        self.assertEqual(rows[0], ["Job", "Languages", "TotalDuration", "Confidence", "Created", "Artifacts",
+                                   "Alpha", "Zeta"])
+        self.assertEqual(sorted(row[0] for row in rows[1:]), ["a", "b", "c"])
+        self.assertEqual(target.order_columns({"Zeta", "SK", "Alpha", "PK"}), ["PK", "SK", "Alpha", "Zeta"])
+
+    def test_watermark(self):
+        watermark = target.Watermark()
+        self.assertIsNone(watermark.cutoff())
+        self.assertTrue(watermark.keep(job("a", "2025-01-10")))
+        self.assertFalse(watermark.keep(job("a", "2025-01-10")))
+        self.assertTrue(watermark.keep({"SK": "undated"}))
+        self.assertEqual(watermark.cutoff(), "2025-01-08")
+
+        # Jobs saved out of order within the lookback are kept once, and older ones are always kept
+        self.assertTrue(watermark.keep(job("b", "2025-01-09")))
+        self.assertFalse(watermark.keep(job("b", "2025-01-09")))
+        self.assertTrue(watermark.keep(job("old", "2025-01-01")))
+        self.assertTrue(watermark.keep(job("old", "2025-01-01")))
+
+        # Dates that fall out of the lookback are forgotten as the watermark moves on
+        self.assertTrue(watermark.keep(job("c", "2025-01-12")))
+        saved = watermark.to_json()
+        self.assertEqual(saved, {"created": "2025-01-12", "job": "c",
+                                 "recent": {"2025-01-10": ["a"], "2025-01-12": ["c"]}})
+        restored = target.Watermark(json.loads(json.dumps(saved)))
+        self.assertFalse(restored.keep(job("a", "2025-01-10")))
+        self.assertEqual(restored.cutoff(), "2025-01-10")
+
+    def test_load_manifest(self):
+        self.assertIsNone(target.load_manifest("download"))
+        self.s3.objects[target.MANIFEST_KEY] = b'{"deltas": []}'
+        self.assertEqual(target.load_manifest("download"), {"deltas": []})
+
+        def denied(Bucket, Key):
+            raise ClientError({"Error": {"Code": "AccessDenied", "Message": Key}}, "GetObject")
+        self.s3.get_object = denied
+        with self.assertRaises(ClientError):
+            target.load_manifest("download")
+
+    def test_incremental_export(self):
+        items = [job("a", "2025-01-01"), job("b", "2025-01-05")]
+        self.run_handler(items)
+        manifest = self.manifest()
+        self.assertEqual(manifest["full"]["records"], 2)
+        self.assertEqual(manifest["deltas"], [])
+        self.assertEqual(len(self.s3.rows(target.EXPORT_KEY)), 3)
+
+        # Only the jobs since the lookback are read, and those already exported are left out of the delta
+        items.append(job("c", "2025-01-04"))
+        response, requests = self.run_handler(items)
+        self.assertEqual(requests[0][1]["ExpressionAttributeValues"][":since"]["S"], "2025-01-03")
+        manifest = self.manifest()
+        self.assertEqual(len(manifest["deltas"]), 1)
+        delta = manifest["deltas"][0]
+        self.assertEqual((delta["records"], delta["since"]), (1, "2025-01-03"))
+        self.assertEqual(self.s3.rows(delta["key"])[1:], [["c", "2025-01-04"]])
+
+        # Nothing new saves no delta
+        objects = set(self.s3.objects)
+        response, _ = self.run_handler(items)
+        self.assertEqual(response["body"], "No new records since the last export.")
+        self.assertEqual(set(self.s3.objects), objects)
+        self.assertEqual(len(self.manifest()["deltas"]), 1)
+
+        # A full export starts a new list of deltas
+        self.run_handler(items, {"mode": "full"})
+        self.assertEqual((self.manifest()["full"]["records"], self.manifest()["deltas"]), (3, []))
+
+    def test_legacy_csv(self):
+        os.environ["EXPORT_LEGACY_CSV"] = "true"
+        items = [job("a", "2025-01-01", Languages="en-US"), job("b", "2025-01-05")]
+        self.run_handler(items)
+        self.assertEqual(self.s3.rows(target.LEGACY_EXPORT_KEY), self.s3.rows(target.EXPORT_KEY))
+
+        # An incremental run joins the deltas to the full export by column name, without reading the table again
+        items.append(job("c", "2025-01-06", Confidence=80))
+        _, requests = self.run_handler(items)
+        self.assertEqual(len(requests), 1)
+        self.assertIn(":since", requests[0][1]["ExpressionAttributeValues"])
+        self.assertEqual(self.s3.rows(target.LEGACY_EXPORT_KEY), [["Job", "Languages", "Confidence", "Created"],
+                                                                  ["a", "en-US", "", "2025-01-01"],
+                                                                  ["b", "", "", "2025-01-05"],
+                                                                  ["c", "", "80", "2025-01-06"]])
+
+    def test_empty_export(self):
+        self.run_handler([], {"mode": "full"})
+        self.assertEqual(self.s3.rows(target.EXPORT_KEY), [["No records found"]])
+        self.assertEqual(self.manifest()["full"]["records"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,248 @@
+"""
+Digest mode, shared by the Teams and Slack notifiers, which gathers the completed jobs from each upload folder
+into one message.  It is off without both a DIGEST_WINDOW and a DIGEST_TABLE to keep the digests in
+"""
+import json
+import os
+import posixpath
+import threading
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+from webhook import executor, send
+
+DIGEST_PK = "digest"        # Partition of the jobs table that holds the completions waiting for their digest
+DIGEST_TTL = 86400          # Seconds before a digest that was never sent is tidied away
+MAX_DIGEST_ENTRIES = 49     # Most jobs in one message, as Slack allows 50 blocks and the title takes one
+
+digest_window = int(os.environ.get('DIGEST_WINDOW', '0'))
+digest_max_jobs = min(int(os.environ.get('DIGEST_MAX_JOBS', '20')), MAX_DIGEST_ENTRIES)
+
+class LocalDigestStore:
+    """
+    In-memory stand-in for the pending digests, which the unit tests use in place of DynamoDB.  A Lambda never
+    uses it, as its digests would only last as long as its container
+    """
+
+    def __init__(self):
+        self.groups = {}
+        self.lock = threading.Lock()
+
+    def add(self, group, entry, opened):
+        """
+        Adds a completed job to its group's digest, opening the digest if there isn't one.  A job that is already
+        in the digest isn't added again
+
+        :param group: Digest group of the job
+        :param entry: Dictionary of the job name, duration and s3uri
+        :param opened: Time to open the digest at, in seconds since the epoch
+        :return: Number of jobs in the digest, or 0 if the job was already in it
+        """
+        with self.lock:
+            digest = self.groups.setdefault(group, {"opened": opened, "entries": []})
+            if any(pending["job"] == entry["job"] for pending in digest["entries"]):
+                return 0
+            digest["entries"].append(entry)
+            return len(digest["entries"])
+
+    def due(self, cutoff):
+        """
+        :param cutoff: Time in seconds since the epoch that digests opened at or before are due
+        :return: Groups whose digest is due
+        """
+        with self.lock:
+            return [group for group, digest in self.groups.items() if digest["opened"] <= cutoff]
+
+    def take(self, group):
+        """
+        Removes a group's digest, so that only the caller sends it
+
+        :param group: Digest group
+        :return: Tuple of the time the digest opened and its jobs, which are empty if there wasn't one
+        """
+        with self.lock:
+            digest = self.groups.pop(group, None)
+        if digest is None:
+            return None, []
+        return digest["opened"], digest["entries"]
+
+class DynamoDBDigestStore:
+    """
+    Pending digests, kept in the jobs table with an item for each group.  Jobs are only added if they aren't
+    already in the item, and an item is deleted as it is read, so a job is in one digest however often its
+    notification is delivered and however many invocations flush at once
+    """
+
+    def __init__(self, client, table, service):
+        self.client = client
+        self.table = table
+        self.prefix = service + "#"
+
+    def digest_key(self, group):
+        return {"PK": {"S": DIGEST_PK}, "SK": {"S": self.prefix + group}}
+
+    def add(self, group, entry, opened):
+        """
+        Adds a completed job to its group's digest, opening the digest if there isn't one.  A job that is already
+        in the digest isn't added again
+
+        :param group: Digest group of the job
+        :param entry: Dictionary of the job name, duration and s3uri
+        :param opened: Time to open the digest at, in seconds since the epoch
+        :return: Number of jobs in the digest, or 0 if the job was already in it
+        """
+        try:
+            response = self.client.update_item(
+                TableName=self.table,
+                Key=self.digest_key(group),
+                UpdateExpression="SET Entries = list_append(if_not_exists(Entries, :empty), :entry), "
+                                 "Opened = if_not_exists(Opened, :opened), #ttl = if_not_exists(#ttl, :ttl) "
+                                 "ADD Jobs :jobs, Pending :one",
+                ConditionExpression="NOT contains(Jobs, :job)",
+                ExpressionAttributeNames={"#ttl": "TTL"},
+                ExpressionAttributeValues={
+                    ":empty": {"L": []}, ":entry": {"L": [{"S": json.dumps(entry)}]},
+                    ":opened": {"N": str(opened)}, ":ttl": {"N": str(int(opened) + DIGEST_TTL)},
+                    ":jobs": {"SS": [entry["job"]]}, ":job": {"S": entry["job"]}, ":one": {"N": "1"}},
+                ReturnValues="UPDATED_NEW")
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                return 0
+            raise
+        return int(response["Attributes"]["Pending"]["N"])
+
+    def due(self, cutoff):
+        """
+        :param cutoff: Time in seconds since the epoch that digests opened at or before are due
+        :return: Groups whose digest is due
+        """
+        groups = []
+        paginator = self.client.get_paginator("query")
+        for page in paginator.paginate(
+                TableName=self.table,
+                KeyConditionExpression="PK = :pk AND begins_with(SK, :service)",
+                FilterExpression="Opened <= :cutoff",
+                ProjectionExpression="SK",
+                ExpressionAttributeValues={":pk": {"S": DIGEST_PK}, ":service": {"S": self.prefix},
+                                           ":cutoff": {"N": str(cutoff)}}):
+            groups.extend(item["SK"]["S"][len(self.prefix):] for item in page["Items"])
+        return groups
+
+    def take(self, group):
+        """
+        Removes a group's digest, so that only the caller sends it
+
+        :param group: Digest group
+        :return: Tuple of the time the digest opened and its jobs, which are empty if there wasn't one
+        """
+        response = self.client.delete_item(TableName=self.table, Key=self.digest_key(group),
+                                           ReturnValues="ALL_OLD")
+        digest = response.get("Attributes")
+        if not digest:
+            return None, []
+        return float(digest["Opened"]["N"]), [json.loads(entry["S"]) for entry in digest["Entries"]["L"]]
+
+def open_digests(service):
+    """
+    :param service: Sort key prefix that keeps this notifier's digests apart from the other's
+    :return: Store of the pending digests, or None when digest mode is off, which it is without a DIGEST_TABLE
+    """
+    if digest_window <= 0:
+        return None
+    if not os.environ.get('DIGEST_TABLE'):
+        print(f"DIGEST_WINDOW is set without a DIGEST_TABLE, so the {service} digests are off and every "
+              "notification is sent straight away")
+        return None
+    return DynamoDBDigestStore(boto3.client('dynamodb'), os.environ['DIGEST_TABLE'], service)
+
+def format_duration(duration):
+    try:
+        duration = float(duration)
+    except (TypeError, ValueError):
+        return "unknown duration"
+    return str(int(duration / 60)) + "m " + str(round(duration % 60, 2)) + "s"
+
+def digest_group(upload):
+    """
+    :param upload: S3 URI of the job's upload, from its notification
+    :return: Group of the job's digest, which is the folder of the upload's key, or "" for uploads that aren't in
+             one and for notifications that don't have the upload
+    """
+    if not upload:
+        return ""
+    _, _, key = upload.partition("://")[2].partition("/")
+    return posixpath.dirname(key)
+
+def digest_entry(sns):
+    """
+    :return: Tuple of the digest group and the entry for the digest of a completed job's notification, or None for
+             any other notification
+    """
+    try:
+        body = json.loads(sns['Message'])
+    except Exception:
+        return None
+    if not isinstance(body, dict) or "job" not in body or "s3uri" not in body:
+        return None
+    return digest_group(body.get("upload")), {"job": body["job"], "duration": body.get("duration"),
+                                              "s3uri": body["s3uri"]}
+
+def flush_digest(digests, webhook, group, deadline, build_digest_message, service):
+    """
+    Sends the digest of a group, in messages of up to MAX_DIGEST_ENTRIES jobs, putting the jobs that couldn't be
+    sent back for the next flush
+
+    :param build_digest_message: Function that builds the service's message, given the title and the entries
+    :param service: Name of the chat service, for the log
+    :return: Last response status, or None if there was nothing to send or the webhook couldn't be reached
+    """
+    opened, entries = digests.take(group)
+    if not entries:
+        # Already sent by another invocation
+        return None
+
+    status = None
+    for start in range(0, len(entries), MAX_DIGEST_ENTRIES):
+        part = entries[start:start + MAX_DIGEST_ENTRIES]
+        title = f"{len(part)} transcription job{'s' if len(part) > 1 else ''} completed"
+        if group:
+            title += f" in {group}"
+        message = build_digest_message(title, part)
+        if not webhook or webhook == "DISABLED":
+            print(f"notify_{service.lower()} disabled, logging message instead: {title} {json.dumps(message)}")
+            continue
+
+        status = send(webhook, message, deadline, service)
+        if status is None or not 200 <= status < 300:
+            for entry in entries[start:]:
+                digests.add(group, entry, opened)
+            break
+    return status
+
+def send_digests(digests, webhook, records, deadline, notify, build_digest_message, service):
+    """
+    Adds the completed jobs in an event to their digests, then sends every digest whose window has closed or
+    that has reached digest_max_jobs.  Any other notifications, such as failures, are sent straight away
+
+    :param notify: Function that sends one notification, given the webhook, the SNS message and the deadline
+    :param build_digest_message: Function that builds the service's message, given the title and the entries
+    :param service: Name of the chat service, for the log
+    :return: Response statuses of the notifications and digests that were sent
+    """
+    now = time.time()
+    full = set()
+    sends = []
+    for record in records:
+        digest = digest_entry(record['Sns'])
+        if digest is None:
+            sends.append(executor.submit(notify, webhook, record['Sns'], deadline))
+            continue
+        group, entry = digest
+        if digests.add(group, entry, now) >= digest_max_jobs:
+            full.add(group)
+
+    for group in sorted(full.union(digests.due(now - digest_window))):
+        sends.append(executor.submit(flush_digest, digests, webhook, group, deadline, build_digest_message,
+                                     service))
+    return [sent.result() for sent in sends]
@@ -0,0 +1,321 @@
+import contextlib
+import http.client
+import io
+import json
+import os
+import threading
+import time
+import unittest
+from email.utils import formatdate
+
+webhook = __import__("webhook")
+digest = __import__("digest")
+
+URL = "https://hooks.example.com/services/T0/B0?x=1"
+
+class FakeResponse:
+    def __init__(self, status, retry_after=None, will_close=False):
+        self.status = status
+        self.retry_after = retry_after
+        self.will_close = will_close
+    def read(self):
+        return b"ok"
+    def getheader(self, name):
+        return self.retry_after if name == "Retry-After" else None
+
+class FakeConnection:
+    def __init__(self, server, host, timeout):
+        self.server = server
+        self.host = host
+        self.closed = False
+        self.requests = []
+    def request(self, method, path, body=None, headers=None):
+        self.requests.append((method, path, body))
+        outcome = self.server.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        self.response = outcome
+    def getresponse(self):
+        return self.response
+    def close(self):
+        self.closed = True
+
+class FakeServer:
+    """Stands in for http.client.HTTPSConnection, answering each request with the next of its outcomes"""
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.connections = []
+    def connect(self, host, timeout):
+        connection = FakeConnection(self, host, timeout)
+        self.connections.append(connection)
+        return connection
+
+class FakeTime:
+    """A monotonic clock that only moves when slept on"""
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+    def monotonic(self):
+        return self.now
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+    def time(self):
+        return time.time()
+
+class FakeSecrets:
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+    def get_secret_value(self, SecretId):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return {"SecretString": f"{URL}&version={self.calls}"}
+
+class FakeClock:
+    """Wall clock for the digest windows"""
+    def __init__(self):
+        self.now = 1700000000.0
+    def time(self):
+        return self.now
+
+class FakeSend:
+    """Stands in for the webhook's send, answering each digest with the next of its statuses"""
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.messages = []
+        self.lock = threading.Lock()
+    def __call__(self, url, message, deadline, service):
+        with self.lock:
+            self.messages.append(message)
+            return self.statuses.pop(0) if self.statuses else 200
+
+def build_digest_message(title, entries):
+    return {"title": title, "jobs": [entry["job"] for entry in entries]}
+
+def completed(job, upload):
+    message = {"job": job, "duration": "61.5", "s3uri": f"s3://output/{job}.docx", "upload": upload}
+    return {"Sns": {"Subject": "Transcription job completed", "Message": json.dumps(message)}}
+
+class TestWebhook(unittest.TestCase):
+    def setUp(self):
+        self.saved = (http.client.HTTPSConnection, webhook.time, webhook.connections, webhook.secrets_client,
+                      dict(webhook.webhook_cache))
+        self.environ = dict(os.environ)
+        self.time = FakeTime()
+        webhook.time = self.time
+        webhook.connections = threading.local()
+
+    def tearDown(self):
+        http.client.HTTPSConnection, webhook.time, webhook.connections, webhook.secrets_client, cache = self.saved
+        webhook.webhook_cache.update(cache)
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def serve(self, *outcomes):
+        server = FakeServer(*outcomes)
+        http.client.HTTPSConnection = server.connect
+        return server
+
+    def send(self, deadline=60.0):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return webhook.send(URL, {"text": "done"}, self.time.now + deadline, "Slack")
+
+    def test_retry_delay(self):
+        self.assertEqual(webhook.retry_delay(0, "3"), 3.0)
+        self.assertEqual(webhook.retry_delay(0, "120"), webhook.RETRY_MAX_DELAY)
+        self.assertEqual(webhook.retry_delay(0, "-1"), 0.0)
+        self.assertAlmostEqual(webhook.retry_delay(0, formatdate(time.time() + 4, usegmt=True)), 4.0, delta=1.0)
+        self.assertEqual(webhook.retry_delay(0, formatdate(time.time() - 60, usegmt=True)), 0.0)
+
+        # Without a usable Retry-After the backoff is jittered up to its exponential bound
+        for retry_after in (None, "soon"):
+            delay = webhook.retry_delay(2, retry_after)
+            self.assertTrue(0 <= delay <= webhook.RETRY_BASE_DELAY * 4)
+
+    def test_rate_limited_send_waits_for_retry_after(self):
+        server = self.serve(FakeResponse(429, "2"), FakeResponse(200))
+        self.assertEqual(self.send(), 200)
+        self.assertEqual(self.time.sleeps, [2.0])
+        self.assertEqual(len(server.connections), 1)
+        self.assertEqual(server.connections[0].host, "hooks.example.com")
+        self.assertEqual([path for _, path, _ in server.connections[0].requests], ["/services/T0/B0?x=1"] * 2)
+
+    def test_retry_after_past_deadline_gives_up(self):
+        self.serve(FakeResponse(429, "5"), FakeResponse(200))
+        self.assertEqual(self.send(deadline=3.0), 429)
+        self.assertEqual(self.time.sleeps, [])
+
+    def test_client_errors_are_not_retried(self):
+        self.serve(FakeResponse(400), FakeResponse(200))
+        self.assertEqual(self.send(), 400)
+        self.assertEqual(self.time.sleeps, [])
+
+    def test_server_errors_are_retried(self):
+        self.serve(FakeResponse(500), FakeResponse(503), FakeResponse(502), FakeResponse(500))
+        self.assertEqual(self.send(), 500)
+        self.assertEqual(len(self.time.sleeps), webhook.MAX_ATTEMPTS - 1)
+
+    def test_dropped_keep_alive_reconnects(self):
+        server = self.serve(FakeResponse(200), http.client.RemoteDisconnected("closed"), FakeResponse(200))
+        self.assertEqual(self.send(), 200)
+
+        # The idle connection was closed by the webhook, so the next send reconnects once without a backoff
+        self.assertEqual(self.send(), 200)
+        self.assertEqual(len(server.connections), 2)
+        self.assertTrue(server.connections[0].closed)
+        self.assertFalse(server.connections[1].closed)
+        self.assertEqual(self.time.sleeps, [])
+
+    def test_new_connection_failure_is_retried_with_backoff(self):
+        server = self.serve(ConnectionRefusedError("refused"), FakeResponse(200))
+        self.assertEqual(self.send(), 200)
+        self.assertEqual(len(server.connections), 2)
+        self.assertEqual(len(self.time.sleeps), 1)
+
+    def test_connection_closed_by_response(self):
+        server = self.serve(FakeResponse(200, will_close=True), FakeResponse(200))
+        self.assertEqual(self.send(), 200)
+        self.assertEqual(self.send(), 200)
+        self.assertEqual(len(server.connections), 2)
+        self.assertTrue(server.connections[0].closed)
+
+    def test_secret_is_cached(self):
+        os.environ["WEBHOOK_SECRET_ARN"] = "arn:aws:secretsmanager:us-east-1:0:secret:webhook"
+        webhook.webhook_cache.update({"url": None, "expires": 0.0})
+        secrets = FakeSecrets()
+        webhook.secrets_client = secrets
+        self.assertEqual(webhook.get_webhook_url(), URL + "&version=1")
+        self.time.now += webhook.SECRET_TTL - 1
+        self.assertEqual(webhook.get_webhook_url(), URL + "&version=1")
+        self.assertEqual(secrets.calls, 1)
+
+        # Once the TTL has passed, a changed secret is picked up
+        self.time.now += 1
+        self.assertEqual(webhook.get_webhook_url(), URL + "&version=2")
+        self.assertEqual(secrets.calls, 2)
+
+    def test_secret_failures_are_not_cached(self):
+        webhook.webhook_cache.update({"url": None, "expires": 0.0})
+        os.environ.pop("WEBHOOK_SECRET_ARN", None)
+        self.assertEqual(webhook.get_webhook_url(), "DISABLED")
+
+        os.environ["WEBHOOK_SECRET_ARN"] = "arn:aws:secretsmanager:us-east-1:0:secret:webhook"
+        webhook.secrets_client = FakeSecrets(RuntimeError("denied"))
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(webhook.get_webhook_url(), "DISABLED")
+        webhook.secrets_client = FakeSecrets()
+        self.assertEqual(webhook.get_webhook_url(), URL + "&version=1")
+
+class TestDigest(unittest.TestCase):
+    def setUp(self):
+        self.saved = (digest.time, digest.send, digest.digest_window, digest.digest_max_jobs)
+        self.environ = dict(os.environ)
+        self.clock = FakeClock()
+        self.send = FakeSend()
+        self.notified = []
+        self.digests = digest.LocalDigestStore()
+        digest.time = self.clock
+        digest.send = self.send
+        digest.digest_window = 60
+        digest.digest_max_jobs = 20
+
+    def tearDown(self):
+        digest.time, digest.send, digest.digest_window, digest.digest_max_jobs = self.saved
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def notify(self, url, sns, deadline):
+        self.notified.append(sns)
+        return 200
+
+    def send_digests(self, *records):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return digest.send_digests(self.digests, URL, list(records), 60.0, self.notify, build_digest_message,
+                                       "Slack")
+
+    def test_grouped_by_upload_folder(self):
+        self.assertEqual(digest.digest_group("s3://upload/Class 1/week 2/a.mp3"), "Class 1/week 2")
+        self.assertEqual(digest.digest_group("s3://upload/a.mp3"), "")
+        self.assertEqual(digest.digest_group(None), "")
+        self.assertEqual(digest.digest_entry(completed("a", "s3://upload/Class 1/a.mp3")["Sns"]),
+                         ("Class 1", {"job": "a", "duration": "61.5", "s3uri": "s3://output/a.docx"}))
+
+        # Failures and anything else that isn't a completed job aren't digested
+        failed = {"Subject": "Transcription job failed", "Message": json.dumps({"job": "b", "error": "bad"})}
+        self.assertIsNone(digest.digest_entry(failed))
+        self.assertIsNone(digest.digest_entry({"Subject": "", "Message": "not json"}))
+
+    def test_open_digests_needs_a_table(self):
+        os.environ.pop("DIGEST_TABLE", None)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            self.assertIsNone(digest.open_digests("slack"))
+        self.assertIn("DIGEST_TABLE", output.getvalue())
+
+        digest.digest_window = 0
+        os.environ["DIGEST_TABLE"] = "jobs"
+        self.assertIsNone(digest.open_digests("slack"))
+
+    def test_flushed_when_window_closes(self):
+        failed = {"Sns": {"Subject": "Transcription job failed", "Message": json.dumps({"job": "c"})}}
+        statuses = self.send_digests(completed("a", "s3://upload/Class 1/a.mp3"), failed,
+                                     completed("b", "s3://upload/Class 1/b.mp3"),
+                                     completed("a", "s3://upload/Class 1/a.mp3"),
+                                     completed("d", "s3://upload/d.mp3"))
+        self.assertEqual(statuses, [200])
+        self.assertEqual(self.notified, [failed["Sns"]])
+        self.assertEqual(self.send.messages, [])
+
+        self.clock.now += digest.digest_window - 1
+        self.assertEqual(self.send_digests(), [])
+
+        # The scheduled flush after the window sends one message for each folder, with each job once
+        self.clock.now += 1
+        self.assertEqual(self.send_digests(), [200, 200])
+        self.assertEqual(self.send.messages, [{"title": "1 transcription job completed", "jobs": ["d"]},
+                                              {"title": "2 transcription jobs completed in Class 1",
+                                               "jobs": ["a", "b"]}])
+        self.assertEqual(self.digests.groups, {})
+
+    def test_flushed_when_full(self):
+        digest.digest_max_jobs = 2
+        self.assertEqual(self.send_digests(completed("a", "s3://upload/x/a.mp3")), [])
+        self.assertEqual(self.send_digests(completed("b", "s3://upload/x/b.mp3")), [200])
+        self.assertEqual(self.send.messages, [{"title": "2 transcription jobs completed in x", "jobs": ["a", "b"]}])
+
+    def test_failed_delivery_is_added_back(self):
+        self.send.statuses = [500, None]
+        self.send_digests(completed("a", "s3://upload/x/a.mp3"), completed("b", "s3://upload/x/b.mp3"))
+        self.clock.now += digest.digest_window
+        self.assertEqual(self.send_digests(), [500])
+
+        # The jobs keep the time their digest opened at, so they are sent with the next flush
+        self.assertEqual(self.digests.due(self.clock.now - digest.digest_window), ["x"])
+        self.assertEqual(self.send_digests(), [None])
+        self.assertEqual(self.send_digests(completed("c", "s3://upload/x/c.mp3")), [200])
+        self.assertEqual(self.send.messages[-1], {"title": "3 transcription jobs completed in x",
+                                                  "jobs": ["a", "b", "c"]})
+        self.assertEqual(self.digests.groups, {})
+
+    def test_split_at_slack_block_limit(self):
+        self.assertLessEqual(digest.digest_max_jobs, digest.MAX_DIGEST_ENTRIES)
+        jobs = [f"job{i:03}" for i in range(120)]
+        for job in jobs:
+            self.digests.add("x", {"job": job, "duration": 1, "s3uri": "s3://output/" + job}, self.clock.now)
+        self.send.statuses = [200, 429]
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(digest.flush_digest(self.digests, URL, "x", 60.0, build_digest_message, "Slack"), 429)
+        self.assertEqual([len(message["jobs"]) for message in self.send.messages], [49, 49])
+        self.assertEqual(self.send.messages[0]["jobs"], jobs[:49])
+
+        # Only the jobs that weren't sent are put back, and the rest of them go in the next flush
+        self.assertEqual([entry["job"] for entry in self.digests.groups["x"]["entries"]], jobs[49:])
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(digest.flush_digest(self.digests, URL, "x", 60.0, build_digest_message, "Slack"), 200)
+        self.assertEqual([len(message["jobs"]) for message in self.send.messages[2:]], [49, 22])
+        self.assertEqual(self.send.messages[-1]["title"], "22 transcription jobs completed in x")
+
+if __name__ == '__main__':
+    unittest.main()
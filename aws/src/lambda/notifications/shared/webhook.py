@@ -0,0 +1,143 @@
+"""
+Delivery to a chat webhook, shared by the Teams and Slack notifiers.  The webhook URL, the thread pool and the
+connections to the webhook are kept between invocations, so that a warm container neither fetches the secret nor
+reconnects each time
+"""
+import http.client
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import boto3
+
+SECRET_TTL = 300            # Seconds to use the webhook URL for before fetching it from Secrets Manager again
+DELIVERY_THREADS = 8        # Notifications that can be being sent at once
+MAX_ATTEMPTS = 4            # Times to try sending each notification
+RETRY_BASE_DELAY = 0.5      # Seconds of the first backoff when a send fails
+RETRY_MAX_DELAY = 10.0      # Longest backoff in seconds, including one asked for by the webhook
+REQUEST_TIMEOUT = 5         # Seconds to wait for the webhook to answer
+RETRY_TIME_MARGIN = 1.0     # Seconds of the invocation to leave unused
+
+secrets_client = None
+webhook_cache = {"url": None, "expires": 0.0}
+executor = ThreadPoolExecutor(max_workers=DELIVERY_THREADS)
+connections = threading.local()
+
+def get_webhook_url():
+    """Retrieve webhook URL from AWS Secrets Manager, reusing it for SECRET_TTL seconds"""
+    global secrets_client
+    secret_arn = os.environ.get('WEBHOOK_SECRET_ARN')
+
+    if not secret_arn or secret_arn == "":
+        return 'DISABLED'
+
+    if webhook_cache["url"] is not None and time.monotonic() < webhook_cache["expires"]:
+        return webhook_cache["url"]
+
+    try:
+        if secrets_client is None:
+            secrets_client = boto3.client('secretsmanager')
+        response = secrets_client.get_secret_value(SecretId=secret_arn)
+    except Exception as e:
+        print(f"Failed to retrieve webhook URL from Secrets Manager: {e}")
+        return 'DISABLED'
+    webhook_cache["url"] = response['SecretString']
+    webhook_cache["expires"] = time.monotonic() + SECRET_TTL
+    return webhook_cache["url"]
+
+def post_json(url, data):
+    """
+    POSTs JSON over a keep-alive connection that this thread keeps open to the webhook's host, reconnecting once
+    if the connection turns out to have been closed while it was idle
+
+    :return: Tuple of the response status and its Retry-After header
+    """
+    parts = urlsplit(url)
+    path = parts.path + ("?" + parts.query if parts.query else "")
+    if not hasattr(connections, "pool"):
+        connections.pool = {}
+    for attempt in range(2):
+        connection = connections.pool.get(parts.netloc)
+        reused = connection is not None
+        if connection is None:
+            connection = http.client.HTTPSConnection(parts.netloc, timeout=REQUEST_TIMEOUT)
+            connections.pool[parts.netloc] = connection
+        try:
+            connection.request("POST", path, body=data, headers={"Content-Type": "application/json"})
+            response = connection.getresponse()
+            response.read()
+            if response.will_close:
+                connection.close()
+                del connections.pool[parts.netloc]
+            return response.status, response.getheader("Retry-After")
+        except (http.client.HTTPException, OSError):
+            connection.close()
+            del connections.pool[parts.netloc]
+            if not reused or attempt > 0:
+                raise
+
+def retry_delay(attempt, retry_after):
+    """
+    Works out how long to wait before the next attempt, which is as long as the webhook asked for when it is
+    rate limiting us, and otherwise an exponential backoff with full jitter
+
+    :return: Delay in seconds
+    """
+    if retry_after:
+        try:
+            return min(RETRY_MAX_DELAY, max(0.0, float(retry_after)))
+        except ValueError:
+            try:
+                return min(RETRY_MAX_DELAY, max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time()))
+            except (TypeError, ValueError):
+                pass
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+
+def send(webhook, message, deadline, service):
+    """
+    Sends a message to the webhook, retrying failures and rate limiting while there is time
+
+    :param service: Name of the chat service, for the log
+    :return: Last response status, or None if the webhook couldn't be reached
+    """
+    request_data = json.dumps(message).encode("utf-8")
+    status = None
+    for attempt in range(MAX_ATTEMPTS):
+        retry_after = None
+        try:
+            status, retry_after = post_json(webhook, request_data)
+            if 200 <= status < 300:
+                return status
+            if status != 429 and status < 500:
+                break
+        except Exception as e:
+            print(e)
+        delay = retry_delay(attempt, retry_after)
+        if attempt + 1 == MAX_ATTEMPTS or time.monotonic() + delay > deadline:
+            break
+        time.sleep(delay)
+    print(f"Failed to notify {service}. Response: {status}")
+    return status
+
+def get_deadline(context):
+    """
+    :param context: Lambda context, or None when run outside Lambda
+    :return: Monotonic time by which every send has to have finished
+    """
+    remaining = context.get_remaining_time_in_millis() / 1000 if context is not None else 60
+    return time.monotonic() + remaining - RETRY_TIME_MARGIN
+
+def send_all(notify, webhook, records, deadline):
+    """
+    Sends every notification in an SNS event at once
+
+    :param notify: Function that sends one notification, given the webhook, the SNS message and the deadline
+    :return: Response statuses of the notifications
+    """
+    sends = [executor.submit(notify, webhook, record['Sns'], deadline) for record in records]
+    return [sent.result() for sent in sends]
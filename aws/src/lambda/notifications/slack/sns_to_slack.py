@@ -1,32 +1,38 @@
 import json
-import os
-import boto3
-from urllib.request import urlopen
-from urllib.request import Request
-
-def get_webhook_url():
-    """Retrieve webhook URL from AWS Secrets Manager"""
-    secret_arn = os.environ.get('WEBHOOK_SECRET_ARN')
-    
-    if not secret_arn or secret_arn == "":
-        return 'DISABLED'
-    
-    try:
-        secrets_client = boto3.client('secretsmanager')
-        response = secrets_client.get_secret_value(SecretId=secret_arn)
-        return response['SecretString']
-    except Exception as e:
-        print(f"Failed to retrieve webhook URL from Secrets Manager: {e}")
-        return 'DISABLED'
 
-def lambda_handler(event, context):
-    webhook = get_webhook_url()
-    title = event['Records'][0]['Sns']['Subject']
-    content = event['Records'][0]['Sns']['Message']
+from digest import format_duration, open_digests, send_digests
+from webhook import get_deadline, get_webhook_url, send, send_all
+
+SERVICE_NAME = "Slack"      # Name of the chat service, for the log
+DIGEST_SERVICE = "slack"    # Sort key prefix that keeps this notifier's digests apart from the other's
+
+# Digest mode, which gathers the completions from each folder into one message, is off without a window
+digests = open_digests(DIGEST_SERVICE)
+
+def build_message(title, body):
+    job_name = body.get("job", "Unknown Job")
+    s3uri = body.get("s3uri", "No S3 URI provided")
+    slack_message = f"*Transcription job completed*\nJob Name:\n`{job_name}`\nTranscript available at:\n`{s3uri}`"
+    exports = [f"{name}: `{uri}`" for name, uri in (body.get("artifacts") or {}).items() if name != "docx"]
+    if exports:
+        slack_message += "\nAlso saved:\n" + "\n".join(exports)
+    return {"blocks": [{"type": "section","text": {"type": "mrkdwn","text": slack_message}}]}
+
+def build_digest_message(title, entries):
+    # Each job has its own block, as a block's text is limited to 3000 characters
+    blocks = [{"type": "section", "text": {"type": "mrkdwn", "text": f"*{title}*"}}]
+    for entry in entries:
+        text = f"`{entry['job']}` ({format_duration(entry['duration'])})\n`{entry['s3uri']}`"
+        blocks.append({"type": "section", "text": {"type": "mrkdwn", "text": text}})
+    return {"blocks": blocks}
+
+def notify(webhook, sns, deadline):
+    title = sns['Subject']
+    content = sns['Message']
 
     if not webhook or webhook == "DISABLED":
         print(f"notify_slack disabled, logging message instead: {title} {content}")
-        return
+        return None
 
     if not title:
         title = "ATS notification"
@@ -35,21 +41,19 @@ def lambda_handler(event, context):
         body = json.loads(content)
     except Exception as e:
         print(f"Failed to parse SNS message as JSON: {e}.")
-        return
+        return None
 
-    job_name = body.get("job", "Unknown Job")
-    s3uri = body.get("s3uri", "No S3 URI provided")
-    slack_message = f"*Transcription job completed*\nJob Name:\n`{job_name}`\nTranscript available at:\n`{s3uri}`"
-    message = {"blocks": [{"type": "section","text": {"type": "mrkdwn","text": slack_message}}]}
-    request_data = json.dumps(message).encode("utf-8")
-    req = Request(url=webhook, headers={"Content-Type": "application/json"}, data=request_data, method='POST')
+    return send(webhook, build_message(title, body), deadline, SERVICE_NAME)
 
-    try:
-        response = urlopen(req)
-        if response.status != 200:
-            print(f"Failed to notify Slack. Response: {response.status}")
-        return response.status
-    except Exception as e:
-        print(e)
+def lambda_handler(event, context):
+    webhook = get_webhook_url()
+    deadline = get_deadline(context)
+
+    # The scheduled flush has no records, and only sends the digests that are due
+    records = event.get('Records', [])
+    if digests is not None:
+        return send_digests(digests, webhook, records, deadline, notify, build_digest_message,
+                            SERVICE_NAME)
 
- 
\ No newline at end of file
+    # Every notification in the event is sent at once
+    return send_all(notify, webhook, records, deadline)
@@ -1,30 +1,75 @@
 import boto3
 import os
+import re
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
-def lambda_handler(event, context):
-    # Get the SQS message from the event
-    message = event['Records'][0]['body']
-    
-    # Get the state machine ARN from environment variables
-    state_machine_arn = os.environ['STATE_MACHINE_ARN']
-    
-    # Start the Step Functions workflow
-    step_functions = boto3.client('stepfunctions')
+START_THREADS = 10          # Executions that can be being started at once
+EXECUTION_NAME_LENGTH = 80  # Longest execution name that Step Functions allows
+NAME_HASH_LENGTH = 12       # Hex digits of the hash that keeps shortened execution names unique
+
+# Step Functions client, shared by every invocation of this container
+step_functions = boto3.client('stepfunctions')
+
+def execution_name(message):
+    """
+    Builds the execution name for a message, from the Transcribe job name in it.  A message that is delivered
+    more than once gets the same name each time, so Step Functions starts only one execution for it
+
+    :param message: SQS message body, which is normally a Transcribe job state change event
+    :return: Execution name
+    """
+    try:
+        job_name = json.loads(message)["detail"]["TranscriptionJobName"]
+    except Exception:
+        job_name = None
+    if not job_name:
+        return "message-" + hashlib.sha256(message.encode("utf-8")).hexdigest()[:NAME_HASH_LENGTH]
+
+    # Only letters, numbers, hyphens and underscores are safe in a name, and the hash of the full job name keeps
+    # names distinct where that changed or shortened them
+    digest = hashlib.sha256(job_name.encode("utf-8")).hexdigest()[:NAME_HASH_LENGTH]
+    prefix = re.sub(r'[^a-zA-Z0-9_-]+', '_', job_name)[:EXECUTION_NAME_LENGTH - NAME_HASH_LENGTH - 1]
+    return prefix + "-" + digest
+
+def start_execution(state_machine_arn, message):
+    """
+    Starts the Step Functions workflow for one message
+
+    :param state_machine_arn: ARN of the state machine
+    :param message: SQS message body, passed to the workflow as its input
+    """
+    name = execution_name(message)
     try:
         response = step_functions.start_execution(
             stateMachineArn=state_machine_arn,
+            name=name,
             input=message
         )
-    except Exception as e:
-        print(e)
-        return {
-            'statusCode': 500,
-            'body': 'Error starting Step Functions workflow'
-        }
-
-    print(response)
-
-    return {
-        'statusCode': 200,
-        'body': 'Step Functions workflow started'
-    }
\ No newline at end of file
+        print(response)
+    except step_functions.exceptions.ExecutionAlreadyExists:
+        # A duplicate delivery of a message whose workflow has already started
+        print(f"Execution {name} already exists")
+
+def lambda_handler(event, context):
+    # Get the state machine ARN from environment variables
+    state_machine_arn = os.environ['STATE_MACHINE_ARN']
+
+    # Start the Step Functions workflow for every SQS message in the batch at once
+    with ThreadPoolExecutor(max_workers=START_THREADS) as executor:
+        starts = [(record["messageId"], executor.submit(start_execution, state_machine_arn, record["body"]))
+                  for record in event['Records']]
+
+    # Send the messages whose workflow didn't start back to the queue for retry
+    batch_failures = []
+    for message_id, start in starts:
+        try:
+            start.result()
+        except Exception as e:
+            print(f"Error starting Step Functions workflow for message {message_id}: {e}")
+            batch_failures.append({"itemIdentifier": message_id})
+
+    response = {"batchItemFailures": batch_failures}
+    print(f"Function ending. Response={response}")
+    return response
@@ -0,0 +1,75 @@
+import contextlib
+import io
+import json
+import os
+import unittest
+
+# The module creates its client on import, which needs a region but no credentials
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+target = __import__("step_proxy")
+
+def job_message(job_name):
+    return json.dumps({"detail": {"TranscriptionJobName": job_name, "TranscriptionJobStatus": "COMPLETED"}})
+
+class FakeStepFunctions:
+    class exceptions:
+        class ExecutionAlreadyExists(Exception):
+            pass
+
+    def __init__(self):
+        self.started = {}
+        self.failing = ()               # Execution name prefixes that fail to start
+    def start_execution(self, stateMachineArn, name, input):
+        if name.startswith(self.failing):
+            raise ConnectionError(name)
+        if name in self.started:
+            raise self.exceptions.ExecutionAlreadyExists(name)
+        self.started[name] = input
+        return {"executionArn": stateMachineArn + ":" + name}
+
+class TestStepProxy(unittest.TestCase):
+    def test_execution_name_rules(self):
+        for job_name in ("interview.mp3-1b4e28ba-2fa1-5e4c-9a0d-7b3f6c2d1e0f", "Class 1/ä (1).mp3-x", "a" * 200):
+            name = target.execution_name(job_message(job_name))
+            self.assertLessEqual(len(name), target.EXECUTION_NAME_LENGTH)
+            self.assertRegex(name, r"^[a-zA-Z0-9_-]+$")
+            self.assertEqual(name, target.execution_name(job_message(job_name)))
+
+    def test_execution_names_stay_distinct(self):
+        # Names that only differ in characters that are replaced, or past the length limit, keep apart
+        names = {target.execution_name(job_message(job_name))
+                 for job_name in ("a b.mp3", "a_b.mp3", "a/b.mp3", "a" * 100 + "1", "a" * 100 + "2")}
+        self.assertEqual(len(names), 5)
+        self.assertEqual(len(target.execution_name(job_message("a" * 100))), target.EXECUTION_NAME_LENGTH)
+
+    def test_execution_name_without_job(self):
+        name = target.execution_name("not json")
+        self.assertRegex(name, r"^message-[0-9a-f]{%d}$" % target.NAME_HASH_LENGTH)
+        self.assertEqual(name, target.execution_name("not json"))
+        self.assertNotEqual(name, target.execution_name(json.dumps({"detail": {}})))
+
+    def test_batch_item_failures(self):
+        step_functions = FakeStepFunctions()
+        step_functions.failing = ("failing",)
+        records = [{"messageId": "m1", "body": job_message("first.mp3")},
+                   {"messageId": "m2", "body": job_message("failing.mp3")},
+                   {"messageId": "m3", "body": job_message("first.mp3")},
+                   {"messageId": "m4", "body": job_message("second.mp3")}]
+        client = target.step_functions
+        environ = dict(os.environ)
+        try:
+            target.step_functions = step_functions
+            os.environ["STATE_MACHINE_ARN"] = "arn:aws:states:us-east-1:123456789012:stateMachine:test"
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = target.lambda_handler({"Records": records}, None)
+        finally:
+            target.step_functions = client
+            os.environ.clear()
+            os.environ.update(environ)
+
+        # The duplicate delivery of first.mp3 is not a failure, and only starts one execution
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "m2"}]})
+        self.assertEqual(len(step_functions.started), 2)
+
+if __name__ == '__main__':
+    unittest.main()
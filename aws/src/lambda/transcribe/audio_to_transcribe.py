@@ -1,40 +1,262 @@
 import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
 from urllib.parse import unquote_plus
+from concurrent.futures import ThreadPoolExecutor
 import json
 from datetime import datetime as dt
 import os
+import random
+import threading
+import time
 import uuid
 import re
 
 # Get current date for S3 folder name:
 today = dt.now().strftime("%Y%m%d")
 
-# S3 client to read/write files
-s3 = boto3.client('s3')
+SUBMIT_THREADS = 8                  # Transcription jobs that can be being started at once
+RETRY_BASE_DELAY = 0.25             # Seconds of the first backoff when Transcribe is throttling us
+RETRY_MAX_DELAY = 8.0               # Longest single backoff in seconds
+RETRY_TIME_MARGIN = 2.0             # Seconds of the invocation to leave for returning the batch result
+RETRY_ERROR_CODES = ("ThrottlingException", "LimitExceededException")
+ADMISSION_PK = "admission"          # Partition of the jobs table that holds the in-flight job counter
+ADMISSION_COUNTER_SK = "counter"    # Sort key of the counter item, whose InFlight attribute is the count
+ADMISSION_JOB_PREFIX = "job#"       # Sort key prefix of the marker kept for each admitted job
+ADMISSION_RECLAIM_AGE = 900         # Seconds a job holds its slot before it is checked for finishing unnoticed
+ADMISSION_RECLAIM_INTERVAL = 300    # Least seconds between those checks in each container
+ADMISSION_BASE_DELAY = 60           # Seconds that an upload over the quota is first held for
+ADMISSION_MAX_DELAY = 900           # Longest hold in seconds, which is as long as SQS can delay a message
 
-# Transcribe client to read job results
-ts_client = boto3.client('transcribe')
+# Transcribe client to start jobs.  Throttling is retried by submit_job() instead of botocore, so that the
+# backoff can be jittered and kept within the time the invocation has left
+ts_client = boto3.client('transcribe', config=Config(retries={"mode": "standard", "total_max_attempts": 1}))
 
-def lambda_handler(event, context):
+class LocalAdmissionStore:
     """
-    Entrypoint for the transcribe Lambda function. Pulls batch of messages from SQS standard queue.
+    In-memory stand-in for the admission counter, which the unit tests use in place of DynamoDB
     """
-    print("audio_to_transcribe.lambda_handler started")
 
-    s3bucketOutput = os.environ["BUCKET"]
-    batch_failures = []
-    for record in event["Records"]:
-        event_message = json.loads(record["body"])
-        print(f"Event message: {event_message}")
+    def __init__(self, limit):
+        self.limit = limit
+        self.jobs = {}                  # Job name -> time it was admitted
+        self.lock = threading.Lock()
+
+    def acquire(self, job_name):
+        """
+        Takes a slot for a job, unless every slot is already taken.  A job that already has one keeps it
 
-        recordZero = event_message['Records'][0]
-        # unquote_plus to handle spaces
-        s3object = unquote_plus(recordZero['s3']['object']['key'])
-        s3bucketInput = recordZero['s3']['bucket']['name']
+        :param job_name: Transcribe job name
+        :return: True if the job may be started
+        """
+        with self.lock:
+            if job_name in self.jobs:
+                return True
+            if len(self.jobs) >= self.limit:
+                return False
+            self.jobs[job_name] = time.time()
+            return True
 
-        s3Path = "s3://" + s3bucketInput + "/" + s3object
-        jobName = re.sub('[^a-zA-Z0-9_\-.]+','_', s3object) + '-' + str(uuid.uuid4())
+    def release(self, job_name):
+        """
+        Gives back the slot held by a job
 
+        :param job_name: Transcribe job name
+        :return: True if the job held a slot
+        """
+        with self.lock:
+            return self.jobs.pop(job_name, None) is not None
+
+    def held_since(self, age):
+        """
+        :param age: Seconds that a job must have held its slot for
+        :return: Names of the jobs that were admitted at least that long ago
+        """
+        cutoff = time.time() - age
+        with self.lock:
+            return [job_name for job_name, admitted in self.jobs.items() if admitted <= cutoff]
+
+    def recount(self):
+        """
+        :return: Number of jobs holding a slot
+        """
+        with self.lock:
+            return len(self.jobs)
+
+class DynamoDBAdmissionStore:
+    """
+    Counter of in-flight Transcribe jobs, kept in the jobs table.  Each admitted job also has a marker item, and
+    the counter only changes in the same transaction as a marker, so a job is never counted twice or released
+    twice however often its messages and events are delivered.  The markers never expire, so the counter always
+    matches them, and a job that finishes without its slot being released is found by held_since()
+    """
+
+    def __init__(self, client, table, limit):
+        self.client = client
+        self.table = table
+        self.limit = limit
+
+    def marker_key(self, job_name):
+        return {"PK": {"S": ADMISSION_PK}, "SK": {"S": ADMISSION_JOB_PREFIX + job_name}}
+
+    def counter_key(self):
+        return {"PK": {"S": ADMISSION_PK}, "SK": {"S": ADMISSION_COUNTER_SK}}
+
+    def acquire(self, job_name):
+        """
+        Takes a slot for a job, unless every slot is already taken.  A job that already has one keeps it
+
+        :param job_name: Transcribe job name
+        :return: True if the job may be started
+        """
+        try:
+            self.client.transact_write_items(TransactItems=[
+                {"Update": {
+                    "TableName": self.table,
+                    "Key": self.counter_key(),
+                    "UpdateExpression": "SET InFlight = if_not_exists(InFlight, :zero) + :one",
+                    "ConditionExpression": "attribute_not_exists(InFlight) OR InFlight < :limit",
+                    "ExpressionAttributeValues": {":zero": {"N": "0"}, ":one": {"N": "1"},
+                                                  ":limit": {"N": str(self.limit)}}}},
+                {"Put": {
+                    "TableName": self.table,
+                    "Item": {**self.marker_key(job_name), "Admitted": {"N": str(int(time.time()))}},
+                    "ConditionExpression": "attribute_not_exists(SK)"}},
+            ])
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+            reasons = [reason.get("Code") for reason in e.response.get("CancellationReasons", [])]
+            if len(reasons) == 2 and reasons[1] == "ConditionalCheckFailed":
+                return True
+            if len(reasons) == 2 and reasons[0] == "ConditionalCheckFailed":
+                return False
+            raise
+
+    def release(self, job_name):
+        """
+        Gives back the slot held by a job
+
+        :param job_name: Transcribe job name
+        :return: True if the job held a slot
+        """
+        try:
+            self.client.transact_write_items(TransactItems=[
+                {"Delete": {
+                    "TableName": self.table,
+                    "Key": self.marker_key(job_name),
+                    "ConditionExpression": "attribute_exists(SK)"}},
+                {"Update": {
+                    "TableName": self.table,
+                    "Key": self.counter_key(),
+                    "UpdateExpression": "SET InFlight = InFlight - :one",
+                    "ConditionExpression": "InFlight > :zero",
+                    "ExpressionAttributeValues": {":zero": {"N": "0"}, ":one": {"N": "1"}}}},
+            ])
+            return True
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "TransactionCanceledException":
+                return False
+            raise
+
+    def held_since(self, age):
+        """
+        :param age: Seconds that a job must have held its slot for
+        :return: Names of the jobs that were admitted at least that long ago
+        """
+        job_names = []
+        paginator = self.client.get_paginator("query")
+        for page in paginator.paginate(
+                TableName=self.table,
+                KeyConditionExpression="PK = :pk AND begins_with(SK, :prefix)",
+                FilterExpression="attribute_not_exists(Admitted) OR Admitted <= :cutoff",
+                ExpressionAttributeValues={":pk": {"S": ADMISSION_PK}, ":prefix": {"S": ADMISSION_JOB_PREFIX},
+                                           ":cutoff": {"N": str(int(time.time() - age))}},
+                ProjectionExpression="SK"):
+            job_names.extend(item["SK"]["S"][len(ADMISSION_JOB_PREFIX):] for item in page["Items"])
+        return job_names
+
+    def recount(self):
+        """
+        Sets the counter to the number of markers, in case any were removed without it, such as markers that
+        expired under an earlier version of this function.  The counter is left alone if a job was admitted or
+        released while the markers were being counted
+
+        :return: Number of jobs holding a slot
+        """
+        counter = self.client.get_item(TableName=self.table, Key=self.counter_key(), ConsistentRead=True)
+        in_flight = counter.get("Item", {}).get("InFlight", {}).get("N", "0")
+        markers = 0
+        paginator = self.client.get_paginator("query")
+        for page in paginator.paginate(
+                TableName=self.table,
+                KeyConditionExpression="PK = :pk AND begins_with(SK, :prefix)",
+                ExpressionAttributeValues={":pk": {"S": ADMISSION_PK}, ":prefix": {"S": ADMISSION_JOB_PREFIX}},
+                Select="COUNT", ConsistentRead=True):
+            markers += page["Count"]
+        if markers != int(in_flight):
+            try:
+                self.client.update_item(
+                    TableName=self.table,
+                    Key=self.counter_key(),
+                    UpdateExpression="SET InFlight = :markers",
+                    ConditionExpression="InFlight = :in_flight",
+                    ExpressionAttributeValues={":markers": {"N": str(markers)}, ":in_flight": {"N": in_flight}})
+                print(f"Admission counter corrected from {in_flight} to {markers}")
+            except ClientError as e:
+                if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                    raise
+        return markers
+
+# Admission control against the account's concurrent Transcribe job quota, which is off without a table
+admission = None
+if os.environ.get("ADMISSION_TABLE"):
+    admission = DynamoDBAdmissionStore(boto3.client('dynamodb'), os.environ["ADMISSION_TABLE"],
+                                       int(os.environ.get("ADMISSION_LIMIT", "100")))
+
+# When this container last looked for slots held by jobs that have finished
+last_reclaim = 0.0
+reclaim_lock = threading.Lock()
+
+# SQS client to hold uploads over the quota back on the queue
+sqs = boto3.client('sqs')
+
+def create_job_name(bucket, key, sequencer):
+    """
+    Builds the Transcribe job name for an uploaded file.  It is the same every time the same upload is seen, so
+    a message that is delivered again cannot start a second job for it
+
+    :param bucket: Bucket the file was uploaded to
+    :param key: Key of the uploaded file
+    :param sequencer: S3 event sequencer of the upload, which differs when the same key is uploaded again
+    :return: Job name
+    """
+    upload = uuid.uuid5(uuid.NAMESPACE_URL, "s3://" + bucket + "/" + key + "#" + sequencer)
+    return re.sub(r'[^a-zA-Z0-9_\-.]+', '_', key) + '-' + str(upload)
+
+def remaining_seconds(context):
+    """
+    :param context: Lambda context, or None when not running in Lambda
+    :return: Seconds left in this invocation, less the margin kept for returning the result
+    """
+    if context is None:
+        return float("inf")
+    return context.get_remaining_time_in_millis() / 1000 - RETRY_TIME_MARGIN
+
+def submit_job(jobName, s3Path, s3bucketOutput, context):
+    """
+    Starts the transcription of one uploaded file, backing off with full jitter while Transcribe is throttling
+    or at its concurrent job limit, for as long as the invocation has time left
+
+    :param jobName: Transcribe job name
+    :param s3Path: S3 URI of the uploaded file
+    :param s3bucketOutput: Bucket for the transcript
+    :param context: Lambda context
+    :return: True if the job was started or is still running, or False if an earlier start of it has finished
+    """
+    attempt = 0
+    while True:
         try:
             response = ts_client.start_transcription_job(
                 TranscriptionJobName=jobName,
@@ -50,10 +272,177 @@ def lambda_handler(event, context):
                 OutputKey = today + "/"
             )
             print(response)
+            return True
+        except ClientError as e:
+            code = e.response["Error"]["Code"]
+            if code == "ConflictException":
+                # An earlier delivery of this message already started the job, which may have finished since
+                print(f"Job {jobName} already exists for {s3Path}")
+                return not job_finished(jobName)
+            if code not in RETRY_ERROR_CODES:
+                raise
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            if delay > remaining_seconds(context):
+                raise
+            print(f"{code} starting job {jobName}, retrying in {delay:.2f} seconds")
+            time.sleep(delay)
+            attempt += 1
+
+def job_finished(jobName):
+    """
+    :param jobName: Transcribe job name
+    :return: True if the job has completed or failed, or no longer exists
+    """
+    try:
+        status = ts_client.get_transcription_job(TranscriptionJobName=jobName)["TranscriptionJob"]
+        return status["TranscriptionJobStatus"] in ("COMPLETED", "FAILED")
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "BadRequestException":
+            # Jobs that have been deleted are not found
+            return True
+        raise
+
+def reclaim_slots():
+    """
+    Gives back the slots of jobs that finished without releasing them, for example because their completion
+    event was lost or they were cancelled by hand, and corrects the counter to match the jobs holding a slot.
+    This runs when the quota is full, at most once every ADMISSION_RECLAIM_INTERVAL seconds in each container
+
+    :return: True if any slots were given back
+    """
+    global last_reclaim
+    with reclaim_lock:
+        if time.time() - last_reclaim < ADMISSION_RECLAIM_INTERVAL:
+            return False
+        last_reclaim = time.time()
+
+    in_flight = admission.recount()
+    released = 0
+    for jobName in admission.held_since(ADMISSION_RECLAIM_AGE):
+        try:
+            if job_finished(jobName) and admission.release(jobName):
+                released += 1
+        except Exception as e:
+            print(f"Unable to check whether job {jobName} has finished: {e}")
+    print(f"Reclaimed {released} of {in_flight} admission slot(s) from finished jobs")
+    return released > 0 or in_flight < admission.limit
+
+def process_upload(s3bucketInput, s3object, sequencer, s3bucketOutput, context):
+    """
+    Starts the transcription of one uploaded file, if there is room for it under the concurrent job quota
+
+    :param s3bucketInput: Bucket the file was uploaded to
+    :param s3object: Key of the uploaded file
+    :param sequencer: S3 event sequencer of the upload
+    :param s3bucketOutput: Bucket for the transcript
+    :param context: Lambda context
+    :return: True if the job was started, or already had been, or False if it has to wait for a slot
+    """
+    s3Path = "s3://" + s3bucketInput + "/" + s3object
+    jobName = create_job_name(s3bucketInput, s3object, sequencer)
+    if admission is not None and not admission.acquire(jobName):
+        if not (reclaim_slots() and admission.acquire(jobName)):
+            print(f"Concurrent job quota reached, holding {s3Path}")
+            return False
+
+    try:
+        if not submit_job(jobName, s3Path, s3bucketOutput, context) and admission is not None:
+            # A repeat delivery of an upload whose job has already finished, which must not keep the slot
+            admission.release(jobName)
+    except Exception as e:
+        if admission is not None:
+            admission.release(jobName)
+        if isinstance(e, ClientError) and e.response["Error"]["Code"] == "LimitExceededException":
+            # Jobs started outside this pipeline count towards the quota too
+            print(f"Transcribe is at its concurrent job limit, holding {s3Path}")
+            return False
+        raise
+    return True
+
+def hold_delay(attempts):
+    """
+    Works out how long to hold an upload that is over the quota, doubling with each hold and with jitter so
+    that a large batch of uploads does not all come back at once
+
+    :param attempts: Number of times the upload has already been held
+    :return: Delay in seconds
+    """
+    delay = min(ADMISSION_MAX_DELAY, ADMISSION_BASE_DELAY * 2 ** attempts)
+    return int(delay / 2 + random.uniform(0, delay / 2))
+
+def hold_uploads(record, s3records):
+    """
+    Puts uploads that are over the quota back on the queue as a new delayed message.  The original message can
+    then be deleted, so waiting for a slot does not use up its receives and send it to the dead-letter queue
+
+    :param record: SQS record the uploads came from
+    :param s3records: S3 event records of the uploads to hold
+    """
+    attributes = record.get("messageAttributes") or {}
+    attempts = int(attributes.get("AdmissionAttempts", {}).get("stringValue", 0))
+    delay = hold_delay(attempts)
+    sqs.send_message(
+        QueueUrl=os.environ["QUEUE_URL"],
+        MessageBody=json.dumps({"Records": s3records}),
+        DelaySeconds=delay,
+        MessageAttributes={"AdmissionAttempts": {"DataType": "Number", "StringValue": str(attempts + 1)}}
+    )
+    print(f"Held {len(s3records)} upload(s) from message {record['messageId']} for {delay} seconds")
+
+def lambda_handler(event, context):
+    """
+    Entrypoint for the transcribe Lambda function. Pulls batch of messages from SQS standard queue, and starts a
+    transcription job for every uploaded file in them at once
+    """
+    print("audio_to_transcribe.lambda_handler started")
+
+    s3bucketOutput = os.environ["BUCKET"]
+
+    # Each message is an S3 event, which may be about more than one file
+    submissions = []
+    batch_failures = []
+    with ThreadPoolExecutor(max_workers=SUBMIT_THREADS) as executor:
+        for record in event["Records"]:
+            try:
+                event_message = json.loads(record["body"])
+                print(f"Event message: {event_message}")
+                if event_message.get("Event") == "s3:TestEvent":
+                    # Sent by S3 when the notification is set up, and there is nothing to transcribe
+                    continue
+                for s3record in event_message['Records']:
+                    # unquote_plus to handle spaces
+                    s3object = unquote_plus(s3record['s3']['object']['key'])
+                    s3bucketInput = s3record['s3']['bucket']['name']
+                    sequencer = s3record['s3']['object'].get('sequencer', '')
+                    submissions.append((record, s3record, executor.submit(process_upload, s3bucketInput, s3object,
+                                                                          sequencer, s3bucketOutput, context)))
+            except Exception as e:
+                print(f"Unable to read message {record['messageId']}: {e}")
+                batch_failures.append({"itemIdentifier": record["messageId"]})
+
+    # A message goes back to the queue if any of its files failed, which is safe as the job names stop a file
+    # that did start from being transcribed twice
+    held = {}
+    for record, s3record, submission in submissions:
+        failure = {"itemIdentifier": record["messageId"]}
+        try:
+            if not submission.result():
+                held.setdefault(record["messageId"], (record, []))[1].append(s3record)
         except Exception as e:
-            print(e)
-            batch_failures.append({"itemIdentifier": record["messageId"]})
+            print(f"Failed to start transcription of {s3record['s3']['object']['key']}: {e}")
+            if failure not in batch_failures:
+                batch_failures.append(failure)
+
+    # Otherwise any files over the quota are held back on the queue
+    for messageId, (record, s3records) in held.items():
+        failure = {"itemIdentifier": messageId}
+        if failure in batch_failures:
             continue
+        try:
+            hold_uploads(record, s3records)
+        except Exception as e:
+            print(f"Failed to hold message {messageId}: {e}")
+            batch_failures.append(failure)
 
     # Send failed messages back to queue for retry
     sqs_response = {}
@@ -61,4 +450,4 @@ def lambda_handler(event, context):
         sqs_response["batchItemFailures"] = batch_failures
 
     print(f"Function ending. Response={sqs_response}")
-    return sqs_response
\ No newline at end of file
+    return sqs_response
@@ -0,0 +1,203 @@
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+import unittest
+
+from botocore.exceptions import ClientError
+
+# The module creates its clients on import, which needs a region but no credentials
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+target = __import__("audio_to_transcribe")
+
+def client_error(code):
+    return ClientError({"Error": {"Code": code, "Message": code}}, "StartTranscriptionJob")
+
+class FakeContext:
+    def __init__(self, remaining, clock):
+        self.remaining = remaining      # Seconds left in the invocation when it started
+        self.clock = clock
+    def get_remaining_time_in_millis(self):
+        return int((self.remaining - sum(self.clock.sleeps)) * 1000)
+
+class FakeTranscribe:
+    def __init__(self, errors=(), status="IN_PROGRESS"):
+        self.errors = list(errors)      # Error codes to raise from the next starts, in order
+        self.rejected = ()              # Prefixes of the job names that are always rejected
+        self.status = status
+        self.started = []
+        self.lock = threading.Lock()
+    def start_transcription_job(self, TranscriptionJobName, **kwargs):
+        if TranscriptionJobName.startswith(self.rejected):
+            raise client_error("BadRequestException")
+        with self.lock:
+            if self.errors:
+                raise client_error(self.errors.pop(0))
+            if TranscriptionJobName in self.started:
+                raise client_error("ConflictException")
+            self.started.append(TranscriptionJobName)
+        return {"TranscriptionJob": {"TranscriptionJobName": TranscriptionJobName}}
+    def get_transcription_job(self, TranscriptionJobName):
+        return {"TranscriptionJob": {"TranscriptionJobStatus": self.status}}
+
+class FakeSQS:
+    def __init__(self):
+        self.sent = []
+    def send_message(self, **kwargs):
+        self.sent.append(kwargs)
+
+class FakeTime:
+    """Records the backoffs instead of sleeping through them"""
+    def __init__(self):
+        self.sleeps = []
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+    def time(self):
+        return time.time()
+
+class LongestRandom:
+    """Always picks the longest backoff that full jitter allows"""
+    def uniform(self, low, high):
+        return high
+
+def s3_record(key, sequencer="0055AED6DCD90281E5"):
+    return {"s3": {"bucket": {"name": "upload"}, "object": {"key": key, "sequencer": sequencer}}}
+
+def sqs_record(message_id, *keys, attributes=None):
+    return {"messageId": message_id, "body": json.dumps({"Records": [s3_record(key) for key in keys]}),
+            "messageAttributes": attributes or {}}
+
+class TestSubmit(unittest.TestCase):
+    def setUp(self):
+        self.saved = {name: getattr(target, name) for name in ("ts_client", "sqs", "time", "random", "admission",
+                                                              "last_reclaim")}
+        self.environ = dict(os.environ)
+        self.transcribe = FakeTranscribe()
+        self.sqs = FakeSQS()
+        self.time = FakeTime()
+        target.ts_client = self.transcribe
+        target.sqs = self.sqs
+        target.time = self.time
+        target.random = LongestRandom()
+        target.admission = None
+        os.environ.update({"BUCKET": "output", "QUEUE_URL": "https://sqs/queue"})
+
+    def tearDown(self):
+        for name, value in self.saved.items():
+            setattr(target, name, value)
+        os.environ.clear()
+        os.environ.update(self.environ)
+
+    def run_handler(self, *records, remaining=20.0):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return target.lambda_handler({"Records": list(records)}, FakeContext(remaining, self.time))
+
+    def test_create_job_name(self):
+        key = "Class 1/interview (1).mp3"
+        name = target.create_job_name("upload", key, "0055AED6DCD90281E5")
+        self.assertEqual(name, target.create_job_name("upload", key, "0055AED6DCD90281E5"))
+        self.assertNotEqual(name, target.create_job_name("upload", key, "0055AED6DCD90281E6"))
+        self.assertTrue(name.startswith("Class_1_interview_1_.mp3-"))
+        self.assertRegex(name, r"^[a-zA-Z0-9_\-.]+$")
+
+    def test_throttle_then_success(self):
+        self.transcribe.errors = ["ThrottlingException", "LimitExceededException"]
+        self.assertEqual(self.run_handler(sqs_record("m1", "a.mp3")), {})
+        self.assertEqual(len(self.transcribe.started), 1)
+        self.assertEqual(self.time.sleeps, [target.RETRY_BASE_DELAY, target.RETRY_BASE_DELAY * 2])
+
+    def test_backoff_bounded_by_remaining_time(self):
+        # The backoffs must all finish before the invocation's margin, or the message is reported failed instead
+        self.transcribe.errors = ["ThrottlingException"] * 10
+        remaining = target.RETRY_TIME_MARGIN + 1.0
+        response = self.run_handler(sqs_record("m1", "a.mp3"), remaining=remaining)
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "m1"}]})
+        self.assertEqual(self.transcribe.started, [])
+        self.assertEqual(self.time.sleeps, [target.RETRY_BASE_DELAY, target.RETRY_BASE_DELAY * 2])
+        self.assertLessEqual(sum(self.time.sleeps), remaining - target.RETRY_TIME_MARGIN)
+
+    def test_conflict_is_already_submitted(self):
+        self.transcribe.errors = ["ConflictException"]
+        self.assertEqual(self.run_handler(sqs_record("m1", "a.mp3")), {})
+        self.assertEqual(self.transcribe.started, [])
+
+    def test_other_errors_fail_their_message(self):
+        self.transcribe.rejected = ("a.mp3",)
+        response = self.run_handler(sqs_record("m1", "a.mp3"), sqs_record("m2", "b.mp3"))
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "m1"}]})
+        self.assertEqual(len(self.transcribe.started), 1)
+        self.assertEqual(self.time.sleeps, [])
+
+    def test_unreadable_and_test_events(self):
+        test_event = {"messageId": "m1", "body": json.dumps({"Event": "s3:TestEvent"})}
+        unreadable = {"messageId": "m2", "body": "not json"}
+        response = self.run_handler(test_event, unreadable, sqs_record("m3", "a.mp3"))
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "m2"}]})
+        self.assertEqual(len(self.transcribe.started), 1)
+
+class TestAdmission(TestSubmit):
+    def setUp(self):
+        super().setUp()
+        target.admission = target.LocalAdmissionStore(1)
+        target.last_reclaim = time.time()
+
+    def test_quota_full_is_held(self):
+        target.admission.acquire("other-job")
+        attempts = {"AdmissionAttempts": {"stringValue": "2", "dataType": "Number"}}
+        record = sqs_record("m1", "a.mp3", attributes=attempts)
+        self.assertEqual(self.run_handler(record), {})
+        self.assertEqual(self.transcribe.started, [])
+        self.assertEqual(target.admission.recount(), 1)
+        self.assertEqual(len(self.sqs.sent), 1)
+        held = self.sqs.sent[0]
+        self.assertEqual(json.loads(held["MessageBody"]), {"Records": [s3_record("a.mp3")]})
+        self.assertEqual(held["DelaySeconds"], target.ADMISSION_BASE_DELAY * 2 ** 2)
+        self.assertEqual(held["MessageAttributes"]["AdmissionAttempts"]["StringValue"], "3")
+
+        # Once the slot is given back, the held upload is admitted
+        target.admission.release("other-job")
+        self.assertEqual(self.run_handler(json.loads(json.dumps(record))), {})
+        self.assertEqual(len(self.transcribe.started), 1)
+        self.assertEqual(target.admission.held_since(0), self.transcribe.started)
+        self.assertEqual(len(self.sqs.sent), 1)
+
+    def test_hold_delay_is_capped(self):
+        self.assertEqual(target.hold_delay(0), target.ADMISSION_BASE_DELAY)
+        self.assertEqual(target.hold_delay(10), target.ADMISSION_MAX_DELAY)
+
+    def test_duplicate_delivery_keeps_one_slot(self):
+        target.admission = target.LocalAdmissionStore(2)
+        self.assertEqual(self.run_handler(sqs_record("m1", "a.mp3"), sqs_record("m2", "a.mp3")), {})
+        self.assertEqual(len(self.transcribe.started), 1)
+        self.assertEqual(target.admission.recount(), 1)
+
+        # A delivery after the job has finished gives back the slot rather than keeping it
+        self.transcribe.status = "COMPLETED"
+        self.assertEqual(self.run_handler(sqs_record("m3", "a.mp3")), {})
+        self.assertEqual(target.admission.recount(), 0)
+
+    def test_failed_start_releases_slot(self):
+        self.transcribe.rejected = ("a.mp3",)
+        response = self.run_handler(sqs_record("m1", "a.mp3"))
+        self.assertEqual(response, {"batchItemFailures": [{"itemIdentifier": "m1"}]})
+        self.assertEqual(target.admission.recount(), 0)
+
+    def test_reclaim_slots(self):
+        target.admission.acquire("finished-job")
+        target.admission.jobs["finished-job"] = 0
+        target.last_reclaim = 0.0
+        self.transcribe.status = "COMPLETED"
+        self.assertEqual(self.run_handler(sqs_record("m1", "a.mp3")), {})
+        self.assertEqual(len(self.transcribe.started), 1)
+        self.assertEqual(target.admission.held_since(0), self.transcribe.started)
+        self.assertEqual(self.sqs.sent, [])
+
+        # Checks are rate limited, so a full quota straight afterwards is held without asking Transcribe again
+        self.assertFalse(target.reclaim_slots())
+        self.assertEqual(self.run_handler(sqs_record("m2", "b.mp3")), {})
+        self.assertEqual(len(self.sqs.sent), 1)
+
+if __name__ == '__main__':
+    unittest.main()
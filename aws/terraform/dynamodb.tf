@@ -14,6 +14,20 @@ module "dynamodb_table" {
     {
       name = "SK"
       type = "S"
+    },
+    {
+      name = "Created"
+      type = "S"
+    }
+  ]
+
+  # Lets export_jobs read only the jobs created since its last incremental export
+  global_secondary_indexes = [
+    {
+      name            = "Created"
+      hash_key        = "PK"
+      range_key       = "Created"
+      projection_type = "ALL"
     }
   ]
 
@@ -52,3 +52,12 @@ resource "aws_cloudwatch_event_target" "trigger_step_function" {
   arn       = module.step_function.state_machine_arn
   role_arn  = aws_iam_role.eventbridge_role.arn
 }
+
+# Sends the notification digests whose window has closed, when digest mode is on
+resource "aws_cloudwatch_event_rule" "digest_flush_rule" {
+  count               = var.digest_window > 0 && (var.teams_notification || var.slack_notification) ? 1 : 0
+  name                = "${var.prefix}-flush-notification-digests"
+  description         = "Send the notification digests whose window has closed"
+  schedule_expression = "rate(1 minute)"
+  state               = "ENABLED"
+}
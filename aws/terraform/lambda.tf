@@ -27,11 +27,15 @@ module "transcribe" {
   function_name = "${var.prefix}-${var.lambda_ts}"
   handler       = "audio_to_transcribe.lambda_handler"
   runtime       = "python${var.python_version}"
+  timeout       = 25 # Time to back off while Transcribe is throttling, within the queue's 30 second visibility timeout
   publish       = true
   source_path   = "../src/lambda/transcribe"
   environment_variables = {
-    LOG_LEVEL = "INFO"
-    BUCKET    = aws_s3_bucket.download.id
+    LOG_LEVEL       = "INFO"
+    BUCKET          = aws_s3_bucket.download.id
+    QUEUE_URL       = aws_sqs_queue.audio_to_transcribe.url
+    ADMISSION_TABLE = var.transcribe_limit > 0 ? module.dynamodb_table.dynamodb_table_id : ""
+    ADMISSION_LIMIT = var.transcribe_limit
   }
 
   attach_policy_json = true
@@ -46,9 +50,9 @@ module "transcribe" {
                 "s3:PutObject",
                 "s3:GetObject",
                 "s3:ListBucket",
-                "transcribe:GetTranscriptionJob",
                 "sqs:ReceiveMessage",
                 "sqs:DeleteMessage",
+                "sqs:SendMessage",
                 "sqs:GetQueueAttributes"
             ],
             "Resource": [
@@ -63,9 +67,22 @@ module "transcribe" {
             "Sid": "VisualEditor2",
             "Effect": "Allow",
             "Action": [
-                "transcribe:StartTranscriptionJob"
+                "transcribe:StartTranscriptionJob",
+                "transcribe:GetTranscriptionJob"
             ],
             "Resource": "*"
+        },
+        {
+            "Sid": "AdmissionCounter",
+            "Effect": "Allow",
+            "Action": [
+                "dynamodb:GetItem",
+                "dynamodb:PutItem",
+                "dynamodb:UpdateItem",
+                "dynamodb:DeleteItem",
+                "dynamodb:Query"
+            ],
+            "Resource": "${module.dynamodb_table.dynamodb_table_arn}"
         }
     ]
   }
@@ -87,11 +104,21 @@ module "teams-notification" {
   timeout       = 15 # Set a short timeout for notifications
   publish       = true
 
-  source_path = "../src/lambda/notifications/teams"
+  # The webhook delivery and digest code is shared with the Slack Lambda
+  source_path = [
+    "../src/lambda/notifications/teams",
+    {
+      path     = "../src/lambda/notifications/shared"
+      patterns = ["!.*", "webhook\\.py", "digest\\.py"]
+    }
+  ]
 
   environment_variables = {
     LOG_LEVEL          = "INFO"
     WEBHOOK_SECRET_ARN = var.teams_notification ? aws_secretsmanager_secret.teams_webhook[0].arn : ""
+    DIGEST_WINDOW      = var.digest_window
+    DIGEST_MAX_JOBS    = var.digest_max_jobs
+    DIGEST_TABLE       = var.digest_window > 0 ? module.dynamodb_table.dynamodb_table_id : ""
   }
 
   attach_policy_json = true
@@ -137,6 +164,16 @@ module "teams-notification" {
                 "secretsmanager:GetSecretValue"
             ],
             "Resource": "${var.teams_notification ? aws_secretsmanager_secret.teams_webhook[0].arn : "*"}"
+        },
+        {
+            "Sid": "DigestBuffer",
+            "Effect": "Allow",
+            "Action": [
+                "dynamodb:UpdateItem",
+                "dynamodb:DeleteItem",
+                "dynamodb:Query"
+            ],
+            "Resource": "${module.dynamodb_table.dynamodb_table_arn}"
         }
     ]
   }
@@ -163,6 +200,22 @@ resource "aws_sns_topic_subscription" "teams_notification_subscription" {
   endpoint  = module.teams-notification[0].lambda_function_arn
 }
 
+resource "aws_lambda_permission" "teams_notification_digest_permission" {
+  count         = var.teams_notification && var.digest_window > 0 ? 1 : 0
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = module.teams-notification[0].lambda_function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.digest_flush_rule[0].arn
+}
+
+resource "aws_cloudwatch_event_target" "teams_notification_digest_flush" {
+  count     = var.teams_notification && var.digest_window > 0 ? 1 : 0
+  rule      = aws_cloudwatch_event_rule.digest_flush_rule[0].name
+  target_id = "flush-teams-digests"
+  arn       = module.teams-notification[0].lambda_function_arn
+}
+
 module "export_jobs" {
   source  = "terraform-aws-modules/lambda/aws"
   version = ">= 7.14.0"
@@ -172,11 +225,22 @@ module "export_jobs" {
   runtime       = "python${var.python_version}"
   timeout       = 300
   publish       = true
-  source_path   = "../src/lambda/export"
+
+  # The S3 upload code is shared with the docx Lambda
+  source_path = [
+    "../src/lambda/export",
+    {
+      path     = "../src/lambda/docx"
+      patterns = ["!.*", "s3_multipart\\.py"]
+    }
+  ]
 
   environment_variables = {
-    DOWNLOAD_BUCKET = aws_s3_bucket.download.id
-    DYNAMODB_TABLE  = module.dynamodb_table.dynamodb_table_id
+    DOWNLOAD_BUCKET   = aws_s3_bucket.download.id
+    DYNAMODB_TABLE    = module.dynamodb_table.dynamodb_table_id
+    CREATED_INDEX     = "Created"
+    EXPORT_MODE       = var.export_mode
+    EXPORT_LEGACY_CSV = var.export_legacy_csv
   }
 
   attach_policy_json = true
@@ -188,17 +252,31 @@ module "export_jobs" {
         "Sid": "QueryDynamoDB",
         "Effect": "Allow",
         "Action": [
-          "dynamodb:Query"
+          "dynamodb:Query",
+          "dynamodb:Scan"
         ],
-        "Resource": "${module.dynamodb_table.dynamodb_table_arn}"
+        "Resource": [
+          "${module.dynamodb_table.dynamodb_table_arn}",
+          "${module.dynamodb_table.dynamodb_table_arn}/index/*"
+        ]
       },
       {
         "Sid": "WriteToS3",
         "Effect": "Allow",
         "Action": [
-          "s3:PutObject"
+          "s3:PutObject",
+          "s3:GetObject",
+          "s3:AbortMultipartUpload"
         ],
         "Resource": "${aws_s3_bucket.download.arn}/*"
+      },
+      {
+        "Sid": "FindManifest",
+        "Effect": "Allow",
+        "Action": [
+          "s3:ListBucket"
+        ],
+        "Resource": "${aws_s3_bucket.download.arn}"
       }
     ]
   }
@@ -264,12 +342,17 @@ module "docx" {
 
   image_uri = module.docker_build.image_uri
   environment_variables = {
-    MPLCONFIGDIR      = var.mpl
-    BUCKET            = aws_s3_bucket.download.id
-    TIMEOUT           = var.docx_timeout
-    CONFIDENCE        = var.confidence_score
-    DOCX_MAX_DURATION = var.docx_max_duration
-    DOCUMENT_TITLE    = var.document_title
+    MPLCONFIGDIR            = var.mpl
+    BUCKET                  = aws_s3_bucket.download.id
+    TIMEOUT                 = var.docx_timeout
+    CONFIDENCE              = var.confidence_score
+    DOCX_MAX_DURATION       = var.docx_max_duration
+    DOCX_RENDERER           = var.docx_renderer
+    DOCX_TEMPLATE           = var.docx_template
+    DOCUMENT_TITLE          = var.document_title
+    PYTHONPROFILEIMPORTTIME = var.docx_importtime ? "1" : ""
+    EXPORT_FORMATS          = var.export_formats
+    ADMISSION_TABLE         = var.transcribe_limit > 0 ? module.dynamodb_table.dynamodb_table_id : ""
   }
 
   image_config_command = ["transcribe_to_docx.lambda_handler"]
@@ -284,6 +367,7 @@ module "docx" {
         "Effect" : "Allow",
         "Action" : [
           "s3:PutObject",
+          "s3:AbortMultipartUpload",
           "s3:DeleteObject",
           "s3:GetObject",
           "s3:ListBucket",
@@ -302,6 +386,15 @@ module "docx" {
         "Effect" : "Allow",
         "Action" : "transcribe:ListTranscriptionJobs",
         "Resource" : "*"
+      },
+      {
+        "Sid" : "AdmissionCounter",
+        "Effect" : "Allow",
+        "Action" : [
+          "dynamodb:UpdateItem",
+          "dynamodb:DeleteItem"
+        ],
+        "Resource" : "${module.dynamodb_table.dynamodb_table_arn}"
       }
     ]
   }
@@ -324,11 +417,21 @@ module "slack-notification" {
   timeout       = 15 # Set a short timeout for notifications
   publish       = true
 
-  source_path = "../src/lambda/notifications/slack"
+  # The webhook delivery and digest code is shared with the Teams Lambda
+  source_path = [
+    "../src/lambda/notifications/slack",
+    {
+      path     = "../src/lambda/notifications/shared"
+      patterns = ["!.*", "webhook\\.py", "digest\\.py"]
+    }
+  ]
 
   environment_variables = {
     LOG_LEVEL          = "INFO"
     WEBHOOK_SECRET_ARN = var.slack_notification ? aws_secretsmanager_secret.slack_webhook[0].arn : ""
+    DIGEST_WINDOW      = var.digest_window
+    DIGEST_MAX_JOBS    = var.digest_max_jobs
+    DIGEST_TABLE       = var.digest_window > 0 ? module.dynamodb_table.dynamodb_table_id : ""
   }
 
   attach_policy_json = true
@@ -374,6 +477,16 @@ module "slack-notification" {
                 "secretsmanager:GetSecretValue"
             ],
             "Resource": "${var.slack_notification ? aws_secretsmanager_secret.slack_webhook[0].arn : "*"}"
+        },
+        {
+            "Sid": "DigestBuffer",
+            "Effect": "Allow",
+            "Action": [
+                "dynamodb:UpdateItem",
+                "dynamodb:DeleteItem",
+                "dynamodb:Query"
+            ],
+            "Resource": "${module.dynamodb_table.dynamodb_table_arn}"
         }
     ]
   }
@@ -398,4 +511,20 @@ resource "aws_sns_topic_subscription" "slack_notification_subscription" {
   topic_arn = module.sns_topic.topic_arn
   protocol  = "lambda"
   endpoint  = module.slack-notification[0].lambda_function_arn
+}
+
+resource "aws_lambda_permission" "slack_notification_digest_permission" {
+  count         = var.slack_notification && var.digest_window > 0 ? 1 : 0
+  statement_id  = "AllowExecutionFromEventBridge"
+  action        = "lambda:InvokeFunction"
+  function_name = module.slack-notification[0].lambda_function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.digest_flush_rule[0].arn
+}
+
+resource "aws_cloudwatch_event_target" "slack_notification_digest_flush" {
+  count     = var.slack_notification && var.digest_window > 0 ? 1 : 0
+  rule      = aws_cloudwatch_event_rule.digest_flush_rule[0].name
+  target_id = "flush-slack-digests"
+  arn       = module.slack-notification[0].lambda_function_arn
 }
\ No newline at end of file
@@ -19,7 +19,64 @@ module "step_function" {
             "Next": "Create DOCX"
           }
         ],
-        "Default": "Transcribe failed notification"
+        "Default": "Release admission slot"
+      },
+      "Release admission slot": {
+        "Comment": "Free the failed job's slot under the concurrent job quota. A job without one is skipped.",
+        "Type": "Task",
+        "Resource": "arn:aws:states:::aws-sdk:dynamodb:transactWriteItems",
+        "Parameters": {
+          "TransactItems": [
+            {
+              "Delete": {
+                "TableName": "${module.dynamodb_table.dynamodb_table_id}",
+                "Key": {
+                  "PK": {
+                    "S": "admission"
+                  },
+                  "SK": {
+                    "S.$": "States.Format('job#{}', $.detail.TranscriptionJobName)"
+                  }
+                },
+                "ConditionExpression": "attribute_exists(SK)"
+              }
+            },
+            {
+              "Update": {
+                "TableName": "${module.dynamodb_table.dynamodb_table_id}",
+                "Key": {
+                  "PK": {
+                    "S": "admission"
+                  },
+                  "SK": {
+                    "S": "counter"
+                  }
+                },
+                "UpdateExpression": "SET InFlight = InFlight - :one",
+                "ConditionExpression": "InFlight > :zero",
+                "ExpressionAttributeValues": {
+                  ":zero": {
+                    "N": "0"
+                  },
+                  ":one": {
+                    "N": "1"
+                  }
+                }
+              }
+            }
+          ]
+        },
+        "Catch": [
+          {
+            "ErrorEquals": [
+              "States.ALL"
+            ],
+            "ResultPath": null,
+            "Next": "Transcribe failed notification"
+          }
+        ],
+        "ResultPath": null,
+        "Next": "Transcribe failed notification"
       },
       "Transcribe failed notification": {
         "Type": "Task",
@@ -102,6 +159,9 @@ module "step_function" {
             },
             "Created": {
               "S.$": "$.body.created"
+            },
+            "Artifacts": {
+              "S.$": "States.JsonToString($.body.artifacts)"
             }
           }
         },
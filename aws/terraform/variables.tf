@@ -70,6 +70,48 @@ variable "docx_max_duration" {
   default     = 13150
 }
 
+variable "docx_renderer" {
+  description = "Rendering engine for transcribe_to_docx: auto, python-docx or stream. auto streams transcripts longer than an hour straight into the DOCX"
+  type        = string
+  default     = "auto"
+}
+
+variable "docx_template" {
+  description = "Optional s3:// URI of a .docx template for transcripts, which must be in the upload or download bucket. Empty uses the built-in layout"
+  type        = string
+  default     = ""
+}
+
+variable "docx_importtime" {
+  description = "Whether the DOCX Lambda logs how long each module takes to import during a cold start"
+  type        = bool
+  default     = false
+}
+
+variable "export_formats" {
+  description = "Comma-separated extra formats to save next to each DOCX, from txt, srt, vtt and csv. Empty saves only the DOCX and its sidecar"
+  type        = string
+  default     = ""
+}
+
+variable "export_mode" {
+  description = "How export_jobs runs by default: incremental saves only the jobs since the last export as a dated delta file, full rewrites the whole export"
+  type        = string
+  default     = "incremental"
+}
+
+variable "export_legacy_csv" {
+  description = "Whether export_jobs also saves the full export uncompressed as export/transcribe_jobs.csv, where earlier versions saved it. Incremental runs build it from the full export and its deltas rather than reading every job. Turn this off once nothing reads that file"
+  type        = bool
+  default     = true
+}
+
+variable "transcribe_limit" {
+  description = "Most Transcribe jobs to have running at once, which should not be above the account's concurrent batch transcription job quota. Further uploads wait on the queue for a free slot. 0 turns this off"
+  type        = number
+  default     = 0
+}
+
 variable "teams_notification" {
   description = "Whether to create the SNS teams_notification Lambda and subscribe it to the SNS topic"
   type        = bool
@@ -82,6 +124,18 @@ variable "slack_notification" {
   default     = false
 }
 
+variable "digest_window" {
+  description = "Seconds to gather the completed jobs from each upload folder into one Teams or Slack message for, which is sent when the window closes or digest_max_jobs is reached. 0 sends a message for every job"
+  type        = number
+  default     = 0
+}
+
+variable "digest_max_jobs" {
+  description = "Most jobs in one digest message, after which it is sent before its window closes. Values above 49, the most that fit in a Slack message, are treated as 49"
+  type        = number
+  default     = 20
+}
+
 variable "python_version" {
   description = "Python version to use for the Lambda functions. Supported versions: 3.12 or later"
   type        = string
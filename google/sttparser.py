@@ -2,46 +2,142 @@
 # Exploration and testing of the speech-to-text API
 
 import json
-import time
 import argparse
 from google.cloud import storage
 from urllib.parse import urlparse
 
+READ_SIZE = 1024 * 1024     # Characters of a response to read at a time
+
 # Format output of timestamps
 def timestamp(seconds):
     if (seconds.find(".") == -1):
-        seconds = int(seconds[:-1])
-        ts = time.gmtime(seconds)
-        return time.strftime("%H:%M:%S",ts)
+        whole = int(seconds[:-1])
+        fraction = ""
     else:
         x = seconds.split(".")
-        seconds = int(x[0])
-        ts = time.gmtime(seconds)
-        return time.strftime("%H:%M:%S",ts) + "." + x[1][:3]    
+        whole = int(x[0])
+        fraction = "." + x[1][:3]
+    # The same as formatting the time with time.gmtime() and strftime("%H:%M:%S"), without either call
+    return f"{whole // 3600 % 24:02d}:{whole // 60 % 60:02d}:{whole % 60:02d}" + fraction
 
 def decode_gcs_url(url):
     p = urlparse(url)
     return p.netloc, p.path[1:]
 
-def download_blob(url):
-    if url:
-        bucket, file_path = decode_gcs_url(url)
+def open_response(path):
+    """
+    Opens a response file for reading as text, streaming it from Cloud Storage for a gs:// URL
+
+    :param path: Local path or gs:// URL of the response
+    :return: File object
+    """
+    if (urlparse(path).scheme == 'gs'):
+        bucket, file_path = decode_gcs_url(path)
         storage_client = storage.Client()
         bucket = storage_client.bucket(bucket)
-        blob = bucket.blob(file_path)
-        contents = blob.download_as_text()
-        return contents
+        return bucket.blob(file_path).open("r")
+    return open(path)
+
+class ResponseReader:
+    """
+    Reads the JSON values in a response one at a time, reading more of the file only when it runs out
+    """
+
+    def __init__(self, response_file):
+        self.file = response_file
+        self.decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.position = 0
+
+    def read_more(self):
+        # Reading at least as much as is left over keeps the retries of a long value linear in its length
+        more = self.file.read(max(READ_SIZE, len(self.buffer) - self.position))
+        self.buffer = self.buffer[self.position:] + more
+        self.position = 0
+        return bool(more)
+
+    def peek(self):
+        """
+        :return: Next character that isn't whitespace, or "" at the end of the file
+        """
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in ' \t\r\n':
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self.read_more():
+                return ""
+
+    def take(self, expected):
+        """
+        :param expected: Characters that may come next
+        :return: Next character, which is moved past
+        """
+        char = self.peek()
+        if not char or char not in expected:
+            name = getattr(self.file, 'name', 'the response')
+            raise ValueError(f"Expected one of {expected} in {name} but found {char!r}")
+        self.position += 1
+        return char
+
+    def value(self):
+        """
+        :return: Next JSON value
+        """
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self.read_more():
+                    raise
+                continue
+            # A number that ends the buffer may carry on in the rest of the file
+            if end == len(self.buffer) and isinstance(value, (int, float)) and self.read_more():
+                continue
+            self.position = end
+            return value
+
+def iter_results(response_file):
+    """
+    Steps through the results of a speech-to-text response as they are read, so that only one result is held in
+    memory however long the audio was.  Everything else in the response is skipped
+
+    :param response_file: Response file object, opened as text
+    """
+    reader = ResponseReader(response_file)
+    reader.take('{')
+    if reader.peek() == '}':
+        return
+    while True:
+        key = reader.value()
+        reader.take(':')
+        if key == 'results' and reader.peek() == '[':
+            reader.take('[')
+            if reader.peek() == ']':
+                reader.take(']')
+            else:
+                while True:
+                    yield reader.value()
+                    if reader.take(',]') == ']':
+                        break
+        else:
+            reader.value()
+        if reader.take(',}') == '}':
+            return
 
 # Next version parses the final transcription result in the response file, which includes speaker ID and timestamp for every word.
-def print_transcript(response, speakers=False):
+def print_transcript(results, speakers=False):
     if(speakers):
-        last = len(response['results'])-1
-        transcript = response['results'][last]
+        # Only the final result is needed, so the earlier ones are dropped as they are read
+        transcript = None
+        for transcript in results:
+            pass
 
         #Grab first first speaker and start time for initial timestamp
-        best_alternative = transcript['alternatives'][0]
         current_words = []
         try:
+            best_alternative = transcript['alternatives'][0]
             current_speaker = best_alternative['words'][0]['speakerTag']
         except (KeyError, IndexError, TypeError):
             print("Speaker diarization not enabled.")
@@ -73,7 +169,7 @@ def print_transcript(response, speakers=False):
         print()
     else:
         ts = "00:00:00"
-        for result in response['results']:
+        for result in results:
             best_alternative = result['alternatives'][0]
             transcript = best_alternative.get('transcript','missing')
             if (transcript == 'missing'):
@@ -91,14 +187,9 @@ def main():
     parser.add_argument('-s', '--speakers', action='store_true', dest='speakers', help='Enable speaker diarization')
     args = parser.parse_args()
     
-    # Open response file and load JSON results
-    if (urlparse(args.file).scheme == 'gs'):
-        response_file = download_blob(args.file)
-        response = json.loads(response_file)
-    else:
-        with open(args.file) as f:
-            response = json.load(f)
-    print_transcript(response, args.speakers)
+    # Read the results from the response file as they are needed
+    with open_response(args.file) as f:
+        print_transcript(iter_results(f), args.speakers)
 
 if __name__ == "__main__":
     main()
@@ -1,159 +1,123 @@
 # # Speech-to-text
 # Exploration and testing of the speech-to-text API
 
-import json
-import time
 import argparse
 import os
-from google.cloud import storage
-from urllib.parse import urlparse
-from docx.shared import Mm, Pt, Inches, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_COLOR_INDEX
-from docx import Document
-
-# Common formats and styles
-TABLE_STYLE_STANDARD = "Light List"
-
-confidence_env = int(os.environ.get('CONFIDENCE', 90))
-
-# Format output of timestamps
-def timestamp(seconds):
-    if (seconds.find(".") == -1):
-        seconds = int(seconds[:-1])
-        ts = time.gmtime(seconds)
-        return time.strftime("%H:%M:%S",ts)
-    else:
-        x = seconds.split(".")
-        seconds = int(x[0])
-        ts = time.gmtime(seconds)
-        return time.strftime("%H:%M:%S",ts) + "." + x[1][:3]
-
-def decode_gcs_url(url):
-    p = urlparse(url)
-    return p.netloc, p.path[1:]
-
-def download_blob(url):
-    if url:
-        bucket, file_path = decode_gcs_url(url)
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket)
-        blob = bucket.blob(file_path)
-        contents = blob.download_as_text()
-        return contents
-
-# Next version parses the final transcription result in the response file, which includes speaker ID and timestamp for every word.
-def print_transcript(response, document, speakers=False):
-    write_custom_text_header(document, "Audio Transcription")
-
-    if speakers:
-        last = len(response['results']) - 1
-        transcript = response['results'][last]
-
-        #Grab first first speaker and start time for initial timestamp
-        best_alternative = transcript['alternatives'][0]
-        try:
-            current_speaker = best_alternative['words'][0]['speakerTag']
-        except (KeyError, IndexError, TypeError):
-            document.add_paragraph("Speaker diarization not enabled.")
-            return
-        current_ts = best_alternative['words'][0]['startTime']
+import sys
 
-        document.add_paragraph()  # Spacing
-        write_small_header_text(document, "WORD CONFIDENCE: >= " + str(confidence_env) + "% in black, ", (confidence_env / 100))
-        write_small_header_text(document, "< " + str(confidence_env) + "% in yellow highlight", ((confidence_env - 1) / 100))
+from sttparser import iter_results, open_response
 
-        paragraph = document.add_paragraph()
-        run = paragraph.add_run()
+# The document is rendered by the Amazon Transcribe converter, so that both clouds share the same transcript model
+# and renderer.  Its module, aws/src/lambda/docx/transcribe_to_docx.py, has to be on PYTHONPATH
+from transcribe_to_docx import SpeechSegment, TranscriptStats, TranscriptWords, write
 
-        #Initial speaker
-        run.add_text(f"[{timestamp(current_ts)}] Speaker {current_speaker}: ")
-        run = paragraph.add_run()
+SOURCE_GOOGLE = "Google Cloud Speech-to-Text"
 
-        #Loop through words
-        #When speaker changes: print line, timestamp, speaker, paragraph, add line break
-        for word in best_alternative['words']:
-            next_speaker = word['speakerTag']
-            next_word = word['word']
-
-            if next_speaker != current_speaker:
-                #New speaker
-                current_ts = word['startTime']
-                paragraph = document.add_paragraph()
-                run = paragraph.add_run()
-                run.add_text(f"[{timestamp(current_ts)}] Speaker {current_speaker}: ")
-                run = paragraph.add_run()
-                current_speaker = next_speaker
-
-            #Confidence highlighting and add word
-            confidence = word['confidence']
-            set_transcript_text_style(run, False, confidence=confidence)
-
-            run.add_text(next_word + " ")
-            run = paragraph.add_run()
-    else:
-        ts = "00:00:00"
-        for result in response['results']:
-            best_alternative = result['alternatives'][0]
-            transcript = best_alternative.get('transcript', 'missing')
-            if transcript == 'missing':
-                continue
-            confidence = best_alternative['confidence']
-            document.add_paragraph(f"[{ts} {confidence:.0%}]: {transcript}")
-            ts = timestamp(result['resultEndTime'])
-
-def set_transcript_text_style(run, force_highlight, confidence=0.0, rgb_color=None):
+def google_time(duration):
     """
-    Sets the colour and potentially the style of a given run of text in a transcript.  You can either
-    supply the hex-code, or base it upon the confidence score in the transcript.
-
-    :param run: DOCX paragraph run to be modified
-    :param force_highlight: Indicates that we're going to forcibly set the background colour
-    :param confidence: Confidence score for this word, used to dynamically set the colour
-    :param rgb_color: Specific colour for the text
+    :param duration: Google duration, such as "83.450s"
+    :return: Duration in seconds
     """
+    return float(duration[:-1]) if duration.endswith("s") else float(duration)
 
-    # If we have an RGB colour then use it
-    if rgb_color is not None:
-        run.font.color.rgb = rgb_color
-    else:
-        # Set the colour based upon the supplied confidence score
-        if confidence >= (confidence_env / 100):
-            run.font.color.rgb = RGBColor(0, 0, 0)
-        else:
-            run.font.highlight_color = WD_COLOR_INDEX.YELLOW
-
-    # Apply any other styles wanted
-    if confidence == 0.0:
-        # Call out any total disasters in bold
-        run.font.bold = True
-
-    # Force the background colour if required
-    if force_highlight:
-        run.font.highlight_color = WD_COLOR_INDEX.YELLOW
-
-def write_small_header_text(document, text, confidence):
+def create_speaker_segments(result, words, stats=None):
     """
-    Helper function to write out small header entries, where the text colour matches the
-    colour of the transcript text for a given confidence value
+    Creates the speech segments of a diarized response from its final result, which repeats every word with its
+    speaker.  A new segment starts whenever the speaker changes
 
-    :param document: Document to write the text to
-    :param text: Text to be output
-    :param confidence: Confidence score, which changes the text colour
+    :param result: Final result of the response
+    :param words: TranscriptWords to hold the segments' words
+    :param stats: (optional) TranscriptStats to add each segment to once it is complete
+    :return: List of speech segments
     """
-    run = document.paragraphs[-1].add_run(text)
-    set_transcript_text_style(run, False, confidence=confidence)
-    run.font.size = Pt(10)
-    run.font.italic = True
+    try:
+        best_alternative = result['alternatives'][0]
+        best_alternative['words'][0]['speakerTag']
+    except (KeyError, IndexError, TypeError):
+        raise ValueError("Speaker diarization not enabled.")
+    alternative_confidence = best_alternative.get('confidence', 0.0)
+
+    speech_segments = []
+    segment = None
+    for word in best_alternative['words']:
+        # Google numbers speakers from 1, and Transcribe from 0
+        speaker = "spk_" + str(int(word['speakerTag']) - 1)
+        start_time = google_time(word['startTime'])
+        end_time = google_time(word['endTime'])
+        if segment is None or speaker != segment.segmentSpeaker:
+            if segment is not None and stats is not None:
+                stats.add_segment(segment)
+            segment = SpeechSegment(words)
+            segment.segmentStartTime = start_time
+            segment.segmentSpeaker = speaker
+            speech_segments.append(segment)
+        segment.segmentEndTime = end_time
+        segment.add_word(word['word'], float(word.get('confidence', alternative_confidence)), start_time, end_time)
+    if segment is not None and stats is not None:
+        stats.add_segment(segment)
+    return speech_segments
+
+def create_result_segment(result, words, last_end_time):
+    """
+    Creates the speech segment for one result of a response that isn't diarized
 
-def write_custom_text_header(document, text_label):
+    :param result: Response result
+    :param words: TranscriptWords to hold the segment's words
+    :param last_end_time: End time of the previous result, which is where this one starts if it has no word times
+    :return: Speech segment, or None if the result has no transcript
     """
-    Adds a run of text to the document with the given text label, but using our customer text-header style
+    best_alternative = result['alternatives'][0]
+    if 'transcript' not in best_alternative:
+        return None
+    confidence = float(best_alternative.get('confidence', 0.0))
+    segment = SpeechSegment(words)
+    segment.segmentStartTime = last_end_time
+    segment.segmentEndTime = google_time(result.get('resultEndTime', "0s"))
+    if 'channelTag' in result:
+        segment.segmentSpeaker = "Channel " + str(result['channelTag'])
+
+    if best_alternative.get('words'):
+        segment.segmentStartTime = google_time(best_alternative['words'][0]['startTime'])
+        for word in best_alternative['words']:
+            segment.add_word(word['word'], float(word.get('confidence', confidence)), google_time(word['startTime']),
+                             google_time(word['endTime']))
+    else:
+        # Without word time offsets the whole transcript is written as one word with the result's confidence
+        segment.add_word(best_alternative['transcript'].strip(), confidence, segment.segmentStartTime,
+                         segment.segmentEndTime)
+    return segment
 
-    :param document: Document to write the text to
-    :param text_label: Header text to write out
-    :return:
+def create_google_segments(results, speakers=False, stats=None, languages=None):
     """
-    document.add_heading(text_label, level=3)
+    Creates the per-turn speech segments of a speech-to-text response, in the same model that
+    create_turn_by_turn_segments() builds from Transcribe JSON, reading each result only once
+
+    :param results: Results of the response, such as from iter_results()
+    :param speakers: (optional) Whether the response is diarized, when only its final result is used
+    :param stats: (optional) TranscriptStats to add each segment to as it is completed
+    :param languages: (optional) Dictionary that receives the results' language codes, in the order first seen
+    :return: List of speech segments
+    """
+    words = TranscriptWords()
+    speech_segments = []
+    last_result = None
+    last_end_time = 0.0
+    for result in results:
+        if languages is not None and result.get('languageCode'):
+            languages[result['languageCode']] = None
+        if speakers:
+            # Only the final result is needed, so the earlier ones are dropped as they are read
+            last_result = result
+            continue
+        segment = create_result_segment(result, words, last_end_time)
+        if segment is not None:
+            speech_segments.append(segment)
+            if stats is not None:
+                stats.add_segment(segment)
+            last_end_time = segment.segmentEndTime
+    if speakers:
+        speech_segments = create_speaker_segments(last_result, words, stats)
+    return speech_segments
 
 def main():
     parser = argparse.ArgumentParser('Print formatted transcipts from a speech-to-text JSON response.')
@@ -162,71 +126,24 @@ def main():
     parser.add_argument('-o', '--outputFile', metavar='outputFile', type=str, help='Output DOCX file')
     args = parser.parse_args()
 
-    document = Document()
-    document.sections[0].left_margin = Mm(19.1)
-    document.sections[0].right_margin = Mm(19.1)
-    document.sections[0].top_margin = Mm(19.1)
-    document.sections[0].bottom_margin = Mm(19.1)
-    document.sections[0].page_width = Mm(210)
-    document.sections[0].page_height = Mm(297)
-
-    # Open response file and load JSON results
-    if urlparse(args.file).scheme == 'gs':
-        response_file = download_blob(args.file)
-        response = json.loads(response_file)
-    else:
-        with open(args.file) as f:
-            response = json.load(f)
-
-    # Intro header
-    write_custom_text_header(document, "Indiana University Social Science Research Commons")
-
-    write_custom_text_header(document, "Google Cloud Transcribe Audio Source")
-    table = document.add_table(rows=1, cols=2)
-    table.style = document.styles[TABLE_STYLE_STANDARD]
-    table.alignment = WD_ALIGN_PARAGRAPH.LEFT
-    table.autofit = False
-    table.allow_autofit = False
-    table.columns[0].width = Inches(2.0)
-    table.columns[1].width = Inches(2.0)
-    hdr_cells = table.rows[0].cells
-    hdr_cells[0].text = "Job Name"
-    hdr_cells[1].text = os.path.basename(__file__)
-    job_data = []
-    if 'results' in response and len(response['results']) > 0:
-        last_result = response['results'][-2]
-        dur_text = last_result.get('resultEndTime', "00:00:00")
-        job_data.append({"name": "Audio Duration", "value": dur_text})
-    if args.speakers:
-        job_data.append({"name": "Audio Identification", "value": "Speaker-separated"})
-    else:
-        job_data.append({"name": "Audio Identification", "value": "Channel-separated"})
-    if 'results' in response and len(response['results']) > 0:
-        languages = set()
-        for result in response['results']:
-            languages.add(result.get('languageCode', ""))
-        job_data.append({"name": "Language(s)", "value": ', '.join(filter(None, languages))})
-
-        total_confidence = 0
-        confidence_count = 0
-        for result in response.get('results', []):
-            for alternative in result.get('alternatives', []):
-                for word in alternative.get('words', []):
-                    total_confidence += word.get('confidence', 0)
-                    confidence_count += 1
-        average_confidence = (total_confidence / confidence_count) * 100
-        job_data.append({"name": "Average Confidence", "value": f"{average_confidence:.2f}%"})
-
-    for next_row in job_data:
-        row_cells = table.add_row().cells
-        row_cells[0].text = next_row["name"]
-        row_cells[1].text = next_row["value"]
-
-    print_transcript(response, document, args.speakers)
+    # The segments are built as the response is read
+    stats = TranscriptStats()
+    languages = {}
+    with open_response(args.file) as f:
+        try:
+            speech_segments = create_google_segments(iter_results(f), args.speakers, stats, languages)
+        except ValueError as e:
+            print(e)
+            sys.exit(1)
+
+    # The renderer only needs the job name and mode, as for a transcript sidecar
+    data = {"jobName": os.path.basename(args.file), "source": SOURCE_GOOGLE,
+            "results": {"speaker_labels": {}} if args.speakers else {"channel_labels": {}}}
+    job_info = {"language_codes": [{"language_code": code} for code in languages]}
 
     if args.outputFile is None:
         args.outputFile = args.file + ".docx"
-    document.save(args.outputFile)
+    write(data, speech_segments, job_info, args.outputFile, stats=stats)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,103 @@
+import io
+import json
+import os
+import sys
+import unittest
+
+# The parser imports google-cloud-storage for gs:// responses, so it has to be installed to run these, and the
+# converter renders with the Amazon Transcribe one
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "aws", "src", "lambda", "docx"))
+target = __import__("sttparser")
+converter = __import__("sttparser_to_docx")
+
+def result(transcript, end_time, confidence=0.9876543):
+    words = [{"word": word, "startTime": f"{end_time - 1 + i / 10:.1f}s",
+              "endTime": f"{end_time - 1 + (i + 1) / 10:.1f}s"} for i, word in enumerate(transcript.split())]
+    return {"alternatives": [{"transcript": transcript, "confidence": confidence, "words": words}],
+            "resultEndTime": f"{end_time}s", "languageCode": "en-us"}
+
+class TestReader(unittest.TestCase):
+    def setUp(self):
+        self.read_size = target.READ_SIZE
+
+    def tearDown(self):
+        target.READ_SIZE = self.read_size
+
+    def results(self, text):
+        return list(target.iter_results(io.StringIO(text)))
+
+    def test_round_trip(self):
+        # Reads far shorter than a result split its strings, escapes and numbers, which are joined back together
+        results = [result("hello \"world\" été", 1.5), result("second line", 12345),
+                   {"alternatives": [{}], "resultEndTime": "12346s"}]
+        response = {"requestId": 1234567890, "results": results, "totalBilledTime": "12346s",
+                    "speechAdaptationInfo": {"adaptationTimeout": False, "timeoutMessage": ""}}
+        for indent in (None, 2):
+            text = json.dumps(response, indent=indent, ensure_ascii=False)
+            for read_size in (1, 3, 7, 1024 * 1024):
+                target.READ_SIZE = read_size
+                self.assertEqual(self.results(text), results)
+
+    def test_no_results(self):
+        target.READ_SIZE = 2
+        self.assertEqual(self.results('{}'), [])
+        self.assertEqual(self.results(' {"results": [ ] } '), [])
+        self.assertEqual(self.results('{"totalBilledTime": "0s", "requestId": 12}'), [])
+
+        # Only a list under "results" is read as the results
+        self.assertEqual(self.results('{"results": null, "other": {"results": [1]}}'), [])
+
+    def test_malformed_response(self):
+        target.READ_SIZE = 3
+        for text in ('', '[{"alternatives": []}]', '{"results": [{"a": 1} {"b": 2}]}', '{"results": [{"a": 1}',
+                     '{"results": [{"a": tru', '{"results" [] }'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    self.results(text)
+
+def speaker_word(word, speaker, start):
+    return {"word": word, "speakerTag": speaker, "startTime": f"{start}s", "endTime": f"{start + 0.5}s",
+            "confidence": 0.5}
+
+class TestSegments(unittest.TestCase):
+    def test_times(self):
+        self.assertEqual(converter.google_time("83.450s"), 83.45)
+        self.assertEqual(converter.google_time("2"), 2.0)
+        self.assertEqual(target.timestamp("3725s"), "01:02:05")
+        self.assertEqual(target.timestamp("83.45678s"), "00:01:23.456")
+
+    def test_result_segments(self):
+        stats = converter.TranscriptStats()
+        languages = {}
+        untimed = {"alternatives": [{"transcript": " no word times ", "confidence": 0.75}], "resultEndTime": "20s",
+                   "channelTag": 2, "languageCode": "fr-fr"}
+        results = [result("hello world", 3), {"alternatives": [{}], "resultEndTime": "10s"}, untimed]
+        segments = converter.create_google_segments(iter(results), stats=stats, languages=languages)
+
+        self.assertEqual([segment.segmentText for segment in segments], ["hello world", "no word times"])
+        self.assertEqual([(segment.segmentStartTime, segment.segmentEndTime) for segment in segments],
+                         [(2.0, 3.0), (3.0, 20.0)])
+        self.assertEqual([segment.segmentSpeaker for segment in segments], ["", "Channel 2"])
+        self.assertEqual(list(languages), ["en-us", "fr-fr"])
+        self.assertEqual(stats.wordCount, 3)
+
+    def test_speaker_segments(self):
+        # Only the final result of a diarized response is used, and a new segment starts with each change of speaker
+        final = {"alternatives": [{"transcript": "a b c d", "confidence": 0.9,
+                                   "words": [speaker_word("a", 1, 0), speaker_word("b", 1, 1),
+                                             speaker_word("c", 2, 2), speaker_word("d", 1, 3)]}]}
+        stats = converter.TranscriptStats()
+        segments = converter.create_google_segments(iter([result("a b", 2), final]), speakers=True, stats=stats)
+        self.assertEqual([(segment.segmentSpeaker, segment.segmentText) for segment in segments],
+                         [("spk_0", "a b"), ("spk_1", "c"), ("spk_0", "d")])
+        self.assertEqual([(segment.segmentStartTime, segment.segmentEndTime) for segment in segments],
+                         [(0.0, 1.5), (2.0, 2.5), (3.0, 3.5)])
+        self.assertEqual(stats.wordCount, 4)
+
+        with self.assertRaises(ValueError):
+            converter.create_google_segments(iter([result("a b", 2)]), speakers=True)
+        with self.assertRaises(ValueError):
+            converter.create_google_segments(iter([]), speakers=True)
+
+if __name__ == '__main__':
+    unittest.main()